@@ -0,0 +1,325 @@
+"""
+In-memory stand-in for the parts of the Firestore client used by calc.py and importSerial.py.
+
+Every call that would be a network round trip (document get/set/update, a query stream,
+get_all, a batch commit) sleeps for `latency` seconds, so benchmarks can show how the code
+behaves against a slow backend without touching a real project. Counters record round
+trips and document reads/writes.
+
+Collections and where() queries support on_snapshot: listeners get the matching documents
+as ADDED straight away, then one change per write that touches a matching document. Unlike
+the real client the callbacks run synchronously on the writing thread. `listen_reads`
+counts the document changes delivered to listeners, which Firestore bills as reads.
+"""
+
+import copy
+import threading
+import time
+
+
+class NotFound(Exception):
+    """Raised by update() on a missing document, like google.api_core.exceptions.NotFound."""
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.copy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+
+class FakeChange:
+    class _Type:
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, kind, document):
+        self.type = FakeChange._Type(kind)
+        self.document = document
+
+
+class FakeWatch:
+    def __init__(self, client, collection, callback):
+        self._client = client
+        self._collection = collection
+        self._callback = callback
+
+    def unsubscribe(self):
+        with self._client.lock:
+            listeners = self._client.listeners.get(self._collection, [])
+            if self._callback in listeners:
+                listeners.remove(self._callback)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.collection_name = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def _docs(self):
+        return self._client.data.setdefault(self.collection_name, {})
+
+    def get(self):
+        self._client._round_trip(reads=1)
+        data = self._docs().get(self.id)
+        return FakeSnapshot(self, copy.copy(data) if data is not None else None)
+
+    def set(self, fields, merge=False):
+        self._client._round_trip(writes=1)
+        self._apply_set(fields, merge)
+
+    def update(self, fields):
+        self._client._round_trip(writes=1)
+        self._apply_update(fields)
+
+    def delete(self):
+        self._client._round_trip(writes=1)
+        self._apply_delete()
+
+    def _apply_set(self, fields, merge=False):
+        with self._client.lock:
+            existed = self.id in self._docs()
+            if merge and existed:
+                self._docs()[self.id].update(fields)
+            else:
+                self._docs()[self.id] = dict(fields)
+        self._client._notify(self, 'MODIFIED' if existed else 'ADDED')
+
+    def _apply_update(self, fields):
+        with self._client.lock:
+            if self.id in self._client.fail_ids:
+                raise RuntimeError(f"injected write failure for {self.path}")
+            if self.id not in self._docs():
+                raise NotFound(f"No document to update: {self.path}")
+            self._docs()[self.id].update(fields)
+        self._client._notify(self, 'MODIFIED')
+
+    def _apply_delete(self):
+        with self._client.lock:
+            existed = self._docs().pop(self.id, None) is not None
+        if existed:
+            self._client._notify(self, 'REMOVED')
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+class FakeQuery:
+    def __init__(self, client, collection, orders=(), cursor=None, limit=None, filters=()):
+        self._client = client
+        self._collection = collection
+        self._orders = list(orders)
+        self._cursor = cursor
+        self._limit = limit
+        self._filters = list(filters)
+
+    def _copy(self, **changes):
+        args = dict(orders=self._orders, cursor=self._cursor, limit=self._limit, filters=self._filters)
+        args.update(changes)
+        return FakeQuery(self._client, self._collection, **args)
+
+    def order_by(self, field):
+        return self._copy(orders=self._orders + [field])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, fields):
+        return self._copy(cursor=fields)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + [(field, _OPERATORS[op], value)])
+
+    def _matches(self, data):
+        # Like Firestore, a document missing a filtered field never matches
+        return data is not None and all(
+            field in data and data[field] is not None and compare(data[field], value)
+            for field, compare, value in self._filters)
+
+    def _sort_key(self, doc_id, data):
+        key = []
+        for field in self._orders:
+            if field == '__name__':
+                key.append(doc_id)
+            elif field in data:
+                key.append(data[field])
+            else:
+                return None  # Firestore leaves out documents missing an order_by field
+        return tuple(key)
+
+    def stream(self):
+        with self._client.lock:
+            rows = list(self._client.data.get(self._collection, {}).items())
+        rows = [(doc_id, data) for doc_id, data in rows if self._matches(data)]
+        if self._orders:
+            keyed = [(self._sort_key(doc_id, data), doc_id, data) for doc_id, data in rows]
+            keyed = sorted((row for row in keyed if row[0] is not None), key=lambda row: row[0])
+            if self._cursor is not None:
+                cursor = tuple(self._cursor[field] for field in self._orders[:len(self._cursor)])
+                keyed = [row for row in keyed if row[0][:len(cursor)] > cursor]
+            rows = [(doc_id, data) for _, doc_id, data in keyed]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        self._client._round_trip(reads=len(rows))
+        for doc_id, data in rows:
+            ref = FakeDocumentReference(self._client, self._collection, doc_id)
+            yield FakeSnapshot(ref, copy.copy(data))
+
+    def on_snapshot(self, callback):
+        """
+        Listen to the documents matching this query's filters (order_by/limit are ignored).
+
+        A document that stops matching is delivered as REMOVED and one that starts matching
+        as ADDED, like the real client. Every delivered change counts as a listen read.
+        """
+        client = self._client
+        members = set()
+
+        def deliver(snapshots, changes, read_time, initial=False):
+            delivered = []
+            for change in changes:
+                doc_id = change.document.id
+                matches = change.type.name != 'REMOVED' and self._matches(change.document._data)
+                if matches:
+                    kind = 'MODIFIED' if doc_id in members else 'ADDED'
+                    members.add(doc_id)
+                elif doc_id in members:
+                    kind = 'REMOVED'
+                    members.discard(doc_id)
+                else:
+                    continue
+                delivered.append(FakeChange(kind, change.document))
+            if not delivered and not initial:
+                return  # the first snapshot is delivered even when nothing matches
+            with client.lock:
+                client.listen_reads += len(delivered)
+            callback([change.document for change in delivered], delivered, read_time)
+
+        with client.lock:
+            client.listeners.setdefault(self._collection, []).append(deliver)
+            rows = list(client.data.get(self._collection, {}).items())
+        snapshots = [FakeSnapshot(FakeDocumentReference(client, self._collection, doc_id), copy.copy(data))
+                     for doc_id, data in rows]
+        deliver(snapshots, [FakeChange('ADDED', snapshot) for snapshot in snapshots], None, initial=True)
+        return FakeWatch(client, self._collection, deliver)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self._client, self.id, doc_id)
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, ref, fields, merge=False):
+        self._ops.append(('set', ref, fields, merge))
+
+    def update(self, ref, fields):
+        self._ops.append(('update', ref, fields, False))
+
+    def delete(self, ref):
+        self._ops.append(('delete', ref, None, False))
+
+    def commit(self):
+        self._client._round_trip(writes=len(self._ops))
+        # All-or-nothing like a real batch: check everything before applying anything
+        with self._client.lock:
+            for op, ref, _, _ in self._ops:
+                if ref.id in self._client.fail_ids:
+                    raise RuntimeError(f"injected write failure for {ref.path}")
+                if op == 'update' and ref.id not in ref._docs():
+                    raise NotFound(f"No document to update: {ref.path}")
+        for op, ref, fields, merge in self._ops:
+            if op == 'set':
+                ref._apply_set(fields, merge)
+            elif op == 'update':
+                ref._apply_update(fields)
+            else:
+                ref._apply_delete()
+        self._ops = []
+
+
+class FakeFirestore:
+    """
+    Args:
+        latency: Seconds each round trip takes
+        data: Optional initial contents as {collection: {doc_id: fields}}
+    """
+
+    def __init__(self, latency=0.0, data=None):
+        self.latency = latency
+        self.data = data if data is not None else {}
+        self.lock = threading.Lock()
+        self.fail_ids = set()  # document ids whose writes fail, for error-path tests
+        self.listeners = {}    # collection -> [on_snapshot callbacks]
+        self.round_trips = 0
+        self.reads = 0
+        self.writes = 0
+        self.listen_reads = 0
+
+    def _round_trip(self, reads=0, writes=0):
+        with self.lock:
+            self.round_trips += 1
+            self.reads += reads
+            self.writes += writes
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _notify(self, reference, kind):
+        with self.lock:
+            listeners = list(self.listeners.get(reference.collection_name, ()))
+            data = self.data.get(reference.collection_name, {}).get(reference.id)
+        if not listeners:
+            return
+        snapshot = FakeSnapshot(reference, copy.copy(data) if kind != 'REMOVED' else None)
+        for callback in listeners:
+            callback([snapshot], [FakeChange(kind, snapshot)], None)
+
+    def put(self, collection, doc_id, fields):
+        """Set a document without a round trip (not counted), e.g. to feed readings into a benchmark."""
+        FakeDocumentReference(self, collection, doc_id)._apply_set(fields)
+
+    def reset_counters(self):
+        self.round_trips = self.reads = self.writes = self.listen_reads = 0
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        collection, doc_id = path.split('/')
+        return FakeDocumentReference(self, collection, doc_id)
+
+    def collections(self):
+        return [FakeCollectionReference(self, name) for name in self.data]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def get_all(self, references):
+        references = list(references)
+        self._round_trip(reads=len(references))
+        for ref in references:
+            data = ref._docs().get(ref.id)
+            yield FakeSnapshot(ref, copy.copy(data) if data is not None else None)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark: bytes per monitored user for the dict-of-User roster used by
+continuously_monitor_uv_updates versus the compact UserRegistry used by
+monitor_uv_updates_compact.
+
+Usage:
+    python benchmarks/registry_memory.py [--sizes 100000 1000000] [--legacy-max 100000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'riskCalculation'))
+
+from calc import User, get_baseline_code
+from user_registry import UserRegistry
+
+LOCATIONS = ['default_location'] + [f'location_{i}' for i in range(99)]
+
+
+def make_inputs(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        # Firebase auth uids are 28 characters long
+        yield (f"uid{i:025d}", rng.randint(1, 6), rng.randint(0, 90), rng.randint(0, 5),
+               rng.choice(LOCATIONS))
+
+
+def build_legacy_roster(count):
+    """Same shape as load_monitored_users (minus the DocumentReference, which would only add to it)."""
+    user_objects = {}
+    for user_id, phototype, age, severity_score, location in make_inputs(count):
+        user_objects[user_id] = {
+            'user': User(phototype, age, severity_score, location=location),
+            'doc_ref': None,
+            'location': location
+        }
+    return user_objects
+
+
+def build_registry(count):
+    registry = UserRegistry()
+    now = time.time()
+    for user_id, phototype, age, severity_score, location in make_inputs(count):
+        registry.add(user_id, get_baseline_code(phototype, age, severity_score), location, 0, now)
+    return registry
+
+
+def measure(build, count):
+    tracemalloc.start()
+    roster = build(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, roster
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per monitored user for each roster layout.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help="skip the dict-of-User roster above this many users (it needs ~0.7 KB per user)")
+    args = parser.parse_args()
+
+    print(f"{'users':>10}  {'layout':<16} {'total MB':>10} {'bytes/user':>11} {'array bytes/user':>17}")
+    print("-" * 70)
+    for count in args.sizes:
+        if count <= args.legacy_max:
+            total, roster = measure(build_legacy_roster, count)
+            print(f"{count:>10}  {'dict of User':<16} {total / 1e6:>10.1f} {total / count:>11.0f} {'-':>17}")
+            del roster
+        total, registry = measure(build_registry, count)
+        print(f"{count:>10}  {'UserRegistry':<16} {total / 1e6:>10.1f} {total / count:>11.0f} "
+              f"{registry.nbytes() / count:>17.0f}")
+        del registry
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Load generator for the monitor: record or synthesize UV streams and replay them on a simulated clock.
+
+Streams are stored in the compact format of uv_streams.py. A replay drives either the
+real continuously_monitor_uv_updates loop or User.recalculate_risk_score directly against
+the in-memory FakeFirestore, with the time module of the monitor code swapped for a
+simulated clock: the monitor's one-second sleeps return immediately after feeding every
+reading that is due, so hours of readings replay in seconds or minutes of wall time.
+
+Targets:
+    monitor: continuously_monitor_uv_updates (poll mode, live roster, UV cache, write
+             coalescer), reading the replayed uv_intensity documents every simulated second
+    users:   recalculate_risk_score for the users at a reading's location, once per reading
+             (the event-driven path, without Firestore reads or writes)
+
+Usage:
+    python benchmarks/replay_load.py generate streams.uvs [--locations 1000] [--hours 8]
+    python benchmarks/replay_load.py record-serial streams.uvs [--port COM7 ...] [--seconds 600]
+    python benchmarks/replay_load.py record-firestore streams.uvs [--seconds 600]
+    python benchmarks/replay_load.py replay streams.uvs [--target monitor] [--users 2000] [--speed 100]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(repo_root, 'riskCalculation'))
+sys.path.append(os.path.join(repo_root, 'penapps_optSun'))
+
+import calc
+import uv_cache
+import uv_dose
+import write_coalescer
+from fake_firestore import FakeFirestore
+from monitor_metrics import METRICS
+from run_benchmarks import make_users, quiet
+from uv_streams import generate_streams, read_stream, record_firestore, record_serial
+
+# Modules whose `time` is replaced by the simulated clock during a replay
+SIMULATED_MODULES = (calc, uv_cache, uv_dose, write_coalescer)
+RECALCULATION_REASONS = ('uv_delta', 'timer', 'dose')
+
+
+class ReplayFinished(KeyboardInterrupt):
+    """Raised from the simulated sleep() once the stream is used up; the monitor loops stop on KeyboardInterrupt."""
+
+
+class SimulatedClock:
+    """
+    Stand-in for the time module. time() returns the simulated time, sleep() advances it,
+    and everything else (mktime, perf_counter, monotonic, ...) is the real time module.
+
+    Args:
+        start_time: Simulated time to start at (seconds since the epoch)
+        speed: If set, sleep() really waits so the replay runs at most this many times
+               faster than real time; None replays as fast as the code under test allows
+        on_advance: Called with the new time whenever the clock moves
+    """
+
+    def __init__(self, start_time, speed=None, on_advance=None):
+        self.now = start_time
+        self.start_time = start_time
+        self.speed = speed
+        self.on_advance = on_advance
+        self._wall_start = time.perf_counter()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(self.now + max(0.0, seconds))
+
+    def advance(self, to):
+        self.now = max(self.now, to)
+        if self.speed:
+            ahead = (self.now - self.start_time) / self.speed - (time.perf_counter() - self._wall_start)
+            if ahead > 0:
+                time.sleep(ahead)
+        if self.on_advance is not None:
+            self.on_advance(self.now)
+
+    def localtime(self, secs=None):
+        return time.localtime(self.now if secs is None else secs)
+
+    def strftime(self, format, t=None):
+        return time.strftime(format, self.localtime() if t is None else t)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@contextlib.contextmanager
+def simulated_time(clock):
+    """Swap the time module of the monitor code for clock while the block runs."""
+    saved = [(module, module.time) for module in SIMULATED_MODULES]
+    for module in SIMULATED_MODULES:
+        module.time = clock
+    try:
+        yield clock
+    finally:
+        for module, original in saved:
+            module.time = original
+
+
+class StreamFeeder:
+    """Writes the readings of a stream into uv_intensity as the simulated clock reaches them."""
+
+    def __init__(self, readings, client):
+        self.readings = readings
+        self.client = client
+        self.position = 0
+
+    def feed_until(self, now):
+        if self.position >= len(self.readings):
+            raise ReplayFinished()
+        readings = self.readings
+        while self.position < len(readings) and readings[self.position][0] <= now:
+            timestamp, location, uv = readings[self.position]
+            self.client.put('uv_intensity', location, {'value': uv, 'timestamp': timestamp})
+            self.position += 1
+
+
+def recalculation_counts():
+    return {reason: METRICS.get('risk_recalculations_total', reason=reason) for reason in RECALCULATION_REASONS}
+
+
+def replay_into_monitor(readings, start_time, client, speed=None):
+    """
+    Run continuously_monitor_uv_updates against client until the stream is used up.
+
+    Returns:
+        dict: Category of every user at the end ('category_counts') and the replay's clock
+    """
+    clock = SimulatedClock(start_time, speed)
+    feeder = StreamFeeder(readings, client)
+    feeder.feed_until(start_time)
+    clock.on_advance = feeder.feed_until
+    calc._db = client
+    # The monitor's write-ahead log goes to a scratch directory (its writes are drained on exit)
+    with tempfile.TemporaryDirectory() as write_queue_dir, simulated_time(clock), quiet():
+        calc.WRITE_QUEUE_DIR = write_queue_dir
+        calc.continuously_monitor_uv_updates()
+    categories = {}
+    for user_info in client.data['users'].values():
+        category = user_info.get('final_risk_category')
+        categories[category] = categories.get(category, 0) + 1
+    return {'clock': clock, 'category_counts': categories, 'readings_fed': feeder.position}
+
+
+def replay_into_users(readings, start_time, client, speed=None):
+    """
+    Call recalculate_risk_score for every user at a reading's location, reading by reading.
+
+    Returns:
+        dict: Category of every user at the end ('category_counts') and the replay's clock
+    """
+    clock = SimulatedClock(start_time, speed)
+    with simulated_time(clock):
+        with quiet():
+            user_objects = calc.load_monitored_users(client)
+        by_location = {}
+        for user_data in user_objects.values():
+            by_location.setdefault(user_data['location'], []).append(user_data['user'])
+        for timestamp, location, uv in readings:
+            clock.advance(timestamp)
+            for user in by_location.get(location, ()):
+                user.recalculate_risk_score(uv)
+    categories = {}
+    for user_data in user_objects.values():
+        user = user_data['user']
+        category = calc.classify_final_ers(user.risk_score) if user.risk_score else None
+        categories[category] = categories.get(category, 0) + 1
+    return {'clock': clock, 'category_counts': categories, 'readings_fed': len(readings)}
+
+
+def replay(path, target='monitor', user_count=2000, speed=None, seed=0):
+    """
+    Replay a stream file into the chosen target with user_count synthetic users spread over its locations.
+
+    Returns:
+        dict: Simulated and wall time, the speedup, recalculations, Firestore traffic and
+              the final category distribution
+    """
+    start_time, locations, readings = read_stream(path)
+    if not readings:
+        raise ValueError(f"{path} has no readings")
+    client = FakeFirestore(data={'users': make_users(user_count, seed, locations=locations), 'uv_intensity': {}})
+    recalculations_before = recalculation_counts()
+    wall_start = time.perf_counter()
+    run = (replay_into_monitor if target == 'monitor' else replay_into_users)(readings, start_time, client, speed)
+    wall_seconds = time.perf_counter() - wall_start
+    simulated_seconds = run['clock'].now - start_time
+    recalculations = {reason: count - recalculations_before[reason]
+                      for reason, count in recalculation_counts().items()}
+    return {
+        'stream': path,
+        'target': target,
+        'users': user_count,
+        'locations': len(locations),
+        'readings': run['readings_fed'],
+        'simulated_seconds': simulated_seconds,
+        'wall_seconds': wall_seconds,
+        'speedup': simulated_seconds / wall_seconds if wall_seconds else float('inf'),
+        'recalculations': recalculations,
+        'firestore_reads': client.reads,
+        'firestore_writes': client.writes,
+        'round_trips': client.round_trips,
+        'category_counts': {str(category): count for category, count in run['category_counts'].items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record, generate and replay UV streams against the monitor.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="write a synthetic stream")
+    generate_parser.add_argument('path')
+    generate_parser.add_argument('--locations', type=int, default=1000)
+    generate_parser.add_argument('--hours', type=float, default=8.0)
+    generate_parser.add_argument('--interval', type=float, default=5.0, help="seconds between samples per location")
+    generate_parser.add_argument('--seed', type=int, default=0)
+
+    serial_parser = subparsers.add_parser('record-serial', help="record armband readings from serial ports")
+    serial_parser.add_argument('path')
+    serial_parser.add_argument('--port', action='append', default=[], help="serial port (repeatable; default: discover)")
+    serial_parser.add_argument('--seconds', type=float, default=600)
+
+    firestore_parser = subparsers.add_parser('record-firestore', help="record uv_intensity changes from Firestore")
+    firestore_parser.add_argument('path')
+    firestore_parser.add_argument('--seconds', type=float, default=600)
+
+    replay_parser = subparsers.add_parser('replay', help="replay a stream on a simulated clock")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--target', choices=['monitor', 'users'], default='monitor')
+    replay_parser.add_argument('--users', type=int, default=2000)
+    replay_parser.add_argument('--speed', type=float, default=None,
+                               help="cap the replay at this many times real time (default: as fast as possible)")
+    replay_parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        count = generate_streams(args.path, args.locations, args.hours, args.interval, seed=args.seed)
+        print(f"Wrote {count} readings for {args.locations} locations ({os.path.getsize(args.path)} bytes) to {args.path}")
+    elif args.command == 'record-serial':
+        count = record_serial(args.path, args.port, args.seconds)
+        print(f"Recorded {count} readings to {args.path}")
+    elif args.command == 'record-firestore':
+        count = record_firestore(args.path, calc.get_db(), args.seconds)
+        print(f"Recorded {count} readings to {args.path}")
+    else:
+        result = replay(args.path, args.target, args.users, args.speed)
+        print(f"Replayed {result['readings']} readings ({result['locations']} locations, {result['users']} users) "
+              f"into {result['target']}: {result['simulated_seconds']:.0f} simulated seconds in "
+              f"{result['wall_seconds']:.1f}s ({result['speedup']:.0f}x)")
+        print(f"  Recalculations: {result['recalculations']}")
+        print(f"  Firestore: {result['firestore_reads']} reads, {result['firestore_writes']} writes "
+              f"in {result['round_trips']} round trips")
+        print(f"  Final categories: {result['category_counts']}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+            print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the risk scoring backend and the serial bridge.
+
+Everything runs against the in-memory FakeFirestore, optionally with injected latency per
+round trip, and the results are written to a JSON file so runs from different versions
+can be diffed.
+
+Measures:
+    scoring:  calculate_final_erythemal_risk_score calls per second (and the batch scorer)
+    index:    UVThresholdIndex category-change queries against rescoring a whole location
+    backfill: add_risk_categories_to_users wall time at 1k/10k/100k users (per-user and bulk)
+    monitor:  p50/p99 tick duration and Firestore traffic of the continuously_monitor_uv_updates
+              tick with its RecalculationScheduler, writing directly and through the
+              WriteCoalescer, against a baseline that visits every user each tick
+    serial:   lines per second through the importSerial CSV reader stage, and frames per
+              second through the binary FrameDecoder
+    history:  UVHistoryStore appends per second and range-query latency over days of 1 Hz samples
+
+Usage:
+    python benchmarks/run_benchmarks.py [--quick] [--latency SECONDS] [--output FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(repo_root, 'riskCalculation'))
+sys.path.append(os.path.join(repo_root, 'penapps_optSun'))
+
+import calc
+import importSerial
+from fake_firestore import FakeFirestore
+from recalc_scheduler import RecalculationScheduler
+from sensor_protocol import FrameDecoder, encode_frame
+from uv_cache import UVCache
+from uv_history import UVHistoryStore
+from uv_threshold_index import UVThresholdIndex
+
+LOCATIONS = ['default_location'] + [f'location_{i}' for i in range(19)]
+
+
+def make_users(count, seed=0, locations=LOCATIONS):
+    rng = random.Random(seed)
+    return {
+        f"uid{i:025d}": {
+            'skinToneIndex': rng.randint(1, 6),
+            'age': str(rng.randint(10, 90)),  # the app stores age as a string
+            'conditionSeverity': rng.randint(0, 5),
+            'location': rng.choice(locations)
+        }
+        for i in range(count)
+    }
+
+
+def make_client(user_count, latency=0.0, seed=0):
+    rng = random.Random(seed)
+    return FakeFirestore(latency=latency, data={
+        'users': make_users(user_count, seed),
+        'uv_intensity': {location: {'value': rng.randint(0, 300)} for location in LOCATIONS}
+    })
+
+
+def quiet():
+    """The code under test prints per user; keep that out of the terminal (but not out of the timing)."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_scoring(count):
+    rng = random.Random(1)
+    users = [calc.User(rng.randint(1, 6), rng.randint(10, 90), rng.randint(0, 5), uv_intensity=rng.randint(0, 300))
+             for _ in range(count)]
+    start = time.perf_counter()
+    for user in users:
+        user.calculate_final_erythemal_risk_score()
+    elapsed = time.perf_counter() - start
+    result = {'calls': count, 'seconds': elapsed, 'calls_per_second': count / elapsed}
+
+    try:
+        from risk_batch import calculate_risk_scores_batch
+    except ImportError:
+        return result  # NumPy not installed
+    columns = [[rng.randint(1, 6) for _ in range(count)], [rng.randint(10, 90) for _ in range(count)],
+               [rng.randint(0, 5) for _ in range(count)], [rng.randint(0, 300) for _ in range(count)]]
+    start = time.perf_counter()
+    calculate_risk_scores_batch(*columns)
+    elapsed = time.perf_counter() - start
+    result['batch_rows_per_second'] = count / elapsed
+    return result
+
+
+def bench_threshold_index(user_count, moves=1000):
+    """Users whose category flips on a UV move at one location: index query vs rescoring everyone."""
+    rng = random.Random(4)
+    codes = [rng.randrange(len(calc.BASELINE_TABLE)) for _ in range(user_count)]
+    index = UVThresholdIndex(calc.final_category_breakpoints, calc.registry_final_category)
+    for row, code in enumerate(codes):
+        index.add(row, code)
+    pairs = [(rng.randint(0, 300), rng.randint(0, 300)) for _ in range(moves)]
+    start = time.perf_counter()
+    flipped = sum(len(index.changed(old_uv, new_uv)) for old_uv, new_uv in pairs)
+    index_seconds = time.perf_counter() - start
+    rescore_pairs = pairs[:max(1, moves // 100)]
+    start = time.perf_counter()
+    for old_uv, new_uv in rescore_pairs:
+        [row for row, code in enumerate(codes)
+         if calc.registry_final_category(code, old_uv) != calc.registry_final_category(code, new_uv)]
+    rescore_seconds = (time.perf_counter() - start) / len(rescore_pairs) * moves
+    return {
+        'users': user_count,
+        'moves': moves,
+        'mean_flipped': flipped / moves,
+        'index_queries_per_second': moves / index_seconds,
+        'rescore_queries_per_second': moves / rescore_seconds
+    }
+
+
+def bench_backfill(sizes, latency):
+    results = []
+    for size in sizes:
+        for bulk in (False, True):
+            client = make_client(size, latency)
+            start = time.perf_counter()
+            with quiet():
+                summary = calc.add_risk_categories_to_users(bulk=bulk, client=client)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'users': size,
+                'mode': 'bulk' if bulk else 'per_user',
+                'seconds': elapsed,
+                'users_per_second': size / elapsed,
+                'round_trips': client.round_trips,
+                'failed': len(summary['failed'])
+            })
+            print(f"  backfill {results[-1]['mode']:>8} {size:>7} users: {elapsed:8.2f}s "
+                  f"({client.round_trips} round trips)")
+    return results
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def bench_monitor_ticks(user_count, ticks, latency, coalesce=False, scheduled=True):
+    """
+    Ticks of run_monitor_tick as the poll monitor runs them (scheduled=True: a
+    RecalculationScheduler picks the users to visit), or visiting every user each tick
+    (scheduled=False, the baseline before the scheduler).
+    """
+    client = make_client(user_count, latency)
+    with quiet():
+        user_objects = calc.load_monitored_users(client)
+    scheduler = by_location = None
+    if scheduled:
+        scheduler = RecalculationScheduler()
+        scheduler.schedule_all(user_objects, time.time())
+        by_location = {}
+        for user_id, user_data in user_objects.items():
+            by_location.setdefault(user_data['location'], set()).add(user_id)
+    # Same TTL as the monitor; ticks run back to back here, so each one starts by dropping
+    # the previous tick's readings, like the monitor's one-second sleep would
+    uv_cache = UVCache(client, ttl=0.5)
+    coalescer = calc.new_write_coalescer(client) if coalesce else None
+    monitored_locations = {user_data['location'] for user_data in user_objects.values()}
+    rng = random.Random(2)
+    durations = []
+    updates = 0
+    client.reset_counters()
+    for _ in range(ticks):
+        # Random walk per location so some users cross the 100-unit threshold each tick
+        for location_doc in client.data['uv_intensity'].values():
+            location_doc['value'] = max(0, location_doc['value'] + rng.randint(-60, 60))
+        uv_cache.invalidate()
+        start = time.perf_counter()
+        with quiet():
+            updates += calc.run_monitor_tick(user_objects, uv_cache, monitored_locations, time.strftime('%H:%M:%S'),
+                                             coalescer, scheduler, by_location)
+        durations.append(time.perf_counter() - start)
+    return {
+        'users': user_count,
+        'ticks': ticks,
+        'coalesced': coalesce,
+        'scheduled': scheduled,
+        'p50_seconds': percentile(durations, 50),
+        'p99_seconds': percentile(durations, 99),
+        'mean_seconds': statistics.mean(durations),
+        'writes': updates,
+        'documents_read': client.reads,
+        'documents_written': client.writes,
+        'round_trips': client.round_trips
+    }
+
+
+class _ReplaySerial:
+    """Serial port stand-in that replays encoded lines, then stops the reader."""
+
+    def __init__(self, lines, stop_event):
+        self._lines = iter(lines)
+        self._stop_event = stop_event
+
+    def readline(self):
+        try:
+            return next(self._lines)
+        except StopIteration:
+            self._stop_event.set()
+            return b''
+
+
+def bench_serial_parse(line_count):
+    rng = random.Random(3)
+    lines = [f"{raw},{raw / 100:.2f},{rng.randint(0, 1)}\r\n".encode('utf-8')
+             for raw in (rng.randint(0, 1023) for _ in range(line_count))]
+    samples = queue.Queue()
+    stop_event = threading.Event()
+    start = time.perf_counter()
+    importSerial.read_samples(_ReplaySerial(lines, stop_event), samples, stop_event)
+    elapsed = time.perf_counter() - start
+    result = {'lines': line_count, 'seconds': elapsed, 'lines_per_second': line_count / elapsed,
+              'samples': samples.qsize()}
+
+    # Same readings as binary frames, fed to the decoder in 4 KB reads like read_frames does
+    stream = b''.join(encode_frame(sequence, rng.randint(0, 1023), rng.randint(0, 1100) / 100, rng.randint(0, 1))
+                      for sequence in range(line_count))
+    decoder = FrameDecoder()
+    decoded = 0
+    start = time.perf_counter()
+    for offset in range(0, len(stream), 4096):
+        decoded += len(decoder.feed(stream[offset:offset + 4096]))
+    elapsed = time.perf_counter() - start
+    result['frames_per_second'] = decoded / elapsed
+    result['bytes_per_sample'] = {'csv': sum(map(len, lines)) / line_count, 'binary': len(stream) / line_count}
+    return result
+
+
+def bench_history(days, queries=200):
+    """One armband at 1 Hz for days, then aggregate() over random ranges from ten minutes to every day."""
+    rng = random.Random(5)
+    directory = tempfile.mkdtemp()
+    try:
+        store = UVHistoryStore(directory)
+        start_time = 1700000000.0
+        sample_count = days * 86400
+        start = time.perf_counter()
+        for i in range(sample_count):
+            uv_raw = rng.randint(0, 1023)
+            store.append('armband', (start_time + i, uv_raw, uv_raw / 100, i % 60 == 0))
+        append_seconds = time.perf_counter() - start
+        result = {'days': days, 'samples': sample_count, 'appends_per_second': sample_count / append_seconds,
+                  'query_p50_seconds': {}, 'query_p99_seconds': {}}
+        for span in (600, 86400, sample_count):
+            durations = []
+            for _ in range(queries):
+                query_start = start_time + rng.uniform(0, sample_count - span)
+                start = time.perf_counter()
+                store.aggregate('armband', query_start, query_start + span)
+                durations.append(time.perf_counter() - start)
+            result['query_p50_seconds'][span] = percentile(durations, 50)
+            result['query_p99_seconds'][span] = percentile(durations, 99)
+        store.close()
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_root,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scoring, backfill, monitor ticks and serial parsing.")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes for a fast sanity run")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every fake Firestore round trip")
+    parser.add_argument('--monitor-users', type=int, default=1000)
+    parser.add_argument('--ticks', type=int, default=100)
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the JSON results")
+    args = parser.parse_args()
+
+    backfill_sizes = [1000, 10000] if args.quick else [1000, 10000, 100000]
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'latency_seconds': args.latency,
+    }
+
+    print("Scoring throughput...")
+    results['scoring'] = bench_scoring(20000 if args.quick else 200000)
+    print(f"  {results['scoring']['calls_per_second']:,.0f} calls/s")
+
+    print("Category-change queries...")
+    results['index'] = bench_threshold_index(10000 if args.quick else 100000)
+    print(f"  {results['index']['index_queries_per_second']:,.0f} index queries/s vs "
+          f"{results['index']['rescore_queries_per_second']:,.1f} full rescores/s "
+          f"({results['index']['users']} users, {results['index']['mean_flipped']:.0f} flipped per move)")
+
+    print("Backfill wall time...")
+    results['backfill'] = bench_backfill(backfill_sizes, args.latency)
+
+    print("Monitor tick duration...")
+    results['monitor'] = [bench_monitor_ticks(args.monitor_users, 20 if args.quick else args.ticks, args.latency,
+                                              coalesce, scheduled)
+                          for coalesce, scheduled in ((False, False), (False, True), (True, True))]
+    for run in results['monitor']:
+        label = f"{'scheduled' if run['scheduled'] else 'full scan'}, {'coalesced' if run['coalesced'] else 'direct'}"
+        print(f"  {label:>20}: p50 {run['p50_seconds'] * 1000:.1f} ms, "
+              f"p99 {run['p99_seconds'] * 1000:.1f} ms, {run['documents_read']} documents read, "
+              f"{run['documents_written']} documents written "
+              f"in {run['round_trips']} round trips")
+
+    print("Serial line parsing...")
+    results['serial'] = bench_serial_parse(20000 if args.quick else 200000)
+    print(f"  {results['serial']['lines_per_second']:,.0f} CSV lines/s, "
+          f"{results['serial']['frames_per_second']:,.0f} binary frames/s decoded")
+
+    print("UV history range queries...")
+    results['history'] = bench_history(2 if args.quick else 30)
+    print(f"  {results['history']['appends_per_second']:,.0f} appends/s; "
+          + ", ".join(f"{span}s range p99 {seconds * 1000:.2f} ms"
+                      for span, seconds in results['history']['query_p99_seconds'].items())
+          + f" ({results['history']['samples']} samples)")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Compact UV stream files: recorded or synthetic (timestamp, location, uv) readings.
+
+Layout, little-endian:
+
+    header:  b'UVS1', start time as a float64 (seconds since the epoch)
+    records: uint32 milliseconds since the previous record, uint16 location index, uint16 uv
+             (8 bytes per reading)
+
+A record whose location index is 0xFFFF defines the next location instead: its uv field
+is the length of the UTF-8 name that follows. Locations are numbered in the order they
+are defined, so a recorder can add new ones as they show up.
+"""
+
+import math
+import os
+import queue
+import random
+import struct
+import sys
+import threading
+import time
+
+MAGIC = b'UVS1'
+HEADER = struct.Struct('<4sd')
+RECORD = struct.Struct('<IHH')
+DEFINE_LOCATION = 0xFFFF
+MAX_UV = 0xFFFF
+
+
+class StreamWriter:
+    """Append readings to a stream file. Readings must be written in time order."""
+
+    def __init__(self, path, start_time):
+        self.start_time = start_time
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, start_time))
+        self._locations = {}  # name -> index
+        self._last_ms = 0
+        self.count = 0
+
+    def write(self, timestamp, location, uv):
+        index = self._locations.get(location)
+        if index is None:
+            index = self._locations[location] = len(self._locations)
+            if index >= DEFINE_LOCATION:
+                raise ValueError(f"more than {DEFINE_LOCATION} locations in one stream")
+            name = location.encode('utf-8')
+            self._file.write(RECORD.pack(0, DEFINE_LOCATION, len(name)) + name)
+        offset_ms = max(self._last_ms, int(round((timestamp - self.start_time) * 1000)))
+        self._file.write(RECORD.pack(offset_ms - self._last_ms, index, max(0, min(MAX_UV, int(round(uv))))))
+        self._last_ms = offset_ms
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def read_stream(path):
+    """
+    Load a stream file.
+
+    Returns:
+        tuple: (start_time, locations, readings) where readings is a list of
+               (timestamp, location name, uv) in time order
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, start_time = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a UV stream file")
+    locations = []
+    readings = []
+    offset_ms = 0
+    pos = HEADER.size
+    while pos < len(data):
+        delta_ms, index, uv = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if index == DEFINE_LOCATION:
+            locations.append(data[pos:pos + uv].decode('utf-8'))
+            pos += uv
+            continue
+        offset_ms += delta_ms
+        readings.append((start_time + offset_ms / 1000, locations[index], uv))
+    return start_time, locations, readings
+
+
+def generate_streams(path, locations=1000, hours=8.0, interval=5.0, min_delta=5, seed=0, start_time=None):
+    """
+    Write a synthetic day of UV readings for many locations.
+
+    Each location follows a sine-shaped day (peak between 100 and 300, the range of the
+    uv_intensity documents) with clouds that come and go and a little sensor noise. A
+    reading is only written when it moved by at least min_delta since the last one for
+    that location, like a change-driven sensor.
+
+    Returns:
+        int: Number of readings written
+    """
+    rng = random.Random(seed)
+    if start_time is None:
+        # 09:00 today, so the stream covers the hours that matter for sunburn
+        t = time.localtime()
+        start_time = time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 9, 0, 0, 0, 0, -1))
+    duration = hours * 3600
+    names = [f"location_{i}" for i in range(locations)]
+    peaks = [rng.uniform(100, 300) for _ in names]
+    clouds = [1.0] * locations
+    last_written = [None] * locations
+    steps = int(duration // interval) + 1
+    with StreamWriter(path, start_time) as writer:
+        for step in range(steps):
+            elapsed = step * interval
+            daylight = max(0.0, math.sin(math.pi * elapsed / duration)) if duration else 1.0
+            for i in range(locations):
+                if rng.random() < interval / 600:  # weather changes every ~10 minutes
+                    clouds[i] = rng.choice((1.0, 1.0, 0.8, 0.5, 0.2))
+                uv = max(0, round(peaks[i] * daylight * clouds[i] + rng.gauss(0, 2)))
+                if last_written[i] is None or abs(uv - last_written[i]) >= min_delta:
+                    writer.write(start_time + elapsed, names[i], uv)
+                    last_written[i] = uv
+        return writer.count
+
+
+def record_serial(path, ports, duration, stop_event=None):
+    """
+    Record armband readings (uv_raw) from serial ports, with the bridge's reader threads.
+
+    Each device is recorded as a location named by its device id. Runs for duration
+    seconds or until stop_event is set.
+
+    Returns:
+        int: Number of readings written
+    """
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'penapps_optSun'))
+    import importSerial
+
+    stop_event = stop_event or threading.Event()
+    samples = queue.Queue(maxsize=importSerial.QUEUE_SIZE)
+    supervisor = threading.Thread(target=importSerial.supervise_readers, args=(ports, samples, stop_event),
+                                  daemon=True)
+    supervisor.start()
+    end_time = time.time() + duration
+    with StreamWriter(path, time.time()) as writer:
+        while time.time() < end_time and not stop_event.is_set():
+            try:
+                device_id, (timestamp, uv_raw, _, _) = samples.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            writer.write(timestamp, device_id, uv_raw)
+        stop_event.set()
+        supervisor.join(timeout=5)
+        return writer.count
+
+
+def record_firestore(path, client, duration):
+    """
+    Record every change to the uv_intensity collection for duration seconds.
+
+    Returns:
+        int: Number of readings written
+    """
+    changes = queue.Queue()
+
+    def on_snapshot(doc_snapshots, doc_changes, read_time):
+        now = time.time()
+        for change in doc_changes:
+            if change.type.name != 'REMOVED':
+                changes.put((now, change.document.id, (change.document.to_dict() or {}).get('value', 0)))
+
+    watch = client.collection('uv_intensity').on_snapshot(on_snapshot)
+    end_time = time.time() + duration
+    try:
+        with StreamWriter(path, time.time()) as writer:
+            while time.time() < end_time:
+                try:
+                    writer.write(*changes.get(timeout=0.5))
+                except queue.Empty:
+                    continue
+            return writer.count
+    finally:
+        watch.unsubscribe()
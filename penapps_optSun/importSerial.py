@@ -1,57 +1,505 @@
-import serial
-import time
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-# === CONFIG ===
-SERIAL_PORT = 'COM7'  # Replace with your Arduino COM port
-BAUD_RATE = 9600
-SERVICE_ACCOUNT_FILE = 'firebase_key.json'
-FIRESTORE_COLLECTION = 'users'
-# ===============
-
-# Initialize Firebase
-cred = credentials.Certificate(SERVICE_ACCOUNT_FILE)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-def main():
-    try:
-        ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-        print(f"Connected to {SERIAL_PORT} at {BAUD_RATE} baud.")
-    except serial.SerialException as e:
-        print(f"Error opening serial port: {e}")
-        return
-
-    while True:
-        try:
-            line = ser.readline().decode('utf-8').strip()
-            if line:
-                try:
-                    # Expecting line like: "512,5.12"
-                    parts = line.split(",")
-                    if len(parts) == 3:
-                        uv_raw = int(parts[0])
-                        uv_index = float(parts[1])
-                        is_pressed = int(parts[2])
-
-                        # Push both to Firebase
-                        db.collection(FIRESTORE_COLLECTION).document('latest').set({
-                            'uv_raw': uv_raw,
-                            'uv_index': uv_index,
-                            'is_pressed': is_pressed, 
-                            'timestamp': firestore.SERVER_TIMESTAMP
-                        })
-
-                        print(f"Pushed UV Raw: {uv_raw}, UV Index: {uv_index}, is_pressed: {is_pressed}")
-                    else:
-                        print(f"Unexpected data format: {line}")
-                except ValueError:
-                    print(f"Non-numeric data received: {line}")
-        except Exception as e:
-            print(f"Error: {e}")
-
-        time.sleep(1)
-
-if __name__ == "__main__":
-    main()
+import serial
+import serial.tools.list_ports
+import os
+import queue
+import sys
+import threading
+import time
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'riskCalculation'))
+
+from monitor_metrics import METRICS, RateLimitedLogger, start_json_snapshots, start_metrics_server
+from sensor_protocol import ACK_LINE, HELLO_LINE, FrameDecoder
+from uv_history import UVHistoryStore
+from uv_dose import UVDoseAccumulator
+from write_queue import DurableWriteQueue
+
+# === CONFIG ===
+SERIAL_PORTS = ['COM7']  # Replace with your Arduino COM ports; empty list: find USB serial ports automatically
+BAUD_RATE = 9600
+SERVICE_ACCOUNT_FILE = 'firebase_key.json'
+FIRESTORE_COLLECTION = 'users'
+FIRESTORE_DEVICE_COLLECTION = 'uv_devices'  # Latest sample and dose per device, keyed by device id
+FIRESTORE_WINDOW_COLLECTION = 'uv_windows'  # Per-window aggregates of every sample (without a history store)
+FIRESTORE_ROLLUP_COLLECTION = 'uv_rollups'  # Per-hour aggregates from the history store
+LATEST_DEVICE = None    # Device also written to users/latest, which the app reads (None: the first one seen)
+DISCOVERY_INTERVAL = 5.0  # How often ports are rescanned for new or reconnected devices
+MAX_BATCH_WRITES = 500  # Firestore's limit on writes per batch
+SERIAL_PROTOCOL = 'auto'  # 'auto': offer binary frames (see sensor_protocol.py), fall back to CSV; 'csv': CSV only
+NEGOTIATION_TIMEOUT = 2.0  # Seconds to wait for a device to accept binary frames
+WINDOW_SECONDS = 10     # Length of each aggregation window
+FLUSH_INTERVAL = 1.0    # How often the writer pushes each device's latest sample and closed windows
+QUEUE_SIZE = 10000      # Samples buffered between the readers and the writer
+DOSE_MAX_GAP = 10       # Seconds a reading is held for the dose if the armband goes quiet
+METRICS_PORT = None     # Set to serve Prometheus metrics on http://127.0.0.1:<port>/metrics
+METRICS_JSON_PATH = None  # Set to write a JSON metrics snapshot to this file every 10 seconds
+# Write-ahead log of pending Firestore writes, replayed on the next start after a crash or outage
+WRITE_QUEUE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'write_queue')
+# Local columnar store of every sample with minute/hour/day rollups (see uv_history.py); None: push uv_windows instead
+HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uv_history')
+# ===============
+
+# Status lines go through this so a noisy sensor cannot flood the console
+status_log = RateLimitedLogger(interval=10.0)
+
+# Firestore client, created on first use so the parsing code can be imported without credentials
+_db = None
+
+def get_db():
+    global _db
+    if _db is None:
+        # Initialize Firebase
+        cred = credentials.Certificate(SERVICE_ACCOUNT_FILE)
+        firebase_admin.initialize_app(cred)
+        _db = firestore.client()
+    return _db
+
+def parse_line(line):
+    """
+    Parse one line from the armband.
+
+    Args:
+        line: Decoded line like "512,5.12,0" (uv_raw, uv_index, is_pressed)
+
+    Returns:
+        tuple: (uv_raw, uv_index, is_pressed)
+
+    Raises:
+        ValueError: If the line does not have three numeric fields
+    """
+    parts = line.split(",")
+    if len(parts) != 3:
+        raise ValueError(f"Unexpected data format: {line}")
+    return int(parts[0]), float(parts[1]), int(parts[2])
+
+class SampleWindow:
+    """Running min/max/mean/count/last of the samples that fall into one window."""
+
+    def __init__(self, start, length):
+        self.start = start
+        self.end = start + length
+        self.count = 0
+        self.uv_raw_min = self.uv_raw_max = None
+        self.uv_index_min = self.uv_index_max = None
+        self.uv_raw_sum = 0
+        self.uv_index_sum = 0.0
+        self.last = None
+
+    def add(self, sample):
+        _, uv_raw, uv_index, is_pressed = sample
+        if self.count == 0:
+            self.uv_raw_min = self.uv_raw_max = uv_raw
+            self.uv_index_min = self.uv_index_max = uv_index
+        else:
+            self.uv_raw_min = min(self.uv_raw_min, uv_raw)
+            self.uv_raw_max = max(self.uv_raw_max, uv_raw)
+            self.uv_index_min = min(self.uv_index_min, uv_index)
+            self.uv_index_max = max(self.uv_index_max, uv_index)
+        self.count += 1
+        self.uv_raw_sum += uv_raw
+        self.uv_index_sum += uv_index
+        self.last = sample
+
+    def to_dict(self):
+        _, uv_raw, uv_index, is_pressed = self.last
+        return {
+            'window_start': self.start,
+            'window_end': self.end,
+            'count': self.count,
+            'uv_raw_min': self.uv_raw_min,
+            'uv_raw_max': self.uv_raw_max,
+            'uv_raw_mean': self.uv_raw_sum / self.count,
+            'uv_index_min': self.uv_index_min,
+            'uv_index_max': self.uv_index_max,
+            'uv_index_mean': self.uv_index_sum / self.count,
+            'last_uv_raw': uv_raw,
+            'last_uv_index': uv_index,
+            'last_is_pressed': is_pressed
+        }
+
+def device_id_for(port):
+    """Device id used in Firestore for a serial port: 'COM7' -> 'COM7', '/dev/ttyUSB0' -> 'ttyUSB0'."""
+    return os.path.basename(port)
+
+def discover_ports():
+    """
+    Find connected armbands: every USB serial port, since that is how the boards show up.
+
+    Returns:
+        dict: port -> device id (the USB serial number when the board reports one, so a
+              device keeps its id when it is plugged into a different port)
+    """
+    found = {}
+    for port in serial.tools.list_ports.comports():
+        if port.vid is None:
+            continue  # built-in UARTs like /dev/ttyS0
+        found[port.device] = port.serial_number or device_id_for(port.device)
+    return found
+
+def _handle_csv_line(line, samples, device_id):
+    line = line.decode('utf-8', errors='replace').strip()
+    if not line:
+        return
+    METRICS.inc('serial_lines_total')
+    try:
+        uv_raw, uv_index, is_pressed = parse_line(line)
+    except ValueError:
+        METRICS.inc('serial_parse_errors_total')
+        status_log.log('parse_error', f"Non-numeric data received from {device_id}: {line}")
+        return
+    samples.put((device_id, (time.time(), uv_raw, uv_index, is_pressed)))
+
+def read_samples(ser, samples, stop_event, device_id=None, pending_lines=()):
+    """
+    Reader stage for CSV devices: parse every line from one serial port and hand it to the writer.
+
+    Runs without any sleep so the OS buffer never backs up. put() blocks when the queue is
+    full, which slows the reader down instead of dropping samples. Returns when the port
+    goes away (e.g. the armband is unplugged) so the bridge can reopen it later.
+
+    Args:
+        pending_lines: Lines already read from the port (during negotiation) to handle first
+    """
+    for line in pending_lines:
+        _handle_csv_line(line, samples, device_id)
+    while not stop_event.is_set():
+        try:
+            _handle_csv_line(ser.readline(), samples, device_id)
+        except serial.SerialException as e:
+            if not stop_event.is_set():
+                print(f"Lost {device_id}: {e}")
+            return
+        except Exception as e:
+            METRICS.inc('serial_read_errors_total')
+            status_log.log('read_error', f"Error: {e}")
+
+def read_frames(ser, samples, stop_event, device_id=None):
+    """
+    Reader stage for devices that send binary frames.
+
+    Reads whatever the port has buffered in one call and decodes it with a FrameDecoder,
+    so there is no per-line readline/decode/split. CRC failures and frames missing from
+    the sequence are counted in METRICS instead of printed.
+    """
+    decoder = FrameDecoder()
+    reported = decoder.stats()
+    while not stop_event.is_set():
+        try:
+            data = ser.read(ser.in_waiting or 1)
+        except serial.SerialException as e:
+            if not stop_event.is_set():
+                print(f"Lost {device_id}: {e}")
+            return
+        if not data:
+            continue
+        now = time.time()
+        for _, uv_raw, uv_index, is_pressed in decoder.feed(data):
+            samples.put((device_id, (now, uv_raw, uv_index, is_pressed)))
+
+        stats = decoder.stats()
+        for name, metric in (('frames', 'serial_frames_total'), ('crc_errors', 'serial_crc_errors_total'),
+                             ('resync_bytes', 'serial_resync_bytes_total'), ('dropped', 'serial_dropped_frames_total')):
+            if stats[name] != reported[name]:
+                METRICS.inc(metric, stats[name] - reported[name])
+        if stats['dropped'] != reported['dropped'] or stats['crc_errors'] != reported['crc_errors']:
+            status_log.log(f'frame_loss_{device_id}', f"{device_id}: {stats['dropped']} frames dropped, "
+                                                      f"{stats['crc_errors']} CRC errors so far")
+        reported = stats
+
+def negotiate_protocol(ser, timeout=NEGOTIATION_TIMEOUT):
+    """
+    Offer binary frames to the device and see if it accepts.
+
+    Returns:
+        tuple: ('binary', []) if the device acknowledged, otherwise ('csv', lines) with the
+               lines received while waiting, so no CSV sample is lost
+    """
+    ser.write(HELLO_LINE)
+    lines = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        line = ser.readline()
+        if line.strip() == ACK_LINE:
+            return 'binary', []
+        if line:
+            lines.append(line)
+    return 'csv', lines
+
+def serve_device(ser, samples, stop_event, device_id, protocol=SERIAL_PROTOCOL):
+    """Reader thread body: pick the device's protocol, then read it until the port goes away."""
+    try:
+        mode, pending_lines = negotiate_protocol(ser) if protocol == 'auto' else ('csv', [])
+    except serial.SerialException as e:
+        print(f"Lost {device_id}: {e}")
+        return
+    print(f"{device_id}: using {'binary frames' if mode == 'binary' else 'CSV lines'}")
+    if mode == 'binary':
+        read_frames(ser, samples, stop_event, device_id)
+    else:
+        read_samples(ser, samples, stop_event, device_id, pending_lines)
+
+def open_reader(port, device_id, samples, stop_event):
+    """
+    Open a serial port and start a reader thread for it.
+
+    Returns:
+        tuple: (Serial, Thread), or None if the port could not be opened
+    """
+    try:
+        ser = serial.Serial(port, BAUD_RATE, timeout=1)
+    except serial.SerialException as e:
+        status_log.log(f'open_error_{port}', f"Error opening serial port {port}: {e}")
+        return None
+    print(f"Connected to {port} ({device_id}) at {BAUD_RATE} baud.")
+    reader = threading.Thread(target=serve_device, args=(ser, samples, stop_event, device_id),
+                              name=f"serial-{device_id}", daemon=True)
+    reader.start()
+    return ser, reader
+
+def supervise_readers(ports, samples, stop_event, discovery_interval=DISCOVERY_INTERVAL):
+    """
+    Keep one reader thread per device until stop_event is set.
+
+    Every discovery_interval the wanted ports (the ones given, or discover_ports() if
+    there are none) are compared with the running readers: new devices are opened and
+    readers whose device went away are reopened once it is back.
+
+    Args:
+        ports: List of serial ports to read; empty to discover them
+    """
+    readers = {}  # port -> (Serial, Thread)
+    while not stop_event.is_set():
+        wanted = {port: device_id_for(port) for port in ports} if ports else discover_ports()
+        for port, device_id in wanted.items():
+            if port in readers:
+                if readers[port][1].is_alive():
+                    continue
+                readers.pop(port)[0].close()
+            reader = open_reader(port, device_id, samples, stop_event)
+            if reader is not None:
+                readers[port] = reader
+        METRICS.set_gauge('serial_devices', sum(reader.is_alive() for _, reader in readers.values()))
+        stop_event.wait(discovery_interval)
+
+    for ser, reader in readers.values():
+        reader.join(timeout=2)
+        ser.close()
+
+class DeviceBuffer:
+    """The writer's state for one device: open windows, cumulative dose and the unwritten latest sample."""
+
+    def __init__(self, device_id, window_seconds):
+        self.device_id = device_id
+        self.window_seconds = window_seconds
+        self.windows = {}  # window start -> SampleWindow
+        self.dose = UVDoseAccumulator(max_gap=DOSE_MAX_GAP)
+        self.latest = None
+        self.latest_written = True
+
+    def add(self, sample):
+        window_start = sample[0] // self.window_seconds * self.window_seconds
+        if window_start not in self.windows:
+            self.windows[window_start] = SampleWindow(window_start, self.window_seconds)
+        self.windows[window_start].add(sample)
+        self.dose.add_sample(sample[1], sample[0])
+        self.latest = sample
+        self.latest_written = False
+
+    def closed_windows(self, now, everything=False):
+        return [window for window in self.windows.values() if everything or window.end <= now]
+
+    def unwritten_samples(self):
+        return sum(window.count for window in self.windows.values())
+
+def _device_writes(db, buffer, closed_windows, mirror_latest, rollups=None):
+    """
+    (document reference, fields) pairs for one device's flush.
+
+    With rollups (hour documents from the history store) those are written instead of the closed windows.
+    """
+    writes = []
+    if not buffer.latest_written:
+        _, uv_raw, uv_index, is_pressed = buffer.latest
+        latest_doc = {
+            'device_id': buffer.device_id,
+            'uv_raw': uv_raw,
+            'uv_index': uv_index,
+            'is_pressed': is_pressed,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        }
+        latest_doc.update(buffer.dose.to_dict())
+        writes.append((db.collection(FIRESTORE_DEVICE_COLLECTION).document(buffer.device_id), latest_doc))
+        if mirror_latest:
+            writes.append((db.collection(FIRESTORE_COLLECTION).document('latest'), latest_doc))
+    if rollups is not None:
+        for rollup in rollups:
+            rollup_id = f"{buffer.device_id}_{int(rollup['start'])}"
+            writes.append((db.collection(FIRESTORE_ROLLUP_COLLECTION).document(rollup_id), rollup))
+        return writes
+    for window in closed_windows:
+        window_doc = dict(window.to_dict(), device_id=buffer.device_id)
+        window_id = f"{buffer.device_id}_{int(window.start)}"
+        writes.append((db.collection(FIRESTORE_WINDOW_COLLECTION).document(window_id), window_doc))
+    return writes
+
+def _mark_flushed(buffer, closed_windows, now, history):
+    buffer.latest_written = True
+    for window in closed_windows:
+        del buffer.windows[window.start]
+    if history is not None:
+        history.mark_pushed(buffer.device_id, now)
+
+def flush_to_firestore(buffers, now, stopping=False, latest_device=None, write_queue=None, history=None):
+    """
+    Write every device's latest sample (with its cumulative dose) and closed windows.
+
+    Each device's writes go in the same write batch, and batches are filled with whole
+    devices up to MAX_BATCH_WRITES. A device whose batch fails keeps its data for the next flush.
+    With a write_queue the writes are handed to it instead (logged to disk and committed
+    in the background), so the flush never waits on Firestore.
+    With a history store the samples are already kept locally: closed windows are dropped
+    and each device's finished hours are pushed to FIRESTORE_ROLLUP_COLLECTION instead.
+
+    Args:
+        buffers: Iterable of DeviceBuffer
+        stopping: Treat every window as closed (final flush)
+        latest_device: Device whose latest sample is also written to users/latest for the app
+        write_queue: Optional DurableWriteQueue
+        history: Optional UVHistoryStore holding every sample
+
+    Returns:
+        list: DeviceBuffers that were written (or queued)
+    """
+    db = get_db()
+    pending = []
+    for buffer in buffers:
+        closed = buffer.closed_windows(now, stopping)
+        rollups = history.closed_hours(buffer.device_id, now) if history is not None else None
+        if buffer.latest_written and not closed and not rollups:
+            if history is not None:
+                history.mark_pushed(buffer.device_id, now)
+            continue
+        pending.append((buffer, closed, _device_writes(db, buffer, closed, buffer.device_id == latest_device, rollups)))
+
+    flushed = []
+    if write_queue is not None:
+        for buffer, closed, writes in pending:
+            for ref, fields in writes:
+                write_queue.set(ref, fields)
+            _mark_flushed(buffer, closed, now, history)
+            flushed.append(buffer)
+        return flushed
+    start = 0
+    while start < len(pending):
+        end, write_count = start, 0
+        while end < len(pending) and (end == start or write_count + len(pending[end][2]) <= MAX_BATCH_WRITES):
+            write_count += len(pending[end][2])
+            end += 1
+        batch = db.batch()
+        for _, _, writes in pending[start:end]:
+            for ref, fields in writes:
+                batch.set(ref, fields)
+        try:
+            with METRICS.timer('firestore_write_seconds', source='serial'):
+                batch.commit()
+            METRICS.inc('firestore_writes_total', write_count, source='serial')
+            for buffer, closed, _ in pending[start:end]:
+                _mark_flushed(buffer, closed, now, history)
+                flushed.append(buffer)
+        except Exception as e:
+            METRICS.inc('firestore_errors_total', source='serial')
+            status_log.log('write_error', f"Error writing to Firestore: {e}")
+        start = end
+    return flushed
+
+def write_samples(samples, stop_event, window_seconds=WINDOW_SECONDS, flush_interval=FLUSH_INTERVAL,
+                  latest_device=None, write_queue=None, history=None):
+    """
+    Writer stage: aggregate every device's samples into fixed windows and flush them on a schedule.
+
+    Every flush_interval each device's latest sample is written to
+    FIRESTORE_DEVICE_COLLECTION/<device_id> and every window that has closed is written to
+    FIRESTORE_WINDOW_COLLECTION. If a write fails the data is kept and retried on the next
+    flush. Remaining samples are flushed when stop_event is set.
+    With a history store every sample is also appended to it, and finished hours are
+    pushed in place of the windows.
+
+    Args:
+        latest_device: Device also mirrored to users/latest (None: the first device seen)
+        write_queue: Optional DurableWriteQueue the flushes go through (see flush_to_firestore)
+        history: Optional UVHistoryStore
+    """
+    buffers = {}  # device id -> DeviceBuffer
+    next_flush = time.time() + flush_interval
+    final_attempts = 3
+
+    while True:
+        stopping = stop_event.is_set()
+        try:
+            device_id, sample = samples.get(timeout=max(0.0, min(next_flush - time.time(), flush_interval)))
+            if device_id not in buffers:
+                buffers[device_id] = DeviceBuffer(device_id, window_seconds)
+                latest_device = latest_device or device_id
+            buffers[device_id].add(sample)
+            if history is not None:
+                history.append(device_id, sample)
+        except queue.Empty:
+            pass
+
+        now = time.time()
+        if now >= next_flush or (stopping and samples.empty()):
+            METRICS.set_gauge('serial_queue_depth', samples.qsize())
+            if history is not None:
+                history.checkpoint()
+            for buffer in flush_to_firestore(buffers.values(), now, stopping, latest_device, write_queue, history):
+                _, uv_raw, uv_index, is_pressed = buffer.latest
+                status_log.log(f'pushed_{buffer.device_id}',
+                               f"Pushed {buffer.device_id} UV Raw: {uv_raw}, UV Index: {uv_index}, "
+                               f"is_pressed: {is_pressed} ({samples.qsize()} samples queued)")
+            next_flush = now + flush_interval
+            if stopping and samples.empty():
+                final_attempts -= 1
+                unwritten = [buffer for buffer in buffers.values() if buffer.windows or not buffer.latest_written]
+                if not unwritten:
+                    return
+                if final_attempts == 0:
+                    print(f"Giving up on {sum(buffer.unwritten_samples() for buffer in unwritten)} unwritten samples")
+                    return
+
+def main():
+    get_db()  # Fail fast on bad credentials before opening any port
+
+    if METRICS_PORT is not None:
+        start_metrics_server(METRICS_PORT)
+    if METRICS_JSON_PATH:
+        start_json_snapshots(METRICS_JSON_PATH)
+
+    samples = queue.Queue(maxsize=QUEUE_SIZE)
+    stop_event = threading.Event()
+    # SERVER_TIMESTAMP is not JSON, so the log stores it by name
+    write_queue = DurableWriteQueue(get_db(), WRITE_QUEUE_DIR, name='serial', batch_size=MAX_BATCH_WRITES,
+                                    sentinels={'server_timestamp': firestore.SERVER_TIMESTAMP})
+    history = UVHistoryStore(HISTORY_DIR) if HISTORY_DIR else None
+    supervisor = threading.Thread(target=supervise_readers, args=(SERIAL_PORTS, samples, stop_event), daemon=True)
+    writer = threading.Thread(target=write_samples, args=(samples, stop_event),
+                              kwargs={'latest_device': LATEST_DEVICE, 'write_queue': write_queue, 'history': history})
+    supervisor.start()
+    writer.start()
+    print(f"Reading {', '.join(SERIAL_PORTS) if SERIAL_PORTS else 'every USB serial port'}. Press Ctrl+C to stop.")
+
+    try:
+        while writer.is_alive():
+            writer.join(timeout=1)
+    except KeyboardInterrupt:
+        print("Stopping, flushing buffered samples...")
+        stop_event.set()
+        supervisor.join(timeout=5)
+        writer.join()
+    write_queue.close()
+    if history is not None:
+        history.close()
+
+if __name__ == "__main__":
+    main()
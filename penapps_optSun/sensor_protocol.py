@@ -0,0 +1,132 @@
+"""
+Binary frame format for the armband's serial link, and the handshake that picks it.
+
+Frame (version 1), little-endian:
+
+    offset  size  field
+    0       2     magic 0xA5 0x5A
+    2       1     version (1)
+    3       1     payload length N (5 for version 1)
+    4       2     sequence number, +1 per frame, wraps at 65536
+    6       N     payload: uv_raw uint16, uv_index x 100 uint16, flags uint8 (bit 0: is_pressed)
+    6+N     2     CRC-16/CCITT-FALSE of bytes 2 .. 6+N (version through payload)
+
+Negotiation: after opening the port the bridge sends HELLO_LINE. A device that speaks
+frames answers with ACK_LINE and switches to frames; older devices ignore it and keep
+printing CSV lines (uv_raw,uv_index,is_pressed), which the bridge falls back to.
+"""
+
+import binascii
+import struct
+
+MAGIC = b'\xa5\x5a'
+FRAME_VERSION = 1
+HEADER = struct.Struct('<2sBBH')   # magic, version, payload length, sequence
+PAYLOAD_V1 = struct.Struct('<HHB')  # uv_raw, uv_index x 100, flags
+CRC = struct.Struct('<H')
+
+HELLO_LINE = b'HELLO %d\n' % FRAME_VERSION
+ACK_LINE = b'OK BIN %d' % FRAME_VERSION
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF), the variant most MCU libraries ship."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(sequence, uv_raw, uv_index, is_pressed):
+    """Build one version 1 frame (what the firmware sends; used by tests and simulators)."""
+    payload = PAYLOAD_V1.pack(uv_raw, int(round(uv_index * 100)), 1 if is_pressed else 0)
+    body = HEADER.pack(MAGIC, FRAME_VERSION, len(payload), sequence & 0xFFFF) + payload
+    return body + CRC.pack(crc16(body[2:]))
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for a byte stream of frames.
+
+    feed() takes whatever a bulk read returned (partial frames are kept for the next
+    call) and returns the decoded samples. Frames are parsed in place with struct over a
+    memoryview of the receive buffer, and the consumed prefix is dropped once per call.
+
+    Stream problems are counted rather than raised:
+        crc_errors:   frames whose CRC did not match (skipped)
+        resync_bytes: bytes thrown away while looking for the next magic
+        dropped:      frames missing according to gaps in the sequence numbers
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.last_sequence = None
+        self.frames = 0
+        self.crc_errors = 0
+        self.resync_bytes = 0
+        self.dropped = 0
+
+    def _track_sequence(self, sequence):
+        if self.last_sequence is not None:
+            gap = (sequence - self.last_sequence - 1) & 0xFFFF
+            # A huge "gap" is a duplicate or the device restarting its counter, not lost frames
+            if gap < 0x8000:
+                self.dropped += gap
+        self.last_sequence = sequence
+
+    def feed(self, data):
+        """
+        Args:
+            data: Bytes read from the port
+
+        Returns:
+            list: (sequence, uv_raw, uv_index, is_pressed) for every complete, valid frame
+        """
+        buffer = self._buffer
+        buffer += data
+        samples = []
+        view = memoryview(buffer)
+        pos = 0
+        end = len(buffer)
+        try:
+            while True:
+                start = buffer.find(MAGIC, pos)
+                if start < 0:
+                    # Keep a trailing 0xA5 in case it is the first half of the next magic
+                    keep_from = end - 1 if end and buffer[end - 1] == MAGIC[0] else end
+                    self.resync_bytes += keep_from - pos
+                    pos = keep_from
+                    break
+                self.resync_bytes += start - pos
+                pos = start
+                if end - pos < HEADER.size:
+                    break
+                _, version, length, sequence = HEADER.unpack_from(view, pos)
+                if version != FRAME_VERSION or length != PAYLOAD_V1.size:
+                    # Not a frame we understand: treat the magic as noise and look further on
+                    self.resync_bytes += 1
+                    pos += 1
+                    continue
+                frame_end = pos + HEADER.size + length + CRC.size
+                if frame_end > end:
+                    break
+                (crc,) = CRC.unpack_from(view, frame_end - CRC.size)
+                if crc != crc16(view[pos + 2:frame_end - CRC.size]):
+                    self.crc_errors += 1
+                    self.resync_bytes += 1
+                    pos += 1
+                    continue
+                uv_raw, uv_index_centi, flags = PAYLOAD_V1.unpack_from(view, pos + HEADER.size)
+                self._track_sequence(sequence)
+                self.frames += 1
+                samples.append((sequence, uv_raw, uv_index_centi / 100.0, flags & 1))
+                pos = frame_end
+        finally:
+            view.release()
+        del buffer[:pos]
+        return samples
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'crc_errors': self.crc_errors,
+            'resync_bytes': self.resync_bytes,
+            'dropped': self.dropped
+        }
@@ -0,0 +1,405 @@
+"""
+Local UV history: every armband reading in memory-mapped columns, with minute, hour and day rollups.
+
+Layout, one directory per device:
+
+    meta.json                     base time, checkpoint and the last hour pushed to Firestore
+    raw_ts.col                    float64 timestamp per sample (non-decreasing)
+    raw_uv_raw.col                uint16
+    raw_uv_index.col              uint16, uv_index x 100
+    raw_is_pressed.col            uint8
+    <resolution>_<field>.col      one slot per minute / hour / day since the base time:
+                                  count, sum_raw, min_raw, max_raw, sum_index, max_index, pressed
+
+The device is the partition key rather than a column, so a device's samples are
+contiguous and sorted by time. Rollup slots are addressed directly by
+(timestamp - base) // resolution and updated as samples are appended, so range queries
+add up a few day slots plus hour and minute slots at the edges (and at most two
+minutes of raw samples) instead of scanning the samples. Days are UTC days.
+
+Files grow by doubling and are mapped with mmap. Writes land in the OS page cache
+straight away, so they survive a crash of the process; after a crash the rollups of the
+buckets written since the last checkpoint are rebuilt from the raw samples on open.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+
+RESOLUTIONS = (86400, 3600, 60)  # day, hour, minute; coarsest first
+RESOLUTION_NAMES = {60: 'minute', 3600: 'hour', 86400: 'day'}
+RAW_COLUMNS = (('ts', 'd'), ('uv_raw', 'H'), ('uv_index', 'H'), ('is_pressed', 'B'))
+ROLLUP_COLUMNS = (('count', 'I'), ('sum_raw', 'd'), ('min_raw', 'H'), ('max_raw', 'H'),
+                  ('sum_index', 'd'), ('max_index', 'H'), ('pressed', 'I'))
+MAX_U16 = 0xFFFF
+
+
+class _Column:
+    """A growable typed array backed by a memory-mapped file."""
+
+    def __init__(self, path, typecode, initial_items=4096):
+        self.typecode = typecode
+        self.itemsize = struct.calcsize(typecode)
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        self._file = open(path, mode)
+        if os.fstat(self._file.fileno()).st_size < initial_items * self.itemsize:
+            self._file.truncate(initial_items * self.itemsize)
+        self._map()
+
+    def _map(self):
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self.view = memoryview(self._mmap).cast(self.typecode)
+
+    def ensure(self, items):
+        """Grow (by doubling) until the column holds at least this many items."""
+        if items <= len(self.view):
+            return
+        capacity = max(items, 2 * len(self.view))
+        self.view.release()
+        self._mmap.close()
+        self._file.truncate(capacity * self.itemsize)
+        self._map()
+
+    def sync(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class _Totals:
+    """Running aggregate of rollup slots and raw samples for one query."""
+
+    __slots__ = ('count', 'sum_raw', 'min_raw', 'max_raw', 'sum_index', 'max_index', 'pressed')
+
+    def __init__(self):
+        self.count = 0
+        self.sum_raw = 0.0
+        self.min_raw = None
+        self.max_raw = None
+        self.sum_index = 0.0
+        self.max_index = None
+        self.pressed = 0
+
+    def add(self, count, sum_raw, min_raw, max_raw, sum_index, max_index, pressed):
+        if not count:
+            return
+        self.count += count
+        self.sum_raw += sum_raw
+        self.min_raw = min_raw if self.min_raw is None else min(self.min_raw, min_raw)
+        self.max_raw = max_raw if self.max_raw is None else max(self.max_raw, max_raw)
+        self.sum_index += sum_index
+        self.max_index = max_index if self.max_index is None else max(self.max_index, max_index)
+        self.pressed += pressed
+
+    def to_dict(self):
+        count = self.count
+        return {
+            'count': count,
+            'uv_raw_mean': self.sum_raw / count if count else None,
+            'uv_raw_min': self.min_raw,
+            'uv_raw_max': self.max_raw,
+            'uv_index_mean': self.sum_index / count / 100 if count else None,
+            'uv_index_max': self.max_index / 100 if self.max_index is not None else None,
+            'pressed_count': self.pressed
+        }
+
+
+class DeviceHistory:
+    """The columns and rollups of one device. Use through UVHistoryStore."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self.meta = {'base': None, 'checkpoint': 0, 'pushed_hour': None}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.meta.update(json.load(f))
+        self.raw = {name: _Column(os.path.join(directory, f'raw_{name}.col'), typecode)
+                    for name, typecode in RAW_COLUMNS}
+        self.rollups = {resolution: {name: _Column(os.path.join(directory, f'{resolution}_{name}.col'), typecode, 64)
+                                     for name, typecode in ROLLUP_COLUMNS}
+                        for resolution in RESOLUTIONS}
+        self.count = self._find_count()
+        if self.count > self.meta['checkpoint']:
+            self._rebuild_rollups(self.meta['checkpoint'])
+            self.checkpoint()
+
+    def _find_count(self):
+        """Samples stored: the slots before the first zero timestamp (timestamps never go down)."""
+        ts = self.raw['ts'].view
+        low, high = 0, len(ts)
+        while low < high:
+            mid = (low + high) // 2
+            if ts[mid] > 0:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _save_meta(self):
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def checkpoint(self):
+        """Record that the rollups are up to date with every sample so far."""
+        if self.meta['checkpoint'] != self.count:
+            self.meta['checkpoint'] = self.count
+            self._save_meta()
+
+    def _slot(self, timestamp, resolution):
+        return int((timestamp - self.meta['base']) // resolution)
+
+    def append(self, timestamp, uv_raw, uv_index, is_pressed):
+        count = self.count
+        if self.meta['base'] is None:
+            self.meta['base'] = timestamp // 86400 * 86400
+            self._save_meta()
+        ts = self.raw['ts']
+        if count and timestamp < ts.view[count - 1]:
+            timestamp = ts.view[count - 1]  # keep the column sorted; a late sample counts at the last time
+        uv_raw = max(0, min(MAX_U16, int(uv_raw)))
+        uv_index = max(0, min(MAX_U16, int(round(uv_index * 100))))
+        is_pressed = 1 if is_pressed else 0
+        for column in self.raw.values():
+            column.ensure(count + 1)
+        ts.view[count] = timestamp
+        self.raw['uv_raw'].view[count] = uv_raw
+        self.raw['uv_index'].view[count] = uv_index
+        self.raw['is_pressed'].view[count] = is_pressed
+        self.count = count + 1
+
+        base = self.meta['base']
+        for resolution, columns in self.rollups.items():
+            slot = int((timestamp - base) // resolution)
+            if slot >= len(columns['count'].view):
+                for column in columns.values():
+                    column.ensure(slot + 1)
+            counts = columns['count'].view
+            if counts[slot]:
+                if uv_raw < columns['min_raw'].view[slot]:
+                    columns['min_raw'].view[slot] = uv_raw
+                if uv_raw > columns['max_raw'].view[slot]:
+                    columns['max_raw'].view[slot] = uv_raw
+                if uv_index > columns['max_index'].view[slot]:
+                    columns['max_index'].view[slot] = uv_index
+            else:
+                columns['min_raw'].view[slot] = uv_raw
+                columns['max_raw'].view[slot] = uv_raw
+                columns['max_index'].view[slot] = uv_index
+            counts[slot] += 1
+            columns['sum_raw'].view[slot] += uv_raw
+            columns['sum_index'].view[slot] += uv_index
+            columns['pressed'].view[slot] += is_pressed
+
+    def _sample_range(self, start, end):
+        """Indexes [first, last) of the samples with start <= timestamp < end."""
+        ts = self.raw['ts'].view
+        return bisect.bisect_left(ts, start, 0, self.count), bisect.bisect_left(ts, end, 0, self.count)
+
+    def _rebuild_rollups(self, first_sample):
+        """Recompute every rollup slot touched by the samples from first_sample on."""
+        ts = self.raw['ts'].view
+        base = self.meta['base']
+        for resolution, columns in self.rollups.items():
+            slots = sorted({self._slot(ts[i], resolution) for i in range(first_sample, self.count)})
+            for column in columns.values():
+                column.ensure(slots[-1] + 1)
+            for slot in slots:
+                totals = _Totals()
+                self._add_samples(totals, *self._sample_range(base + slot * resolution, base + (slot + 1) * resolution))
+                values = (totals.count, totals.sum_raw, totals.min_raw or 0, totals.max_raw or 0,
+                          totals.sum_index, totals.max_index or 0, totals.pressed)
+                for (name, _), value in zip(ROLLUP_COLUMNS, values):
+                    columns[name].view[slot] = value
+
+    def _add_samples(self, totals, first, last):
+        if first >= last:
+            return
+        uv_raw = self.raw['uv_raw'].view[first:last]
+        uv_index = self.raw['uv_index'].view[first:last]
+        totals.add(last - first, sum(uv_raw), min(uv_raw), max(uv_raw), sum(uv_index), max(uv_index),
+                   sum(self.raw['is_pressed'].view[first:last]))
+        uv_raw.release()
+        uv_index.release()
+
+    def _add_slots(self, totals, resolution, first, last):
+        columns = self.rollups[resolution]
+        last = min(last, len(columns['count'].view))
+        if first >= last:
+            return
+        counts = columns['count'].view
+        for slot in range(first, last):
+            if counts[slot]:
+                totals.add(counts[slot], columns['sum_raw'].view[slot], columns['min_raw'].view[slot],
+                           columns['max_raw'].view[slot], columns['sum_index'].view[slot],
+                           columns['max_index'].view[slot], columns['pressed'].view[slot])
+
+    def _cover(self, totals, start, end, level):
+        """Add [start, end) to totals with the coarsest whole slots, finer ones at the edges."""
+        if start >= end:
+            return
+        if level == len(RESOLUTIONS):
+            self._add_samples(totals, *self._sample_range(start, end))
+            return
+        resolution = RESOLUTIONS[level]
+        base = self.meta['base']
+        first = -(-(start - base) // resolution)  # first whole slot
+        last = (end - base) // resolution         # one past the last whole slot
+        if first >= last:
+            self._cover(totals, start, end, level + 1)
+            return
+        self._add_slots(totals, resolution, int(first), int(last))
+        self._cover(totals, start, base + first * resolution, level + 1)
+        self._cover(totals, base + last * resolution, end, level + 1)
+
+    def aggregate(self, start, end):
+        totals = _Totals()
+        if self.count and self.meta['base'] is not None:
+            self._cover(totals, max(start, self.meta['base']), end, 0)
+        return totals.to_dict()
+
+    def series(self, start, end, resolution):
+        if not self.count:
+            return []
+        base = self.meta['base']
+        first = max(0, self._slot(max(start, base), resolution))
+        last = self._slot(end, resolution) + (0 if (end - base) % resolution == 0 else 1)
+        columns = self.rollups[resolution]
+        rows = []
+        for slot in range(first, min(last, len(columns['count'].view))):
+            if columns['count'].view[slot]:
+                totals = _Totals()
+                self._add_slots(totals, resolution, slot, slot + 1)
+                rows.append(dict(totals.to_dict(), start=base + slot * resolution))
+        return rows
+
+    def samples(self, start, end, limit=None):
+        first, last = self._sample_range(start, end)
+        if limit is not None:
+            last = min(last, first + limit)
+        raw = self.raw
+        return [(raw['ts'].view[i], raw['uv_raw'].view[i], raw['uv_index'].view[i] / 100, raw['is_pressed'].view[i])
+                for i in range(first, last)]
+
+    def sync(self):
+        for column in list(self.raw.values()) + [c for columns in self.rollups.values() for c in columns.values()]:
+            column.sync()
+
+    def close(self):
+        self.sync()
+        self.checkpoint()
+        for column in list(self.raw.values()) + [c for columns in self.rollups.values() for c in columns.values()]:
+            column.close()
+
+
+class UVHistoryStore:
+    """
+    Local UV history for every device the bridge reads.
+
+    append() is called for every sample; aggregate(), series() and samples() answer range
+    queries from the rollups. closed_hours() / mark_pushed() let the bridge push each
+    finished hour to Firestore once, as one compact document.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._devices = {}
+
+    def device(self, device_id):
+        """DeviceHistory for a device, opened (or created) on first use."""
+        history = self._devices.get(device_id)
+        if history is None:
+            safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', device_id)
+            history = self._devices[device_id] = DeviceHistory(os.path.join(self.directory, safe_name))
+        return history
+
+    def devices(self):
+        """Every device with stored history (including ones not opened yet)."""
+        return sorted(set(self._devices) | set(os.listdir(self.directory)))
+
+    def append(self, device_id, sample):
+        """
+        Args:
+            sample: (timestamp, uv_raw, uv_index, is_pressed), as queued by the readers
+        """
+        self.device(device_id).append(*sample)
+
+    def aggregate(self, device_id, start, end):
+        """
+        Summary of a device's readings with start <= timestamp < end.
+
+        Returns:
+            dict: count, uv_raw_mean/min/max, uv_index_mean/max and pressed_count
+                  (means, minimums and maximums are None when there are no readings)
+        """
+        return self.device(device_id).aggregate(start, end)
+
+    def series(self, device_id, start, end, resolution=3600):
+        """
+        One aggregate per minute, hour or day (resolution 60, 3600 or 86400) that has readings.
+
+        Returns:
+            list: aggregate() dicts with the slot's 'start' time, oldest first
+        """
+        if resolution not in RESOLUTION_NAMES:
+            raise ValueError(f"resolution must be one of {sorted(RESOLUTION_NAMES)}")
+        return self.device(device_id).series(start, end, resolution)
+
+    def samples(self, device_id, start, end, limit=None):
+        """Raw (timestamp, uv_raw, uv_index, is_pressed) readings with start <= timestamp < end."""
+        return self.device(device_id).samples(start, end, limit)
+
+    def closed_hours(self, device_id, now):
+        """
+        Hour rollups of a device that have ended by now and have not been pushed yet.
+
+        Returns:
+            list: Documents for Firestore (hour aggregate plus the per-minute mean UV), oldest first
+        """
+        history = self.device(device_id)
+        if not history.count:
+            return []
+        base = history.meta['base']
+        pushed = history.meta['pushed_hour']
+        first = 0 if pushed is None else history._slot(pushed, 3600) + 1
+        current = history._slot(now, 3600)
+        hour_counts = history.rollups[3600]['count'].view
+        documents = []
+        for slot in range(first, min(current, len(hour_counts))):
+            if not hour_counts[slot]:
+                continue
+            start = base + slot * 3600
+            minutes = {row['start']: row['uv_raw_mean'] for row in history.series(start, start + 3600, 60)}
+            documents.append(dict(history.series(start, start + 3600, 3600)[0], device_id=device_id,
+                                  resolution_seconds=3600,
+                                  minute_uv_raw_mean=[minutes.get(start + 60 * i) for i in range(60)]))
+        return documents
+
+    def mark_pushed(self, device_id, now):
+        """Remember that every hour that ended by now has been pushed (empty ones included)."""
+        history = self.device(device_id)
+        if history.meta['base'] is None:
+            return
+        hour_start = history.meta['base'] + (history._slot(now, 3600) - 1) * 3600
+        if history.meta['pushed_hour'] != hour_start:
+            history.meta['pushed_hour'] = hour_start
+            history._save_meta()
+
+    def checkpoint(self):
+        for history in self._devices.values():
+            history.checkpoint()
+
+    def close(self):
+        for history in self._devices.values():
+            history.close()
+        self._devices = {}
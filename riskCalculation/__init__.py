@@ -0,0 +1 @@
+"""Risk scoring backend: calc.py (CLI and monitors) and its helper modules."""
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+
+
+# A full scan's watermark is its start time minus this, so users edited just before the scan
+# started with a clock slightly ahead of ours are not skipped by the next run
+RUN_START_MARGIN = timedelta(minutes=1)
+
+
+def hash_risk_inputs(phototype, age, severity_score, location, uv_intensity):
+    """
+    Stable fingerprint of everything that feeds a user's risk categories.
+    If it matches the hash stored on the user document, the categories are already current.
+    """
+    payload = json.dumps([phototype, age, severity_score, location, uv_intensity])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _to_iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _from_iso(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+class BackfillCheckpoint:
+    """
+    Progress of the incremental risk category backfill, persisted as a small JSON file.
+
+    watermark:      users.updatedAt up to which every user has been processed by a finished
+                    run; the next run only looks at users updated after it (None means no
+                    run has finished yet, so the next run scans everything)
+    cursor:         (updatedAt, doc_id) of the last committed page of the run in progress,
+                    so an interrupted run resumes after it instead of starting over
+    run_watermark:  highest updatedAt seen so far by the run in progress
+    run_started_at: when the run in progress started. A full scan walks users by id, so a
+                    user edited after their page was committed can be missed while later
+                    pages show newer updatedAt values; its watermark is therefore the start
+                    time (less RUN_START_MARGIN), not the highest updatedAt it saw
+    failed_ids:    users whose write failed; they are retried at the start of the next run
+    location_uv:    UV reading of each location as used by the finished runs; a location
+                    whose reading has changed since has its users rescored by the next run
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self.cursor = None
+        self.run_watermark = None
+        self.run_started_at = None
+        self.failed_ids = []
+        self.location_uv = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.watermark = _from_iso(state.get('watermark'))
+            if state.get('cursor'):
+                self.cursor = (_from_iso(state['cursor']['updated_at']), state['cursor']['doc_id'])
+            self.run_watermark = _from_iso(state.get('run_watermark'))
+            self.run_started_at = _from_iso(state.get('run_started_at'))
+            self.failed_ids = state.get('failed_ids', [])
+            self.location_uv = state.get('location_uv', {})
+
+    @property
+    def in_progress(self):
+        return self.cursor is not None
+
+    def start_run(self, now):
+        """Record the start time of a new run (a resumed run keeps its original start)."""
+        if self.run_started_at is None or not self.in_progress:
+            self.run_started_at = now
+
+    def advance(self, updated_at, doc_id):
+        """Record that every user up to and including (updated_at, doc_id) has been committed."""
+        self.cursor = (updated_at, doc_id)
+        if updated_at is not None and (self.run_watermark is None or updated_at > self.run_watermark):
+            self.run_watermark = updated_at
+
+    def finish(self, uv_by_location=None):
+        """
+        Mark the current run as complete and move the watermark forward.
+
+        Args:
+            uv_by_location: UV reading the run scored each location's users with
+        """
+        self.location_uv.update(uv_by_location or {})
+        if self.watermark is None and self.run_started_at is not None:
+            self.watermark = self.run_started_at - RUN_START_MARGIN
+        elif self.run_watermark is not None:
+            self.watermark = self.run_watermark
+        self.cursor = None
+        self.run_watermark = None
+        self.run_started_at = None
+
+    def save(self):
+        state = {
+            'watermark': _to_iso(self.watermark),
+            'cursor': {'updated_at': _to_iso(self.cursor[0]), 'doc_id': self.cursor[1]} if self.cursor else None,
+            'run_watermark': _to_iso(self.run_watermark),
+            'run_started_at': _to_iso(self.run_started_at),
+            'failed_ids': self.failed_ids,
+            'location_uv': self.location_uv
+        }
+        # Write to a temporary file first so a crash mid-write never corrupts the checkpoint
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
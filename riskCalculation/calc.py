@@ -1,29 +1,134 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import queue
+import signal
+import sys
 import time
 import os
+import zlib
+
+# Relative imports when loaded as riskCalculation.calc; plain sibling imports when run as a script
+try:
+    from .backfill_state import RUN_START_MARGIN, BackfillCheckpoint, hash_risk_inputs
+    from .monitor_metrics import METRICS, start_json_snapshots, start_metrics_server
+    from .recalc_scheduler import RecalculationScheduler
+    from .user_registry import UserRegistry
+    from .user_roster import LiveRoster
+    from .uv_threshold_index import UVDeltaIndex
+    from .uv_dose import UVDoseAccumulator
+    from .uv_cache import DEFAULT_UV_INTENSITY, UVCache, status_log
+    from .write_coalescer import WriteCoalescer
+    from .write_queue import DurableWriteQueue
+except ImportError:
+    from backfill_state import RUN_START_MARGIN, BackfillCheckpoint, hash_risk_inputs
+    from monitor_metrics import METRICS, start_json_snapshots, start_metrics_server
+    from recalc_scheduler import RecalculationScheduler
+    from user_registry import UserRegistry
+    from user_roster import LiveRoster
+    from uv_threshold_index import UVDeltaIndex
+    from uv_dose import UVDoseAccumulator
+    from uv_cache import DEFAULT_UV_INTENSITY, UVCache, status_log
+    from write_coalescer import WriteCoalescer
+    from write_queue import DurableWriteQueue
 
 # Get the directory where this script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 firebase_key_path = os.path.join(script_dir, 'firebasekey.json')
+# Watermark, cursor and per-location UV readings of the incremental backfill
+DEFAULT_CHECKPOINT_PATH = os.path.join(script_dir, 'backfill_checkpoint.json')
+# Write-ahead logs of the monitors' and the backfill's Firestore writes, one subdirectory each
+WRITE_QUEUE_DIR = os.path.join(script_dir, 'write_queue')
+# How long a queued backfill waits for its writes before reporting the rest as failed
+BACKFILL_FLUSH_TIMEOUT = 300.0
 
-# Check if the firebase key file exists
-if not os.path.exists(firebase_key_path):
-    print(f"Error: firebasekey.json not found at {firebase_key_path}")
-    print("Please place your Firebase service account key file as 'firebasekey.json' in the same directory as this script.")
-    exit(1)
+# Firestore client, created on first use by get_db() so importing this module
+# never touches the network
+_db = None
 
-try:
-    cred = credentials.Certificate(firebase_key_path)
-    firebase_admin.initialize_app(cred)
-    print("Firebase initialized successfully!")
-except Exception as e:
-    print(f"Error initializing Firebase: {e}")
-    print("Please check your firebasekey.json file.")
-    exit(1)
+def get_db():
+    """
+    Return the Firestore client, initializing Firebase the first time it is needed.
+
+    Raises:
+        FileNotFoundError: If firebasekey.json is missing
+    """
+    global _db
+    if _db is None:
+        # Imported here because firebase_admin pulls in the whole Google Cloud client stack
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        # Check if the firebase key file exists
+        if not os.path.exists(firebase_key_path):
+            raise FileNotFoundError(
+                f"firebasekey.json not found at {firebase_key_path}. Please place your Firebase service "
+                "account key file as 'firebasekey.json' in the same directory as this script.")
+
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(firebase_key_path)
+            firebase_admin.initialize_app(cred)
+            print("Firebase initialized successfully!")
+        _db = firestore.client()
+    return _db
+
+# Status and error lines from the hot loops go through status_log so they cannot flood the
+# console. It is uv_cache's logger, so a UV read error logged by UVCache and by
+# get_uv_intensity_from_firebase shares one 'uv_read_error' rate limit.
+
+# Users are recalculated at least this often (seconds), even if UV has not changed
+RECALCULATION_INTERVAL = 900
+# ... and whenever the reading has moved this far from the one they were last calculated at
+UV_CHANGE_THRESHOLD = 100
+# The monitors only write a new final category once the ERS is this far past the band edge,
+# and hold moves to a lower category until the current one has been shown this many seconds
+CATEGORY_HYSTERESIS = 0.1
+CATEGORY_MIN_DWELL = 60
+
+# Cumulative exposure feeds the final score: a full hour at the sensor's max reading (165)
+# adds one final-category band (1.15) to the ERS
+MAX_HOURLY_DOSE = 165 * 3600
+DOSE_WEIGHT = 1.15
+# Recalculate when the dose term has moved this much, even if no single reading changed by 100
+DOSE_MODIFIER_CHANGE_THRESHOLD = 0.1
 
-# Initialize Firestore client
-db = firestore.client()
+# The sharded monitor stores each user's bucket (crc32 of the id) in SHARD_FIELD so every
+# shard can listen to its own range of buckets instead of the whole users collection
+SHARD_BUCKETS = 1024
+SHARD_FIELD = 'monitor_shard'
+# Users created up to this long before the supervisor started are still watched for stamping
+# (server clock skew), and the new-users listener is re-armed this often so it stops
+# hearing about users that have long been stamped
+NEW_USERS_MARGIN = timedelta(minutes=1)
+NEW_USERS_REARM_INTERVAL = 3600
+
+def classify_final_ers(ers):
+    if ers <= 1.15:
+        return "Very Low"
+    elif 1.16 <= ers <= 2.30:
+        return "Low"
+    elif 2.31 <= ers <= 3.45:
+        return "Medium"
+    elif 3.46 <= ers <= 4.60:
+        return "High"
+    elif ers > 4.61:
+        return "Very High"
+
+# Band edges of classify_final_ers: a final category can only change where the ERS crosses one
+FINAL_ERS_EDGES = (1.15, 1.16, 2.30, 2.31, 3.45, 3.46, 4.60, 4.61)
+
+def uv_modifier_for(uv):
+    if uv == 0:
+        return -2.88
+    else:
+        proportion = uv / 165 #165 is max uv intensity
+        return proportion * 2.88 #2.88 is max baseline score, we weight both the same
 
 class User:
     def __init__(self, phototype, age, severity_score, risk_score1=0, uv_intensity=0, location='default_location'):
@@ -37,6 +142,9 @@ class User:
         self.previous_uv_intensity = self.uv_intensity
         self.last_calculation_time = time.time()
         self.risk_score = 0  # Initialize risk_score
+        # Cumulative exposure, updated with every reading
+        self.uv_dose = UVDoseAccumulator()
+        self.dose_modifier_at_last_calculation = 0.0
 
     def get_ref(self):
         ref_table = {
@@ -86,16 +194,7 @@ class User:
             return "Very High"
 
     def classify_ers_final(self, ers):
-        if ers <= 1.15:
-            return "Very Low"
-        elif 1.16 <= ers <= 2.30:
-            return "Low"
-        elif 2.31 <= ers <= 3.45:
-            return "Medium"
-        elif 3.46 <= ers <= 4.60:
-            return "High"
-        elif ers > 4.61:
-            return "Very High"
+        return classify_final_ers(ers)
 
     def calculate_baseline_erythemal_risk_score(self):
         ref = self.get_ref()
@@ -119,17 +218,25 @@ class User:
         The sensor data is a raw integer value, not a UV index.
         Uses the raw sensor data directly without any scaling.
         """
-        uv = self.uv_intensity
-        if uv == 0:
-            return -2.88
-        else:
-            proportion = uv / 165 #165 is max uv intensity
-            return proportion * 2.88 #2.88 is max baseline score, we weight both the same
+        return uv_modifier_for(self.uv_intensity)
+
+    def record_uv_sample(self, raw_sensor_data, timestamp=None):
+        """
+        Add a reading to the user's cumulative dose without recalculating the risk score.
+        """
+        self.uv_dose.add_sample(raw_sensor_data, timestamp)
+
+    def get_dose_modifier(self):
+        """
+        ERS term for the UV dose received over the last hour (0 until readings have been recorded).
+        """
+        return self.uv_dose.dose_last_window() / MAX_HOURLY_DOSE * DOSE_WEIGHT
 
     def calculate_final_erythemal_risk_score(self):
         baseline = self.calculate_baseline_erythemal_risk_score()
         uv_modifier = self.get_uv_modifier()
-        ers = baseline["Basline Risk Score"] + uv_modifier
+        dose_modifier = self.get_dose_modifier()
+        ers = baseline["Basline Risk Score"] + uv_modifier + dose_modifier
         risk_category = self.classify_ers_final(ers)
         self.risk_score = ers  # Store the final risk score in the user instance
         return {
@@ -137,6 +244,9 @@ class User:
             "Age Modifier": baseline["Age Modifier"],
             "Condition Modifier": baseline["Condition Modifier"],
             "UV Modifier": uv_modifier,
+            "Dose Modifier": dose_modifier,
+            "UV Dose (last hour)": self.uv_dose.dose_last_window(),
+            "UV Dose (today)": self.uv_dose.today_dose,
             "ERS": ers,
             "Risk Category": risk_category
         }
@@ -154,14 +264,18 @@ class User:
         current_time = time.time()
         time_since_last_calculation = current_time - self.last_calculation_time
         
+        # Every reading counts towards the cumulative dose, even ones that do not trigger a recalculation
+        self.record_uv_sample(raw_sensor_data, current_time)
+        dose_change = abs(self.get_dose_modifier() - self.dose_modifier_at_last_calculation)
+        
         # Check if raw sensor data changed by 100 or more
         sensor_data_change = abs(raw_sensor_data - self.previous_uv_intensity)
         
         # Check if 15 minutes (900) seconds) have passed since last calculation
-        time_threshold_exceeded = time_since_last_calculation >= 900
+        time_threshold_exceeded = time_since_last_calculation >= RECALCULATION_INTERVAL
         
-        # Recalculate if sensor data changed by 100+ OR 15 minutes have passed
-        if sensor_data_change >= 100 or time_threshold_exceeded:
+        # Recalculate if sensor data changed by 100+ OR 15 minutes have passed OR the dose built up
+        if sensor_data_change >= 100 or time_threshold_exceeded or dose_change >= DOSE_MODIFIER_CHANGE_THRESHOLD:
             # Update UV intensity with raw sensor data
             self.uv_intensity = raw_sensor_data
             
@@ -171,9 +285,15 @@ class User:
             # Update tracking variables
             self.previous_uv_intensity = raw_sensor_data
             self.last_calculation_time = current_time
+            self.dose_modifier_at_last_calculation = result["Dose Modifier"]
             
-            print(f"Risk score recalculated - Sensor data change: {sensor_data_change}, Time since last: {time_since_last_calculation:.1f}s")
-            print(f"Raw sensor data: {raw_sensor_data}, UV modifier: {result['UV Modifier']:.3f}")
+            if sensor_data_change >= 100:
+                reason = 'uv_delta'
+            elif time_threshold_exceeded:
+                reason = 'timer'
+            else:
+                reason = 'dose'
+            METRICS.inc('risk_recalculations_total', reason=reason)
             return result
         else:
             # No recalculation needed
@@ -211,15 +331,73 @@ class User:
             # Wait 1 second before next update
             time.sleep(1)
 
-def get_uv_intensity_from_firebase(location='default_location'):
+def get_age_band(age):
+    """
+    Index of the age band used by User.get_age_modifier: 0 (<20), 1 (20-39), 2 (40-59), 3 (60-69), 4 (70+).
+    """
+    if age < 20:
+        return 0
+    elif 20 <= age <= 39:
+        return 1
+    elif 40 <= age <= 59:
+        return 2
+    elif 60 <= age <= 69:
+        return 3
+    else:
+        return 4
+
+def get_baseline_code(phototype, age, severity_score):
+    """
+    Index into BASELINE_TABLE for a user's phototype, age and severity.
+
+    Raises:
+        KeyError: If phototype or severity_score is out of range, like User.get_ref does
+    """
+    if phototype not in range(1, 7) or severity_score not in range(0, 6):
+        raise KeyError((phototype, severity_score))
+    return ((int(phototype) - 1) * 5 + get_age_band(age)) * 6 + int(severity_score)
+
+def _build_baseline_table():
+    """
+    Baseline ERS only depends on phototype (1-6), age band (5) and severity (0-5), so all 180
+    (score, category) pairs are computed once with User itself and looked up afterwards.
+    """
+    band_ages = (10, 30, 50, 65, 80)  # one age inside each band
+    table = []
+    for phototype in range(1, 7):
+        for age in band_ages:
+            for severity_score in range(6):
+                baseline = User(phototype, age, severity_score).calculate_baseline_erythemal_risk_score()
+                table.append((baseline["Basline Risk Score"], baseline["Baseline Risk Category"]))
+    return table
+
+BASELINE_TABLE = _build_baseline_table()
+
+def final_category_breakpoints(baseline_code):
+    """
+    UV readings at which the final category of a BASELINE_TABLE entry (with no dose term)
+    can change: 0, where uv_modifier_for jumps, and the reading at which the ERS reaches
+    each band edge above the baseline (uv_modifier_for solved for uv).
+    """
+    baseline_ers = BASELINE_TABLE[baseline_code][0]
+    return [0.0] + [(edge - baseline_ers) / 2.88 * 165 for edge in FINAL_ERS_EDGES if edge >= baseline_ers]
+
+def registry_final_category(baseline_code, uv):
+    """Final category of a BASELINE_TABLE entry at a UV reading, as recalculate_registry_user scores it."""
+    return classify_final_ers(BASELINE_TABLE[baseline_code][0] + uv_modifier_for(uv))
+
+def get_uv_intensity_from_firebase(location='default_location', client=None):
     """
     Get UV intensity from Firestore.
     For now, returns a default value since we don't have UV data in Firestore yet.
     """
+    client = client or get_db()
     try:
         # Try to get UV intensity from Firestore
-        uv_ref = db.collection('uv_intensity').document(location)
-        uv_doc = uv_ref.get()
+        uv_ref = client.collection('uv_intensity').document(location)
+        with METRICS.timer('firestore_read_seconds', source='uv_intensity'):
+            uv_doc = uv_ref.get()
+        METRICS.inc('firestore_reads_total', source='uv_intensity')
         
         if uv_doc.exists:
             uv_data = uv_doc.to_dict()
@@ -228,42 +406,203 @@ def get_uv_intensity_from_firebase(location='default_location'):
             # Return default value if no UV data exists
             return 100
     except Exception as e:
-        print(f"Error getting UV intensity: {e}")
+        METRICS.inc('firestore_errors_total', source='uv_intensity')
+        status_log.log('uv_read_error', f"Error getting UV intensity: {e}")
         return 100  # Default value
 
-def add_risk_categories_to_users():
+def extract_user_inputs(user_info):
+    """
+    Pull the risk inputs out of a Firestore user document, applying the usual defaults.
+
+    Returns:
+        tuple: (phototype, age, severity_score, location)
+    """
+    phototype = user_info.get('skinToneIndex', 3)
+    age = int(user_info.get('age', 25))  # Ensure age is an integer
+    severity_score = int(user_info.get('conditionSeverity', 0))  # Ensure severity is an integer
+    location = user_info.get('location', 'default_location')
+    return phototype, age, severity_score, location
+
+def _commit_update_chunk(client, chunk):
+    """
+    Commit one chunk of (user_id, doc_ref, fields) updates as a single write batch.
+
+    A write batch is atomic, so if the commit fails every document in the chunk is
+    retried on its own to find out which ones actually fail.
+
+    Returns:
+        dict: user_id -> error message for documents that could not be written
+    """
+    batch = client.batch()
+    for _, doc_ref, fields in chunk:
+        batch.update(doc_ref, fields)
+    try:
+        batch.commit()
+        return {}
+    except Exception:
+        failures = {}
+        for user_id, doc_ref, fields in chunk:
+            try:
+                doc_ref.update(fields)
+            except Exception as e:
+                failures[user_id] = str(e)
+        return failures
+
+def _add_risk_categories_bulk(client, users_list, batch_size, commit_concurrency, write_queue=None,
+                              flush_timeout=BACKFILL_FLUSH_TIMEOUT):
+    """
+    Bulk version of add_risk_categories_to_users: scores every user in one vectorized pass
+    and writes the categories with batched commits running concurrently (or hands them to
+    write_queue, which batches them itself, and waits up to flush_timeout for it).
+    """
+    # Imported here so scoring a single user never needs NumPy
+    try:
+        from .risk_batch import calculate_risk_scores_batch, category_labels
+    except ImportError:
+        from risk_batch import calculate_risk_scores_batch, category_labels
+
+    failures = {}
+    uv_by_location = {}
+    user_ids, doc_refs, phototypes, ages, severities, uv_values = [], [], [], [], [], []
+
+    for user_doc in users_list:
+        try:
+            phototype, age, severity_score, location = extract_user_inputs(user_doc.to_dict())
+            if phototype not in range(1, 7) or severity_score not in range(0, 6):
+                raise ValueError(f"invalid phototype {phototype!r} or severity {severity_score!r}")
+        except Exception as e:
+            failures[user_doc.id] = str(e)
+            continue
+        if location not in uv_by_location:
+            uv_by_location[location] = get_uv_intensity_from_firebase(location, client=client)
+        user_ids.append(user_doc.id)
+        doc_refs.append(user_doc.reference)
+        phototypes.append(phototype)
+        ages.append(age)
+        severities.append(severity_score)
+        uv_values.append(uv_by_location[location])
+
+    updates = []
+    if user_ids:
+        scores = calculate_risk_scores_batch(phototypes, ages, severities, uv_values)
+        baseline_categories = category_labels(scores["baseline_category"])
+        final_categories = category_labels(scores["final_category"])
+        for i, user_id in enumerate(user_ids):
+            updates.append((user_id, doc_refs[i], {
+                'baseline_risk_category': baseline_categories[i],
+                'final_risk_category': final_categories[i]
+            }))
+
+    write_failures = {}
+    if write_queue is not None:
+        queued = {write_queue.update(doc_ref, fields): user_id for user_id, doc_ref, fields in updates}
+        print(f"  Queued {len(updates)} updates")
+        write_failures = _wait_for_write_queue(write_queue, queued, flush_timeout)
+        failures.update(write_failures)
+        return {'processed': len(users_list), 'updated': len(updates) - len(write_failures), 'failed': failures}
+    chunks = [updates[i:i + batch_size] for i in range(0, len(updates), batch_size)]
+    with ThreadPoolExecutor(max_workers=commit_concurrency) as executor:
+        results = executor.map(lambda chunk: _commit_update_chunk(client, chunk), chunks)
+        for chunk_number, (chunk, chunk_failures) in enumerate(zip(chunks, results), 1):
+            write_failures.update(chunk_failures)
+            print(f"  Committed batch {chunk_number}/{len(chunks)} ({len(chunk) - len(chunk_failures)} ok, {len(chunk_failures)} failed)")
+
+    failures.update(write_failures)
+    return {
+        'processed': len(users_list),
+        'updated': len(updates) - len(write_failures),
+        'failed': failures
+    }
+
+def _wait_for_write_queue(write_queue, queued, timeout):
+    """
+    Block until the backfill's queued writes are committed or dead-lettered, or timeout
+    seconds have passed (a Firestore outage is retried for as long as it lasts).
+
+    Args:
+        queued: Sequence number -> user id of the writes this run queued
+
+    Returns:
+        dict: user_id -> error message for writes that were dead-lettered or are still
+              uncommitted (those stay in the write-ahead log and are replayed next time)
+    """
+    if not queued:
+        return {}
+    print(f"Waiting for {write_queue.pending()} queued writes...")
+    finished = write_queue.flush(timeout)
+    failures = {queued[entry['seq']]: entry['error']
+                for entry in write_queue.read_dead_letters(min(queued) - 1) if entry['seq'] in queued}
+    if not finished:
+        for seq, user_id in queued.items():
+            if not write_queue.is_done(seq):
+                failures[user_id] = (f"not committed within {timeout:.0f}s; left in {write_queue.directory} "
+                                     f"to be replayed on the next run")
+    if failures:
+        print(f"  ✗ {len(failures)} writes failed or are still pending; dead letters are in "
+              f"{write_queue.dead_letter_path}")
+    return failures
+
+def add_risk_categories_to_users(bulk=False, batch_size=500, commit_concurrency=4, client=None, write_queue=None,
+                                 flush_timeout=BACKFILL_FLUSH_TIMEOUT):
     """
     Add baseline_risk_category and final_risk_category fields to all users in Firestore.
     This is a focused function that only adds the two string fields you need.
+
+    Args:
+        bulk: Score all users in one vectorized pass and write them with batched commits
+              instead of one update round trip per user
+        batch_size: Number of updates per write batch in bulk mode (Firestore allows at most 500)
+        commit_concurrency: Number of batch commits allowed in flight at once in bulk mode
+        client: Firestore client to use; defaults to the module client (pass a fake or an
+                emulator-backed client for testing)
+        write_queue: Optional DurableWriteQueue; updates are logged to it and committed
+                     (with retries) in the background, and this waits until they are done
+        flush_timeout: Seconds to wait for write_queue; writes still uncommitted by then
+                       are reported as failed (and replayed by the queue's next run)
+
+    Returns:
+        dict: Counts of processed/updated users and a user_id -> error map of failures,
+              or None if Firestore could not be read
     """
+    client = client or get_db()
     try:
         # Get all users from Firestore
-        users_ref = db.collection('users')
+        users_ref = client.collection('users')
         users_docs = users_ref.stream()
         
         users_list = list(users_docs)
         if not users_list:
             print("No users found in the database.")
-            return
+            return {'processed': 0, 'updated': 0, 'failed': {}}
 
         print(f"Adding risk categories to {len(users_list)} users...")
         print("-" * 60)
 
+        if bulk:
+            summary = _add_risk_categories_bulk(client, users_list, min(batch_size, 500), commit_concurrency,
+                                                write_queue, flush_timeout)
+            for user_id, error in summary['failed'].items():
+                print(f"  ✗ Error processing user {user_id}: {error}")
+            print(f"Risk categories added: {summary['updated']} updated, {len(summary['failed'])} failed.")
+            return summary
+
+        failures = {}
+        queued = {}
+        uv_by_location = {}
         for user_doc in users_list:
             try:
                 user_id = user_doc.id
                 user_info = user_doc.to_dict()
                 
                 # Extract user attributes
-                phototype = user_info.get('skinToneIndex', 3)
-                age = int(user_info.get('age', 25))  # Ensure age is an integer
-                severity_score = int(user_info.get('conditionSeverity', 0))  # Ensure severity is an integer
-                location = user_info.get('location', 'default_location')
+                phototype, age, severity_score, location = extract_user_inputs(user_info)
 
                 print(f"Processing user {user_id}...")
 
-                # Get UV intensity
-                uv_intensity = get_uv_intensity_from_firebase(location)
+                # Get UV intensity (once per location per run)
+                if location not in uv_by_location:
+                    uv_by_location[location] = get_uv_intensity_from_firebase(location, client=client)
+                uv_intensity = uv_by_location[location]
 
                 # Create user and calculate risk scores
                 user = User(phototype, age, severity_score, uv_intensity=uv_intensity, location=location)
@@ -271,10 +610,14 @@ def add_risk_categories_to_users():
                 final = user.calculate_final_erythemal_risk_score()
 
                 # Update ONLY the two category fields in Firestore
-                user_doc.reference.update({
+                fields = {
                     'baseline_risk_category': baseline["Baseline Risk Category"],
                     'final_risk_category': final["Risk Category"]
-                })
+                }
+                if write_queue is not None:
+                    queued[write_queue.update(user_doc.reference, fields)] = user_id
+                else:
+                    user_doc.reference.update(fields)
                 
                 print(f"  ✓ Added categories for user {user_id}:")
                 print(f"    Baseline: {baseline['Baseline Risk Category']}")
@@ -283,30 +626,264 @@ def add_risk_categories_to_users():
 
             except Exception as e:
                 print(f"  ✗ Error processing user {user_id}: {e}")
+                failures[user_id] = str(e)
                 continue
 
-        print("Risk categories added successfully!")
+        if write_queue is not None:
+            write_failures = _wait_for_write_queue(write_queue, queued, flush_timeout)
+            for user_id, error in write_failures.items():
+                print(f"  ✗ Error writing user {user_id}: {error}")
+            failures.update(write_failures)
+        if failures:
+            print(f"Risk categories added: {len(users_list) - len(failures)} updated, {len(failures)} failed.")
+        else:
+            print("Risk categories added successfully!")
+        return {
+            'processed': len(users_list),
+            'updated': len(users_list) - len(failures),
+            'failed': failures
+        }
 
     except Exception as e:
         print(f"Error accessing Firestore: {e}")
 
-def continuously_monitor_uv_updates():
+def _incremental_page_query(client, checkpoint, page_size):
+    """Build the query for the next page of users the incremental backfill has not seen yet."""
+    users_ref = client.collection('users')
+    if checkpoint.watermark is None:
+        # No finished run yet, so there is nothing to compare against: walk every user by id
+        query = users_ref.order_by('__name__').limit(page_size)
+        if checkpoint.cursor:
+            query = query.start_after({'__name__': checkpoint.cursor[1]})
+        return query
+    query = users_ref.order_by('updatedAt').order_by('__name__').limit(page_size)
+    if checkpoint.cursor:
+        return query.start_after({'updatedAt': checkpoint.cursor[0], '__name__': checkpoint.cursor[1]})
+    return query.start_after({'updatedAt': checkpoint.watermark})
+
+def _uv_changed_locations(client, checkpoint, uv_by_location):
+    """Locations whose UV reading differs from the one the last finished run scored them with."""
+    changed = []
+    for location, previous_uv in checkpoint.location_uv.items():
+        if location not in uv_by_location:
+            uv_by_location[location] = get_uv_intensity_from_firebase(location, client=client)
+        if uv_by_location[location] != previous_uv:
+            changed.append(location)
+    return changed
+
+def _backfill_changed_users(client, users_docs, uv_by_location, stamp_time=None):
     """
-    Continuously monitor UV intensity changes and update final risk categories for all users.
-    This function runs indefinitely and updates risk scores when UV changes by 100+ or every 15 minutes.
+    Rescore the given user documents, skipping users whose inputs hash to the value stored last time.
+
+    Every write also stores risk_location (the location the user was scored at, after
+    defaults) so a UV change can find the location's users, and gives users without an
+    updatedAt one (stamp_time), since paging by updatedAt leaves them out.
+
+    Returns:
+        tuple: (updated count, skipped count, {user_id: error} for bad inputs, {user_id: error} for failed writes)
     """
-    print("Starting continuous UV monitoring...")
-    print("This will monitor UV changes and update final risk categories in real-time")
-    print("Press Ctrl+C to stop monitoring")
+    updates, input_failures = [], {}
+    skipped = 0
+    for user_doc in users_docs:
+        try:
+            user_info = user_doc.to_dict()
+            phototype, age, severity_score, location = extract_user_inputs(user_info)
+            if location not in uv_by_location:
+                uv_by_location[location] = get_uv_intensity_from_firebase(location, client=client)
+            uv_intensity = uv_by_location[location]
+
+            inputs_hash = hash_risk_inputs(phototype, age, severity_score, location, uv_intensity)
+            missing_updated_at = user_info.get('updatedAt') is None and stamp_time is not None
+            if (user_info.get('risk_inputs_hash') == inputs_hash and user_info.get('risk_location') == location
+                    and not missing_updated_at):
+                skipped += 1
+                continue
+
+            user = User(phototype, age, severity_score, uv_intensity=uv_intensity, location=location)
+            baseline = user.calculate_baseline_erythemal_risk_score()
+            final = user.calculate_final_erythemal_risk_score()
+            fields = {
+                'baseline_risk_category': baseline["Baseline Risk Category"],
+                'final_risk_category': final["Risk Category"],
+                'risk_inputs_hash': inputs_hash,
+                'risk_location': location
+            }
+            if missing_updated_at:
+                fields['updatedAt'] = stamp_time
+            updates.append((user_doc.id, user_doc.reference, fields))
+        except Exception as e:
+            input_failures[user_doc.id] = str(e)
+
+    write_failures = _commit_update_chunk(client, updates) if updates else {}
+    return len(updates) - len(write_failures), skipped, input_failures, write_failures
+
+def add_risk_categories_incremental(page_size=500, checkpoint_path=DEFAULT_CHECKPOINT_PATH, client=None):
+    """
+    Incremental version of add_risk_categories_to_users.
+
+    Only users whose updatedAt is newer than the watermark left by the last finished run are
+    read, plus the users of every location whose UV reading has changed since that run (the
+    final category depends on it), found by the risk_location each write stores. Users whose
+    inputs hash to the value stored on their document are skipped without a write. Progress
+    is checkpointed after every committed page of updated users, so an interrupted run
+    resumes from where it stopped; the UV pass is cheap to redo and starts over. The first
+    run has no watermark and scans everyone, giving users without an updatedAt one so that
+    later runs see their edits.
+
+    Args:
+        page_size: Users read and committed per page (Firestore allows at most 500 writes per batch)
+        checkpoint_path: JSON file holding the watermark and the cursor of the run in progress
+        client: Firestore client to use; defaults to the module client
+
+    Returns:
+        dict: Counts of processed/updated/skipped users and a user_id -> error map of failures
+    """
+    client = client or get_db()
+    page_size = min(page_size, 500)
+    checkpoint = BackfillCheckpoint(checkpoint_path)
+    summary = {'processed': 0, 'updated': 0, 'skipped': 0, 'failed': {}}
+    uv_by_location = {}
+    full_scan = checkpoint.watermark is None
+
+    if checkpoint.in_progress:
+        print(f"Resuming interrupted backfill after user {checkpoint.cursor[1]}...")
+    elif full_scan:
+        print("No watermark found, processing every user...")
+    else:
+        print(f"Processing users updated since {checkpoint.watermark.isoformat()}...")
     print("-" * 60)
-    
-    # Get all users once at startup
-    users_ref = db.collection('users')
-    users_docs = list(users_ref.stream())
-    
-    if not users_docs:
-        print("No users found in the database.")
-        return
+
+    checkpoint.start_run(datetime.now(timezone.utc))
+    checkpoint.save()
+    # Stamped on users without an updatedAt; no later than this run's watermark
+    stamp_time = checkpoint.run_started_at - RUN_START_MARGIN
+
+    def backfill(users_docs):
+        result = _backfill_changed_users(client, users_docs, uv_by_location, stamp_time)
+        updated, skipped, input_failures, write_failures = result
+        summary['processed'] += len(users_docs)
+        summary['updated'] += updated
+        summary['skipped'] += skipped
+        summary['failed'].update(input_failures)
+        summary['failed'].update(write_failures)
+        checkpoint.failed_ids = sorted(set(checkpoint.failed_ids) | set(write_failures))
+        return result
+
+    # Users whose write failed last time are behind the watermark now, so retry them directly
+    if checkpoint.failed_ids:
+        retry_refs = [client.collection('users').document(user_id) for user_id in checkpoint.failed_ids]
+        retry_docs = [user_doc for user_doc in client.get_all(retry_refs) if user_doc.exists]
+        checkpoint.failed_ids = []
+        updated, _, _, write_failures = backfill(retry_docs)
+        print(f"  Retried {len(retry_docs)} previously failed users: {updated} updated, {len(write_failures)} failed")
+        checkpoint.save()
+
+    page_number = 0
+    while True:
+        users_docs = list(_incremental_page_query(client, checkpoint, page_size).stream())
+        if not users_docs:
+            break
+        page_number += 1
+
+        updated, skipped, input_failures, write_failures = backfill(users_docs)
+        last_doc = users_docs[-1]
+        checkpoint.advance(last_doc.to_dict().get('updatedAt'), last_doc.id)
+        checkpoint.save()
+        print(f"  Page {page_number}: {len(users_docs)} users, {updated} updated, {skipped} unchanged, "
+              f"{len(input_failures) + len(write_failures)} failed")
+
+        if len(users_docs) < page_size:
+            break
+
+    # A full scan has just scored everyone at the current readings
+    for location in [] if full_scan else _uv_changed_locations(client, checkpoint, uv_by_location):
+        query = client.collection('users').where('risk_location', '==', location).order_by('__name__').limit(page_size)
+        users_docs = list(query.stream())
+        while users_docs:
+            updated, skipped, input_failures, write_failures = backfill(users_docs)
+            print(f"  UV changed at {location}: {len(users_docs)} users, {updated} updated, {skipped} unchanged, "
+                  f"{len(input_failures) + len(write_failures)} failed")
+            if len(users_docs) < page_size:
+                break
+            users_docs = list(query.start_after({'__name__': users_docs[-1].id}).stream())
+        checkpoint.save()
+
+    checkpoint.finish(uv_by_location)
+    checkpoint.save()
+    for user_id, error in summary['failed'].items():
+        print(f"  ✗ Error processing user {user_id}: {error}")
+    print(f"Incremental backfill done: {summary['processed']} users read, {summary['updated']} updated, "
+          f"{summary['skipped']} unchanged, {len(summary['failed'])} failed.")
+    return summary
+
+def shard_bucket(user_id):
+    """
+    Stable bucket for a user: the same id lands in the same bucket in every process and
+    on every run (unlike hash(), which is salted per process).
+    """
+    return zlib.crc32(user_id.encode('utf-8')) % SHARD_BUCKETS
+
+def shard_for(user_id, shard_count):
+    """Shard index for a user: shards own contiguous ranges of buckets (see shard_bucket_range)."""
+    return shard_bucket(user_id) * shard_count // SHARD_BUCKETS
+
+def shard_bucket_range(shard_index, shard_count):
+    """
+    Buckets owned by a shard, as (lo, hi) with lo <= bucket < hi; every bucket b with
+    shard_for mapping it to shard_index is in the range.
+    """
+    return (-(-shard_index * SHARD_BUCKETS // shard_count),
+            -(-(shard_index + 1) * SHARD_BUCKETS // shard_count))
+
+def shard_users_query(client, shard_index, shard_count):
+    """Query for one shard's users, filtered on the stored SHARD_FIELD by the server."""
+    lo, hi = shard_bucket_range(shard_index, shard_count)
+    return client.collection('users').where(SHARD_FIELD, '>=', lo).where(SHARD_FIELD, '<', hi)
+
+def stamp_shard_buckets(client, user_docs):
+    """
+    Store shard_bucket(user_id) on every user document that lacks it (or has a stale value),
+    so shard_users_query can see the user. Documents that already hold the right bucket are
+    not written, so restarting the supervisor costs one read per user and no writes.
+
+    Args:
+        client: Firestore client
+        user_docs: Iterable of user document snapshots
+
+    Returns:
+        dict: {'stamped': int, 'failed': {user_id: error message}}
+    """
+    updates = [(doc.id, doc.reference, {SHARD_FIELD: shard_bucket(doc.id)})
+               for doc in user_docs if doc.exists and doc.to_dict().get(SHARD_FIELD) != shard_bucket(doc.id)]
+    failed = {}
+    for start in range(0, len(updates), 500):
+        failed.update(_commit_update_chunk(client, updates[start:start + 500]))
+    return {'stamped': len(updates) - len(failed), 'failed': failed}
+
+def watch_new_users(client, since, on_docs):
+    """
+    Listen to users created at or after `since` (by the app's createdAt server timestamp)
+    and pass every changed document to on_docs(list of snapshots) on the listener thread.
+
+    Returns:
+        watch; call watch.unsubscribe() when done
+    """
+    def on_snapshot(doc_snapshots, changes, read_time):
+        docs = [change.document for change in changes if change.type.name != 'REMOVED']
+        if docs:
+            on_docs(docs)
+    return client.collection('users').where('createdAt', '>=', since).on_snapshot(on_snapshot)
+
+def load_monitored_users(client=None):
+    """
+    Build the monitor's roster from the users collection with a one-off scan
+    (start_live_roster keeps it current instead).
+
+    Returns:
+        dict: user_id -> {'user': User, 'doc_ref': DocumentReference, 'location': str}
+    """
+    client = client or get_db()
+    users_docs = list(client.collection('users').stream())
     
     # Create User objects for each user
     user_objects = {}
@@ -315,10 +892,7 @@ def continuously_monitor_uv_updates():
             user_id = user_doc.id
             user_info = user_doc.to_dict()
             
-            phototype = user_info.get('skinToneIndex', 3)
-            age = int(user_info.get('age', 25))
-            severity_score = int(user_info.get('conditionSeverity', 0))
-            location = user_info.get('location', 'default_location')
+            phototype, age, severity_score, location = extract_user_inputs(user_info)
             
             # Create user object
             user = User(phototype, age, severity_score, location=location)
@@ -328,45 +902,249 @@ def continuously_monitor_uv_updates():
                 'location': location
             }
             
-            print(f"✓ Initialized monitoring for user {user_id}")
-            
         except Exception as e:
-            print(f"✗ Error initializing user {user_id}: {e}")
+            status_log.log('init_error', f"✗ Error initializing user {user_id}: {e}")
             continue
+    print(f"✓ Initialized monitoring for {len(user_objects)} users")
+    return user_objects
+
+def start_live_roster(client=None, query=None, timeout=60):
+    """
+    Subscribe a LiveRoster to the users collection and load it from the first snapshot.
+
+    Args:
+        client: Firestore client (defaults to get_db())
+        query: Optional query to listen to instead of the whole collection, e.g.
+               shard_users_query() for the sharded monitor
+        timeout: Seconds to wait for the first snapshot
+
+    Returns:
+        tuple: (LiveRoster, watch); call watch.unsubscribe() when done
+    """
+    client = client or get_db()
+    roster = LiveRoster(extract_user_inputs, User)
+    watch = (query if query is not None else client.collection('users')).on_snapshot(roster.on_snapshot)
+    if not roster.wait_ready(timeout):
+        print(f"✗ No users snapshot after {timeout}s; starting with an empty roster")
+    summary = roster.apply_pending()
+    for user_id, error in summary['failed'].items():
+        status_log.log('init_error', f"✗ Error initializing user {user_id}: {error}")
+    print(f"✓ Initialized monitoring for {len(roster)} users")
+    return roster, watch
+
+def apply_roster_changes(roster, coalescer, current_time, scheduler=None):
+    """
+    Apply the roster changes queued by the users listener and log them.
+
+    Args:
+        scheduler: Optional RecalculationScheduler; new and edited users are made due now
+                   and removed ones are dropped from it
+
+    Returns:
+        dict: The summary from LiveRoster.apply_pending()
+    """
+    summary = roster.apply_pending()
+    for user_id in summary['removed']:
+        coalescer.discard(user_id)
+        if scheduler is not None:
+            scheduler.discard(user_id)
+    if scheduler is not None:
+        now = time.time()
+        scheduler.schedule_all(summary['added'], now)
+        scheduler.schedule_all(summary['updated'], now)
+    for user_id, error in summary['failed'].items():
+        status_log.log('roster_error', f"[{current_time}] Error reading user {user_id}: {error}")
+    for change in ('added', 'updated', 'removed'):
+        if summary[change]:
+            METRICS.inc('roster_changes_total', len(summary[change]), change=change)
+    if summary['added'] or summary['updated'] or summary['removed']:
+        METRICS.set_gauge('monitored_users', len(roster))
+        status_log.log('roster', f"[{current_time}] Roster: {len(summary['added'])} added, "
+                                 f"{len(summary['updated'])} updated, {len(summary['removed'])} removed "
+                                 f"({len(roster)} users)")
+    return summary
+
+def new_write_queue(name, client=None):
+    """DurableWriteQueue logging to WRITE_QUEUE_DIR/<name>; close() it when done."""
+    return DurableWriteQueue(client or get_db(), os.path.join(WRITE_QUEUE_DIR, name), name=name)
+
+def new_write_coalescer(client=None, write_queue=None):
+    """WriteCoalescer with the monitors' hysteresis, dwell time and refresh interval."""
+    return WriteCoalescer(client or get_db(), classify_final_ers, hysteresis=CATEGORY_HYSTERESIS,
+                          min_dwell=CATEGORY_MIN_DWELL, refresh_interval=RECALCULATION_INTERVAL,
+                          write_queue=write_queue)
+
+def next_recalculation_check(user, now):
+    """
+    Latest time a user can be left alone while the reading at their location stays the same.
+
+    That is the 15-minute timer, or earlier if the dose term could reach
+    DOSE_MODIFIER_CHANGE_THRESHOLD before then: the window dose moves at most
+    uv_dose.peak_rate() per second, plus one bucket for expiry happening a bucket at a time.
+    """
+    due = user.last_calculation_time + RECALCULATION_INTERVAL
+    rate = user.uv_dose.peak_rate() * DOSE_WEIGHT / MAX_HOURLY_DOSE  # dose modifier per second
+    if rate > 0:
+        headroom = DOSE_MODIFIER_CHANGE_THRESHOLD - abs(user.get_dose_modifier() - user.dose_modifier_at_last_calculation)
+        due = min(due, now + max(1.0, headroom / rate - user.uv_dose.bucket_seconds))
+    return due
+
+def schedule_next_check(scheduler, user_id, user, now, coalescer=None):
+    """
+    Schedule a user's next visit: next_recalculation_check(), or earlier when the coalescer
+    holds a move down for them, so the loop is awake to flush it once it is eligible.
+    """
+    due = next_recalculation_check(user, now)
+    held_until = coalescer.held_until(user_id) if coalescer is not None else None
+    scheduler.schedule(user_id, min(due, held_until) if held_until is not None else due)
+
+def apply_uv_reading(user_id, user_data, current_uv, current_time, coalescer=None):
+    """
+    Feed one UV reading to a monitored user and write the new final category if it was recalculated.
+
+    Args:
+        coalescer: If given, the update is handed to this WriteCoalescer (which skips
+                   unchanged categories and writes on its next flush) instead of being
+                   written straight away
+
+    Returns:
+        bool: True if the user's risk score was recalculated and written (or queued)
+    """
+    try:
+        # Try to recalculate risk score
+        result = user_data['user'].recalculate_risk_score(current_uv)
+        
+        if result and coalescer is not None:
+            return coalescer.submit(user_id, user_data['doc_ref'], result["ERS"], {
+                'last_uv_update': current_time,
+                'current_uv_intensity': current_uv,
+                'uv_dose_last_hour': result["UV Dose (last hour)"],
+                'uv_dose_today': result["UV Dose (today)"]
+            })
+        if result:
+            # Update the final risk category in Firestore
+            with METRICS.timer('firestore_write_seconds', source='monitor'):
+                user_data['doc_ref'].update({
+                    'final_risk_category': result["Risk Category"],
+                    'last_uv_update': current_time,
+                    'current_uv_intensity': current_uv,
+                    'uv_dose_last_hour': result["UV Dose (last hour)"],
+                    'uv_dose_today': result["UV Dose (today)"]
+                })
+            METRICS.inc('firestore_writes_total', source='monitor')
+            return True
+        
+    except Exception as e:
+        METRICS.inc('firestore_errors_total', source='monitor')
+        status_log.log('monitor_update_error', f"[{current_time}] Error updating user {user_id}: {e}")
+    return False
+
+def run_monitor_tick(user_objects, uv_cache, monitored_locations, current_time, coalescer=None,
+                     scheduler=None, by_location=None):
+    """
+    One pass of continuously_monitor_uv_updates over the monitored users.
+
+    Args:
+        coalescer: Optional WriteCoalescer; the tick's writes are flushed through it in batches
+        scheduler: Optional RecalculationScheduler holding every user in user_objects. Only
+                   users that are due and users at locations whose reading changed are
+                   visited (by_location, location -> user ids, is then required); without
+                   it every user is visited
+        by_location: Users per location, e.g. LiveRoster.by_location
+
+    Returns:
+        int: Number of users whose final category was recalculated and written
+    """
+    updates_made = 0
+    uv_cache.prefetch(monitored_locations)
     
-    print(f"\nMonitoring {len(user_objects)} users...")
+    if scheduler is None:
+        visits = user_objects
+        readings = None
+    else:
+        now = time.time()
+        readings = {location: uv_cache.get(location) for location in monitored_locations}
+        visits = set(scheduler.pop_due(now))
+        for location in scheduler.changed_locations(readings):
+            visits.update(by_location.get(location, ()))
+    METRICS.inc('monitor_user_visits_total', len(visits))
+    
+    for user_id in visits:
+        user_data = user_objects.get(user_id)
+        if user_data is None:
+            continue
+        # Get current UV intensity for this user's location
+        current_uv = readings[user_data['location']] if readings is not None else uv_cache.get(user_data['location'])
+        if apply_uv_reading(user_id, user_data, current_uv, current_time, coalescer):
+            updates_made += 1
+        if scheduler is not None:
+            schedule_next_check(scheduler, user_id, user_data['user'], now, coalescer)
+    if coalescer is not None:
+        coalescer.flush()
+    return updates_made
+
+def continuously_monitor_uv_updates(uv_cache_ttl=0.5, stats_interval=60):
+    """
+    Continuously monitor UV intensity changes and update final risk categories for all users.
+    This function runs indefinitely and updates risk scores when UV changes by 100+ or every 15 minutes.
+
+    Args:
+        uv_cache_ttl: Seconds a location's UV reading is reused; below the 1 second tick so
+                      each uv_intensity document is read at most once per tick
+        stats_interval: Print UV cache hit/miss counters every this many ticks
+
+    The roster is kept live by a listener on the users collection (see LiveRoster), so
+    sign-ups, deletions and profile edits are picked up between ticks without a rescan.
+    A RecalculationScheduler limits each tick to the users that are due and the users at
+    locations whose reading changed, instead of every user.
+
+    Writes go through a DurableWriteQueue, so a slow or failing Firestore never holds up a
+    tick and nothing is lost if the process dies.
+
+    Per-tick activity is recorded in METRICS (see the monitor command's --metrics-port and
+    --metrics-json options); the console only gets a rate-limited status line.
+    """
+    print("Starting continuous UV monitoring...")
+    print("This will monitor UV changes and update final risk categories in real-time")
+    print("Press Ctrl+C to stop monitoring")
+    print("-" * 60)
+    
+    roster, watch = start_live_roster()
+    print(f"\nMonitoring {len(roster)} users (new sign-ups are added as they arrive)...")
     print("=" * 60)
     
+    # Most users share a location, so read each distinct location once per tick
+    uv_cache = UVCache(get_db(), ttl=uv_cache_ttl)
+    # Only category changes (and a refresh every RECALCULATION_INTERVAL) reach Firestore,
+    # through the write-ahead queue
+    write_queue = new_write_queue('monitor')
+    coalescer = new_write_coalescer(write_queue=write_queue)
+    scheduler = RecalculationScheduler()
+    scheduler.schedule_all(roster.users, time.time())
+    METRICS.set_gauge('monitored_users', len(roster))
+    ticks = 0
+    
     try:
         while True:
             current_time = time.strftime('%H:%M:%S')
-            updates_made = 0
-            
-            for user_id, user_data in user_objects.items():
-                try:
-                    # Get current UV intensity for this user's location
-                    current_uv = get_uv_intensity_from_firebase(user_data['location'])
-                    
-                    # Try to recalculate risk score
-                    result = user_data['user'].recalculate_risk_score(current_uv)
-                    
-                    if result:
-                        # Update the final risk category in Firestore
-                        user_data['doc_ref'].update({
-                            'final_risk_category': result["Risk Category"],
-                            'last_uv_update': current_time,
-                            'current_uv_intensity': current_uv
-                        })
-                        
-                        print(f"[{current_time}] User {user_id}: UV={current_uv}, Final={result['Risk Category']}")
-                        updates_made += 1
-                    
-                except Exception as e:
-                    print(f"[{current_time}] Error updating user {user_id}: {e}")
-                    continue
+            apply_roster_changes(roster, coalescer, current_time, scheduler)
+            with METRICS.timer('monitor_tick_seconds', mode='poll'):
+                updates_made = run_monitor_tick(roster.users, uv_cache, roster.locations(), current_time, coalescer,
+                                                scheduler, roster.by_location)
             
             if updates_made == 0:
-                print(f"[{current_time}] No updates needed (UV changes < 100, time < 15min)")
+                status_log.log('tick', f"[{current_time}] No updates needed (UV changes < 100, time < 15min)")
+            else:
+                status_log.log('tick', f"[{current_time}] Updated {updates_made} users")
+            
+            ticks += 1
+            if ticks % stats_interval == 0:
+                stats = uv_cache.stats()
+                print(f"[{current_time}] UV cache: {stats['hits']} hits, {stats['misses']} misses, "
+                      f"{stats['reads']} document reads ({stats['hit_rate']:.1%} hit rate)")
+                stats = coalescer.stats()
+                print(f"[{current_time}] Writes: {stats['submitted'] - stats['skipped']} of {stats['submitted']} "
+                      f"recalculations written ({stats['skip_rate']:.1%} coalesced)")
             
             # Wait 1 second before next check
             time.sleep(1)
@@ -375,6 +1153,562 @@ def continuously_monitor_uv_updates():
         print(f"\n[{time.strftime('%H:%M:%S')}] Monitoring stopped by user")
     except Exception as e:
         print(f"\n[{time.strftime('%H:%M:%S')}] Error during monitoring: {e}")
+    finally:
+        watch.unsubscribe()
+        write_queue.close()
+
+def _run_monitor_shard(shard_index, shard_count, uv_cache_ttl, report_interval, reports, stop_event,
+                       client_factory=None):
+    """
+    Worker process for monitor_uv_updates_sharded: poll-mode monitoring of one shard's users.
+
+    The worker owns the User state for its slice and sends METRICS.export() to the
+    supervisor over the reports queue every report_interval seconds.
+    """
+    # Ctrl+C is handled by the supervisor, which stops the workers through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    client = client_factory() if client_factory else get_db()
+    roster, watch = start_live_roster(client, query=shard_users_query(client, shard_index, shard_count))
+    uv_cache = UVCache(client, ttl=uv_cache_ttl)
+    write_queue = new_write_queue(f'shard-{shard_index}', client)
+    coalescer = new_write_coalescer(client, write_queue)
+    scheduler = RecalculationScheduler()
+    scheduler.schedule_all(roster.users, time.time())
+    METRICS.set_gauge('monitored_users', len(roster))
+    next_report = time.time()
+
+    while not stop_event.is_set():
+        tick_start = time.time()
+        current_time = time.strftime('%H:%M:%S')
+        apply_roster_changes(roster, coalescer, current_time, scheduler)
+        with METRICS.timer('monitor_tick_seconds', mode='sharded'):
+            run_monitor_tick(roster.users, uv_cache, roster.locations(), current_time, coalescer,
+                             scheduler, roster.by_location)
+        if tick_start >= next_report:
+            reports.put((shard_index, METRICS.export()))
+            next_report = tick_start + report_interval
+        # Same 1 second cadence as continuously_monitor_uv_updates. Sleep rather than
+        # stop_event.wait(): a worker killed while waiting on the event would deadlock set()
+        time.sleep(max(0.0, 1.0 - (time.time() - tick_start)))
+    watch.unsubscribe()
+    write_queue.close()
+    reports.put((shard_index, METRICS.export()))
+
+def monitor_uv_updates_sharded(shard_count=None, uv_cache_ttl=0.5, report_interval=5.0, max_restart_delay=30.0,
+                               client_factory=None):
+    """
+    Poll-mode monitoring spread over several worker processes, one per shard.
+
+    Users are assigned to shards by shard_for(user_id, shard_count), so each process loads
+    and recalculates only its own slice and the work runs on shard_count cores instead of
+    one. The supervisor (this process) restarts workers that die, backing off when a
+    worker keeps crashing, and absorbs each worker's metrics under a shard label so
+    --metrics-port shows every shard.
+
+    Each worker listens to shard_users_query(), which the server filters on SHARD_FIELD, so
+    a user change (including the echo of a monitor write) is delivered and billed once
+    rather than once per shard. The supervisor stamps SHARD_FIELD on users that lack it:
+    a scan of the users collection at startup (one read per user), then a listener on
+    users created since (the app sets createdAt but knows nothing about shards).
+
+    Args:
+        shard_count: Number of worker processes (defaults to the number of CPUs)
+        uv_cache_ttl: Passed to each worker's UVCache
+        report_interval: Seconds between metric reports from each worker
+        max_restart_delay: Upper bound of the restart backoff, in seconds
+        client_factory: Picklable function returning a Firestore client in the worker
+                        (defaults to get_db)
+    """
+    shard_count = shard_count or os.cpu_count() or 1
+    # spawn rather than fork: the gRPC channel behind the Firestore client is not fork-safe
+    context = multiprocessing.get_context('spawn')
+    reports = context.Queue()
+    stop_event = context.Event()
+    workers = {}         # shard -> Process
+    started_at = {}      # shard -> time the current worker was started
+    quick_crashes = {}   # shard -> consecutive crashes within a minute of starting
+    restart_at = {}      # shard -> time a dead worker will be restarted
+
+    def start_worker(shard):
+        worker = context.Process(target=_run_monitor_shard, name=f"uv-monitor-shard-{shard}",
+                                 args=(shard, shard_count, uv_cache_ttl, report_interval, reports, stop_event,
+                                       client_factory))
+        worker.start()
+        workers[shard] = worker
+        started_at[shard] = time.time()
+        METRICS.set_gauge('shard_up', 1, shard=str(shard))
+
+    client = client_factory() if client_factory else get_db()
+    new_users = queue.Queue()  # lists of snapshots from the new-users listener
+
+    def stamp(user_docs):
+        summary = stamp_shard_buckets(client, user_docs)
+        for user_id, error in summary['failed'].items():
+            status_log.log('stamp_error', f"✗ Error storing the shard bucket of user {user_id}: {error}")
+        return summary
+
+    # Listen before scanning so a user created during the scan is not missed
+    armed_at = time.time()
+    new_users_watch = watch_new_users(client, datetime.now(timezone.utc) - NEW_USERS_MARGIN, new_users.put)
+    summary = stamp(client.collection('users').stream())
+    print(f"✓ Stored shard buckets on {summary['stamped']} users")
+
+    print(f"Starting sharded UV monitoring with {shard_count} worker processes...")
+    print("Press Ctrl+C to stop monitoring")
+    print("-" * 60)
+    for shard in range(shard_count):
+        start_worker(shard)
+
+    try:
+        while True:
+            user_docs = []
+            try:
+                while True:
+                    user_docs.extend(new_users.get_nowait())
+            except queue.Empty:
+                pass
+            if user_docs:
+                stamp(user_docs)
+            if time.time() - armed_at >= NEW_USERS_REARM_INTERVAL:
+                armed_at = time.time()
+                previous_watch = new_users_watch
+                new_users_watch = watch_new_users(client, datetime.now(timezone.utc) - NEW_USERS_MARGIN,
+                                                  new_users.put)
+                previous_watch.unsubscribe()
+
+            try:
+                shard, exported = reports.get(timeout=1.0)
+                METRICS.absorb(exported, shard=str(shard))
+                while True:
+                    shard, exported = reports.get_nowait()
+                    METRICS.absorb(exported, shard=str(shard))
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            for shard, worker in workers.items():
+                if worker.is_alive() or shard in restart_at:
+                    continue
+                METRICS.set_gauge('shard_up', 0, shard=str(shard))
+                METRICS.inc('shard_restarts_total', shard=str(shard))
+                quick_crashes[shard] = quick_crashes.get(shard, 0) + 1 if now - started_at[shard] < 60 else 0
+                restart_at[shard] = now + min(max_restart_delay, 2 ** quick_crashes[shard] - 1)
+                print(f"[{time.strftime('%H:%M:%S')}] Shard {shard} exited with code {worker.exitcode}, "
+                      f"restarting in {restart_at[shard] - now:.0f}s")
+            for shard, due in list(restart_at.items()):
+                if now >= due:
+                    del restart_at[shard]
+                    start_worker(shard)
+
+            users = sum(METRICS.get('monitored_users', shard=str(shard)) for shard in range(shard_count))
+            writes = sum(METRICS.get('firestore_writes_total', source='monitor', shard=str(shard))
+                         for shard in range(shard_count))
+            alive = sum(worker.is_alive() for worker in workers.values())
+            status_log.log('shards', f"[{time.strftime('%H:%M:%S')}] {alive}/{shard_count} shards up, "
+                                     f"{users} users, {writes} writes")
+
+    except KeyboardInterrupt:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Monitoring stopped by user, stopping shards...")
+    finally:
+        new_users_watch.unsubscribe()
+        stop_event.set()
+        for worker in workers.values():
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+def load_user_registry(client=None):
+    """
+    Build a compact UserRegistry from the users collection for monitor_uv_updates_compact.
+
+    Returns:
+        UserRegistry: One row per valid user
+    """
+    client = client or get_db()
+    registry = UserRegistry()
+    now = time.time()
+    for user_doc in client.collection('users').stream():
+        try:
+            phototype, age, severity_score, location = extract_user_inputs(user_doc.to_dict())
+            registry.add(user_doc.id, get_baseline_code(phototype, age, severity_score), location, 0, now)
+        except Exception as e:
+            status_log.log('init_error', f"✗ Error initializing user {user_doc.id}: {e}")
+    return registry
+
+def build_uv_delta_indexes(registry):
+    """
+    One UVDeltaIndex of registry rows per location, keyed by each row's last reading.
+
+    Returns:
+        dict: location id -> UVDeltaIndex
+    """
+    indexes = {}
+    for row in range(len(registry)):
+        location_id = registry.location_id[row]
+        index = indexes.get(location_id)
+        if index is None:
+            index = indexes[location_id] = UVDeltaIndex(UV_CHANGE_THRESHOLD)
+        index.set(row, registry.last_uv[row])
+    return indexes
+
+def recalculate_registry_user(registry, row, raw_sensor_data, current_time):
+    """
+    Same rules as User.recalculate_risk_score, applied to one registry row.
+    The registry does not track cumulative dose, so there is no dose term or dose trigger.
+
+    Returns:
+        dict: UV Modifier, ERS, Risk Category and the Trigger (uv_delta or timer) if the user
+              was recalculated, None otherwise
+    """
+    sensor_data_change = abs(raw_sensor_data - registry.last_uv[row])
+    timer_expired = current_time - registry.last_calc_time[row] >= RECALCULATION_INTERVAL
+    if sensor_data_change < UV_CHANGE_THRESHOLD and not timer_expired:
+        return None
+    trigger = 'uv_delta' if sensor_data_change >= UV_CHANGE_THRESHOLD else 'timer'
+    baseline_ers, _ = BASELINE_TABLE[registry.baseline_code[row]]
+    uv_modifier = uv_modifier_for(raw_sensor_data)
+    ers = baseline_ers + uv_modifier
+    registry.last_uv[row] = raw_sensor_data
+    registry.last_calc_time[row] = current_time
+    return {
+        "UV Modifier": uv_modifier,
+        "ERS": ers,
+        "Risk Category": classify_final_ers(ers),
+        "Trigger": trigger
+    }
+
+def compact_monitor_visits(registry, indexes, previous_readings, readings, timers, now):
+    """
+    Registry rows a compact monitor tick has to look at, without scanning every row.
+
+    These are exactly the rows a scan of every row would recalculate:
+        - rows whose location's reading is now UV_CHANGE_THRESHOLD or more away from the
+          reading they were last calculated at (UVDeltaIndex). A row only becomes due when
+          its location's reading changes, so unchanged locations are not queried.
+        - rows whose timer has expired
+
+    Args:
+        indexes: location id -> UVDeltaIndex (build_uv_delta_indexes); the caller moves
+                 each recalculated row to its new reading
+        previous_readings / readings: Reading per location id at the previous and this tick
+        timers: deque of (calc time, array of rows recalculated at that time), oldest
+                first; entries for rows recalculated again since are skipped
+
+    Returns:
+        set: Row numbers to pass to recalculate_registry_user
+    """
+    visits = set()
+    for location_id, index in indexes.items():
+        if previous_readings[location_id] != readings[location_id]:
+            visits.update(index.due(readings[location_id]))
+    last_calc_time = registry.last_calc_time
+    while timers and now - timers[0][0] >= RECALCULATION_INTERVAL:
+        calc_time, rows = timers.popleft()
+        visits.update(row for row in rows if last_calc_time[row] == calc_time)
+    return visits
+
+def monitor_uv_updates_compact(uv_cache_ttl=0.5):
+    """
+    Memory-lean version of continuously_monitor_uv_updates for very large rosters.
+
+    Users are kept in a UserRegistry (typed arrays indexed by row) instead of a dict of User
+    objects, and baseline scores come from BASELINE_TABLE rather than being recomputed.
+    The 100-unit and 15-minute rules and the fields written are the same (the registry has
+    no dose term). After the first tick, which visits every row, a tick only visits the
+    rows compact_monitor_visits picks: a UVDeltaIndex per location finds the rows whose
+    reading moved by 100 or more, and a queue of recalculation times finds the rows whose
+    timer expired. These are exactly the rows a scan of every row would recalculate, so the
+    writes are the same, and a tick costs the rows it recalculates rather than the roster.
+    """
+    print("Starting compact UV monitoring...")
+    print("Press Ctrl+C to stop monitoring")
+    print("-" * 60)
+
+    client = get_db()
+    registry = load_user_registry(client)
+    if not len(registry):
+        print("No users found in the database.")
+        return
+
+    print(f"\nMonitoring {len(registry)} users ({registry.total_bytes() / len(registry):.0f} bytes per user, "
+          f"{registry.nbytes() / len(registry):.0f} of them in the columns)...")
+    print("=" * 60)
+
+    uv_cache = UVCache(client, ttl=uv_cache_ttl)
+    write_queue = new_write_queue('compact', client)
+    coalescer = new_write_coalescer(client, write_queue)
+    users_ref = client.collection('users')
+    indexes = build_uv_delta_indexes(registry)
+    # Registry rows start out scored at a reading of 0
+    previous_readings = [0] * len(registry.locations)
+    timers = collections.deque()
+    for row in range(len(registry)):
+        if not timers or timers[-1][0] != registry.last_calc_time[row]:
+            timers.append((registry.last_calc_time[row], array('I')))
+        timers[-1][1].append(row)
+    first_tick = True
+    METRICS.set_gauge('monitored_users', len(registry))
+    try:
+        while True:
+            current_time = time.strftime('%H:%M:%S')
+            now = time.time()
+            tick_start = time.perf_counter()
+            updates_made = 0
+            uv_cache.prefetch(registry.locations)
+            readings = [uv_cache.get(location) for location in registry.locations]
+            if first_tick:
+                visits = range(len(registry))
+                first_tick = False
+            else:
+                visits = compact_monitor_visits(registry, indexes, previous_readings, readings, timers, now)
+            previous_readings = readings
+            METRICS.inc('monitor_user_visits_total', len(visits))
+
+            recalculated = array('I')
+            for row in visits:
+                user_id = registry.user_ids[row]
+                current_uv = readings[registry.location_id[row]]
+                result = recalculate_registry_user(registry, row, current_uv, now)
+                if not result:
+                    continue
+                indexes[registry.location_id[row]].set(row, current_uv)
+                recalculated.append(row)
+                METRICS.inc('risk_recalculations_total', reason=result["Trigger"])
+                if coalescer.submit(user_id, users_ref.document(user_id), result["ERS"], {
+                    'last_uv_update': current_time,
+                    'current_uv_intensity': current_uv
+                }, now):
+                    updates_made += 1
+            if recalculated:
+                timers.append((now, recalculated))
+            for user_id, error in coalescer.flush().items():
+                status_log.log('monitor_update_error', f"[{current_time}] Error updating user {user_id}: {error}")
+
+            METRICS.observe('monitor_tick_seconds', time.perf_counter() - tick_start, mode='compact')
+            if updates_made == 0:
+                status_log.log('tick', f"[{current_time}] No updates needed (UV changes < 100, time < 15min)")
+            else:
+                status_log.log('tick', f"[{current_time}] Updated {updates_made} users")
+
+            time.sleep(1)
+
+    except KeyboardInterrupt:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Monitoring stopped by user")
+    except Exception as e:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Error during monitoring: {e}")
+    finally:
+        write_queue.close()
+
+async def _monitor_uv_updates_async(user_objects, async_client, max_concurrency, tick_interval, tick_deadline):
+    """
+    Tick loop for monitor_uv_updates_async. Each tick reads every monitored location and writes
+    every recalculated user concurrently, with at most max_concurrency Firestore calls in flight.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    monitored_locations = {user_data['location'] for user_data in user_objects.values()}
+    in_flight = {}  # user_id -> write task still running from an earlier tick
+    overruns = 0
+
+    async def read_uv(location):
+        try:
+            async with semaphore:
+                uv_doc = await async_client.collection('uv_intensity').document(location).get()
+            METRICS.inc('firestore_reads_total', source='uv_intensity')
+            if uv_doc.exists:
+                return location, uv_doc.to_dict().get('value', DEFAULT_UV_INTENSITY)
+        except Exception as e:
+            METRICS.inc('firestore_errors_total', source='uv_intensity')
+            status_log.log('uv_read_error', f"Error getting UV intensity: {e}")
+        return location, DEFAULT_UV_INTENSITY
+
+    async def write_update(user_id, fields):
+        try:
+            async with semaphore:
+                write_start = loop.time()
+                await async_client.collection('users').document(user_id).update(fields)
+            METRICS.observe('firestore_write_seconds', loop.time() - write_start, source='monitor')
+            METRICS.inc('firestore_writes_total', source='monitor')
+        except Exception as e:
+            METRICS.inc('firestore_errors_total', source='monitor')
+            status_log.log('monitor_update_error', f"[{fields['last_uv_update']}] Error updating user {user_id}: {e}")
+
+    while True:
+        tick_start = loop.time()
+        try:
+            readings = dict(await asyncio.wait_for(
+                asyncio.gather(*(read_uv(location) for location in monitored_locations)),
+                timeout=tick_deadline))
+        except asyncio.TimeoutError:
+            overruns += 1
+            METRICS.inc('monitor_tick_overruns_total', phase='read')
+            status_log.log('overrun', f"[{time.strftime('%H:%M:%S')}] Tick overran its {tick_deadline:.2f}s deadline while reading UV; "
+                  f"skipping this tick ({overruns} overruns so far)")
+            continue
+
+        current_time = time.strftime('%H:%M:%S')
+        tick_writes = []
+        for user_id, user_data in user_objects.items():
+            # Keep writes for one user in order: wait for the previous one before feeding a new reading
+            if user_id in in_flight:
+                continue
+            current_uv = readings[user_data['location']]
+            try:
+                result = user_data['user'].recalculate_risk_score(current_uv)
+            except Exception as e:
+                status_log.log('monitor_update_error', f"[{current_time}] Error updating user {user_id}: {e}")
+                continue
+            if result:
+                task = asyncio.create_task(write_update(user_id, {
+                    'final_risk_category': result["Risk Category"],
+                    'last_uv_update': current_time,
+                    'current_uv_intensity': current_uv,
+                    'uv_dose_last_hour': result["UV Dose (last hour)"],
+                    'uv_dose_today': result["UV Dose (today)"]
+                }))
+                in_flight[user_id] = task
+                task.add_done_callback(lambda _, user_id=user_id: in_flight.pop(user_id, None))
+                tick_writes.append(task)
+
+        pending = set()
+        if tick_writes:
+            # Writes that miss the deadline keep running in the background rather than being cancelled
+            _, pending = await asyncio.wait(tick_writes, timeout=max(0.0, tick_start + tick_deadline - loop.time()))
+        elif not in_flight:
+            status_log.log('tick', f"[{current_time}] No updates needed (UV changes < 100, time < 15min)")
+
+        elapsed = loop.time() - tick_start
+        METRICS.observe('monitor_tick_seconds', elapsed, mode='async')
+        if pending or elapsed > tick_deadline:
+            overruns += 1
+            METRICS.inc('monitor_tick_overruns_total', phase='write')
+            status_log.log('overrun', f"[{current_time}] Tick overran its {tick_deadline:.2f}s deadline: took {elapsed:.2f}s, "
+                  f"{len(pending)} writes still in flight ({overruns} overruns so far)")
+
+        await asyncio.sleep(max(0.0, tick_interval - elapsed))
+
+def monitor_uv_updates_async(max_concurrency=50, tick_interval=1.0, tick_deadline=None):
+    """
+    asyncio version of continuously_monitor_uv_updates.
+
+    UV reads and category writes go through the async Firestore client and run concurrently,
+    so a tick costs roughly one round trip instead of the sum of all of them.
+
+    Args:
+        max_concurrency: Maximum number of Firestore reads/writes in flight at once
+        tick_interval: Seconds between the start of consecutive ticks
+        tick_deadline: Seconds a tick may take before it is reported as an overrun
+                       (defaults to tick_interval)
+    """
+    print("Starting async UV monitoring...")
+    print(f"Up to {max_concurrency} Firestore requests in flight per tick")
+    print("Press Ctrl+C to stop monitoring")
+    print("-" * 60)
+
+    user_objects = load_monitored_users()
+    if not user_objects:
+        print("No users found in the database.")
+        return
+
+    print(f"\nMonitoring {len(user_objects)} users...")
+    print("=" * 60)
+
+    try:
+        from firebase_admin import firestore_async
+        get_db()  # Make sure Firebase is initialized before creating the async client
+        asyncio.run(_monitor_uv_updates_async(user_objects, firestore_async.client(), max_concurrency,
+                                              tick_interval, tick_deadline or tick_interval))
+    except KeyboardInterrupt:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Monitoring stopped by user")
+    except Exception as e:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Error during monitoring: {e}")
+
+def listen_for_uv_updates():
+    """
+    Event-driven alternative to continuously_monitor_uv_updates.
+
+    Subscribes to the uv_intensity collection with a snapshot listener instead of polling it
+    every second. When a location's document changes, only the users at that location are
+    recalculated. Between changes the loop sleeps until the RecalculationScheduler's next
+    deadline (the 15-minute timer, or a dose check) and only visits the users that are due,
+    reusing the last UV value pushed by the listener, so an idle system does no reads at all. The roster itself is kept live by a second listener on
+    the users collection (see LiveRoster).
+    """
+    print("Starting event-driven UV monitoring...")
+    print("Risk categories update as soon as a uv_intensity document changes")
+    print("Press Ctrl+C to stop monitoring")
+    print("-" * 60)
+    
+    roster, users_watch = start_live_roster()
+    
+    # Listener callbacks run on a background thread; hand the changes to this thread.
+    # None in the queue means the roster has changes waiting.
+    latest_uv = {}
+    changes = queue.Queue()
+    roster.add_listener(lambda: changes.put(None))
+    
+    def on_uv_snapshot(doc_snapshots, doc_changes, read_time):
+        for change in doc_changes:
+            if change.type.name == 'REMOVED':
+                continue
+            value = (change.document.to_dict() or {}).get('value', DEFAULT_UV_INTENSITY)
+            changes.put((change.document.id, value))
+    
+    write_queue = new_write_queue('listen')
+    coalescer = new_write_coalescer(write_queue=write_queue)
+    scheduler = RecalculationScheduler()
+    scheduler.schedule_all(roster.users, time.time() + RECALCULATION_INTERVAL)
+    watch = get_db().collection('uv_intensity').on_snapshot(on_uv_snapshot)
+    print(f"\nListening for UV changes at {len(roster.by_location)} locations for {len(roster)} users...")
+    print("=" * 60)
+    
+    try:
+        while True:
+            # New and edited users are scheduled for now by apply_roster_changes
+            next_due = scheduler.next_due()
+            if next_due is None:
+                next_due = time.time() + RECALCULATION_INTERVAL
+            try:
+                change = changes.get(timeout=max(0.0, next_due - time.time()))
+            except queue.Empty:
+                # Timer path: recalculate due users with the last value we were sent
+                current_time = time.strftime('%H:%M:%S')
+                now = time.time()
+                for user_id in scheduler.pop_due(now):
+                    user_data = roster.users.get(user_id)
+                    if user_data is None:
+                        continue
+                    current_uv = latest_uv.get(user_data['location'], DEFAULT_UV_INTENSITY)
+                    apply_uv_reading(user_id, user_data, current_uv, current_time, coalescer)
+                    schedule_next_check(scheduler, user_id, user_data['user'], now, coalescer)
+                coalescer.flush()
+                continue
+            
+            current_time = time.strftime('%H:%M:%S')
+            if change is None:
+                apply_roster_changes(roster, coalescer, current_time, scheduler)
+                continue
+            
+            location, current_uv = change
+            # Kept for every location, so a user who moves there later starts from a real reading
+            latest_uv[location] = current_uv
+            METRICS.inc('uv_change_events_total')
+            METRICS.set_gauge('uv_change_queue_depth', changes.qsize())
+            now = time.time()
+            for user_id in roster.by_location.get(location, ()):
+                user_data = roster.users[user_id]
+                apply_uv_reading(user_id, user_data, current_uv, current_time, coalescer)
+                schedule_next_check(scheduler, user_id, user_data['user'], now, coalescer)
+            coalescer.flush()
+            
+    except KeyboardInterrupt:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Monitoring stopped by user")
+    except Exception as e:
+        print(f"\n[{time.strftime('%H:%M:%S')}] Error during monitoring: {e}")
+    finally:
+        watch.unsubscribe()
+        users_watch.unsubscribe()
+        write_queue.close()
 
 def simulate_uv_changes(duration_minutes=5):
     """
@@ -398,7 +1732,7 @@ def simulate_uv_changes(duration_minutes=5):
             current_uv = max(0, current_uv + variation)  # Ensure non-negative
             
             # Write to Firestore
-            uv_ref = db.collection('uv_intensity').document('default_location')
+            uv_ref = get_db().collection('uv_intensity').document('default_location')
             uv_ref.set({
                 'value': current_uv,
                 'timestamp': time.time(),
@@ -421,6 +1755,7 @@ def test_firebase_connection():
         print("Testing Firestore connection...")
         
         # Test basic connection by listing collections
+        db = get_db()
         collections = db.collections()
         collection_names = [col.id for col in collections]
         print(f"✓ Firestore connection successful!")
@@ -445,29 +1780,103 @@ def test_firebase_connection():
     except Exception as e:
         print(f"✗ Firestore connection failed: {e}")
 
-# Test connection first
-test_firebase_connection()
-
-# Example usage:
-print("\nChoose an option:")
-print("1. add_risk_categories_to_users() - Add initial risk categories (run once)")
-print("2. continuously_monitor_uv_updates() - Start continuous monitoring (runs forever)")
-print("3. simulate_uv_changes(5) - Simulate UV changes for 5 minutes (for testing)")
-print("\nRunning add_risk_categories_to_users() first...")
-add_risk_categories_to_users()
-
-print("\n" + "="*60)
-print("CONTINUOUS MONITORING SETUP")
-print("="*60)
-print("To start continuous monitoring, run:")
-print("continuously_monitor_uv_updates()")
-print("\nTo test with simulated UV changes, run in another terminal:")
-print("simulate_uv_changes(5)")
+def main(argv=None):
+    """
+    Command line entry point.
+
+    Usage:
+        python calc.py backfill [--bulk] [--batch-size N] [--commit-concurrency N] [--flush-timeout SECONDS]
+        python calc.py backfill --incremental [--page-size N] [--checkpoint PATH]
+        python calc.py monitor [--mode poll|listen|async|compact|sharded] [--max-concurrency N] [--shards N]
+                               [--metrics-port PORT] [--metrics-json PATH]
+        python calc.py simulate [--minutes N]
+        python calc.py check
+    """
+    parser = argparse.ArgumentParser(description="Risk score backfill and UV monitoring for Sollis users.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill = subparsers.add_parser('backfill', help="add baseline/final risk categories to every user")
+    backfill.add_argument('--bulk', action='store_true',
+                          help="score users in one pass and write them with batched commits")
+    backfill.add_argument('--batch-size', type=int, default=500,
+                          help="updates per write batch in bulk mode (max 500)")
+    backfill.add_argument('--commit-concurrency', type=int, default=4,
+                          help="batch commits in flight at once in bulk mode")
+    backfill.add_argument('--flush-timeout', type=float, default=BACKFILL_FLUSH_TIMEOUT,
+                          help="seconds to wait for queued writes in per-user mode before reporting them as failed")
+    backfill.add_argument('--incremental', action='store_true',
+                          help="only rescore users whose profile changed since the last run or whose location's "
+                               "UV reading changed, resuming from the checkpoint")
+    backfill.add_argument('--page-size', type=int, default=500,
+                          help="users read and committed per page in incremental mode")
+    backfill.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH,
+                          help="checkpoint file for incremental mode")
+
+    monitor = subparsers.add_parser('monitor', help="keep final risk categories in sync with UV readings")
+    monitor.add_argument('--mode', choices=['poll', 'listen', 'async', 'compact', 'sharded'], default='poll',
+                         help="poll every second, react to snapshot listeners, poll with async I/O, "
+                              "poll with the memory-lean user registry, or poll from one process per shard")
+    monitor.add_argument('--max-concurrency', type=int, default=50,
+                         help="Firestore requests in flight at once in async mode")
+    monitor.add_argument('--uv-cache-ttl', type=float, default=0.5,
+                         help="seconds a location's UV reading is reused in poll mode")
+    monitor.add_argument('--shards', type=int, default=None,
+                         help="worker processes in sharded mode (default: number of CPUs)")
+    monitor.add_argument('--metrics-port', type=int, default=None,
+                         help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    monitor.add_argument('--metrics-json', default=None,
+                         help="write a JSON metrics snapshot to this file every 10 seconds")
+
+    simulate = subparsers.add_parser('simulate', help="write random UV values to default_location every second")
+    simulate.add_argument('--minutes', type=float, default=5, help="how long to run the simulation")
+
+    subparsers.add_parser('check', help="test the Firestore connection and show the users collection")
+
+    args = parser.parse_args(argv)
+
+    try:
+        get_db()
+    except Exception as e:
+        print(f"Error initializing Firebase: {e}")
+        print("Please check your firebasekey.json file.")
+        return 1
+
+    if args.command == 'backfill' and args.incremental:
+        summary = add_risk_categories_incremental(page_size=args.page_size, checkpoint_path=args.checkpoint)
+        return 0 if not summary['failed'] else 1
+    if args.command == 'backfill' and args.bulk:
+        # A one-shot bulk run commits its own batches, --commit-concurrency at a time, and
+        # reports the users whose write failed; the durable queue would serialize them
+        summary = add_risk_categories_to_users(bulk=True, batch_size=args.batch_size,
+                                               commit_concurrency=args.commit_concurrency)
+        return 0 if summary is not None and not summary['failed'] else 1
+    if args.command == 'backfill':
+        write_queue = new_write_queue('backfill')
+        try:
+            summary = add_risk_categories_to_users(write_queue=write_queue, flush_timeout=args.flush_timeout)
+        finally:
+            write_queue.close()
+        return 0 if summary is not None and not summary['failed'] else 1
+    if args.command == 'monitor':
+        if args.metrics_port is not None:
+            start_metrics_server(args.metrics_port)
+        if args.metrics_json:
+            start_json_snapshots(args.metrics_json)
+        if args.mode == 'listen':
+            listen_for_uv_updates()
+        elif args.mode == 'async':
+            monitor_uv_updates_async(max_concurrency=args.max_concurrency)
+        elif args.mode == 'compact':
+            monitor_uv_updates_compact(uv_cache_ttl=args.uv_cache_ttl)
+        elif args.mode == 'sharded':
+            monitor_uv_updates_sharded(shard_count=args.shards, uv_cache_ttl=args.uv_cache_ttl)
+        else:
+            continuously_monitor_uv_updates(uv_cache_ttl=args.uv_cache_ttl)
+    elif args.command == 'simulate':
+        simulate_uv_changes(args.minutes)
+    elif args.command == 'check':
+        test_firebase_connection()
+    return 0
 
 if __name__ == "__main__":
-    print("Starting risk score calculation for all Firebase users...")
-    print("This will calculate baseline and final risk scores for each user.")
-    print("=" * 60)
-    
-    # The process_all_users() function is already called above
-    # It will automatically process all users and update their risk scores
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,273 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (an estimate, like Prometheus)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms for the monitor and the serial bridge.
+
+    Metrics are identified by a name plus keyword labels, e.g.
+        METRICS.inc('risk_recalculations_total', reason='timer')
+        METRICS.observe('monitor_tick_seconds', 0.012)
+    and can be read as Prometheus text (render_prometheus) or a JSON-friendly dict (snapshot).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # name -> {label_key: value}
+        self._gauges = {}      # name -> {label_key: value}
+        self._histograms = {}  # name -> {label_key: _Histogram}
+        self.started_at = time.time()
+
+    def inc(self, name, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager that observes the duration of its block into a histogram."""
+        return _Timer(self, name, labels)
+
+    def get(self, name, **labels):
+        """Current value of a counter or gauge (0 if it has not been touched)."""
+        key = _label_key(labels)
+        with self._lock:
+            if name in self._gauges:
+                return self._gauges[name].get(key, 0)
+            return self._counters.get(name, {}).get(key, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'uptime_seconds': time.time() - self.started_at,
+                'counters': {name: {_format_labels(key): value for key, value in series.items()}
+                             for name, series in self._counters.items()},
+                'gauges': {name: {_format_labels(key): value for key, value in series.items()}
+                           for name, series in self._gauges.items()},
+                'histograms': {name: {_format_labels(key): {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99)
+                } for key, histogram in series.items()} for name, series in self._histograms.items()}
+            }
+
+    def export(self):
+        """Raw series as plain picklable data, for sending to another process (see absorb)."""
+        with self._lock:
+            return {
+                'counters': {name: dict(series) for name, series in self._counters.items()},
+                'gauges': {name: dict(series) for name, series in self._gauges.items()},
+                'histograms': {name: {key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                                      for key, histogram in series.items()}
+                               for name, series in self._histograms.items()}
+            }
+
+    def absorb(self, exported, **labels):
+        """
+        Copy another registry's export() into this one with extra labels added to every series.
+
+        Values replace whatever was absorbed under the same labels before, so a supervisor can
+        absorb each worker's cumulative export over and over (e.g. with shard='3').
+        """
+        def relabel(key):
+            return _label_key({**dict(key), **labels})
+
+        with self._lock:
+            for kind, target in (('counters', self._counters), ('gauges', self._gauges)):
+                for name, series in exported[kind].items():
+                    target_series = target.setdefault(name, {})
+                    for key, value in series.items():
+                        target_series[relabel(key)] = value
+            for name, series in exported['histograms'].items():
+                target_series = self._histograms.setdefault(name, {})
+                for key, (buckets, counts, total, count) in series.items():
+                    histogram = _Histogram(buckets)
+                    histogram.counts = list(counts)
+                    histogram.sum = total
+                    histogram.count = count
+                    target_series[relabel(key)] = histogram
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(f'{name}{_format_labels(key)} {value}' for key, value in series.items())
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f'# TYPE {name} gauge')
+                lines.extend(f'{name}{_format_labels(key)} {value}' for key, value in series.items())
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# Shared registry used by calc.py and importSerial.py
+METRICS = MetricsRegistry()
+
+
+def start_metrics_server(port, registry=METRICS, host='127.0.0.1'):
+    """
+    Serve /metrics (Prometheus text format) and /metrics.json on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: Call shutdown() on it to stop serving
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = registry.render_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(registry.snapshot()).encode('utf-8')
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep scrapes out of the console
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
+
+
+def start_json_snapshots(path, interval=10.0, registry=METRICS):
+    """
+    Write registry.snapshot() to a JSON file every interval seconds on a background thread.
+
+    Returns:
+        threading.Event: Set it to stop writing snapshots
+    """
+    stop_event = threading.Event()
+
+    def write_snapshots():
+        while not stop_event.wait(interval):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(registry.snapshot(), f, indent=2)
+            os.replace(tmp_path, path)
+
+    threading.Thread(target=write_snapshots, daemon=True).start()
+    return stop_event
+
+
+class RateLimitedLogger:
+    """
+    print() that emits each kind of message at most once per interval.
+
+    Messages are grouped by key; the ones swallowed in between are counted and reported
+    with the next message that gets through, so bursts of identical errors cannot flood
+    the console or slow down the hot loop.
+    """
+
+    def __init__(self, interval=10.0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self._last = {}        # key -> time of last printed message
+        self._suppressed = {}  # key -> messages swallowed since then
+        self._lock = threading.Lock()
+
+    def log(self, key, message):
+        now = self.clock()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            suppressed = self._suppressed.pop(key, 0)
+            self._last[key] = now
+        if suppressed:
+            message = f"{message} (+{suppressed} similar messages suppressed)"
+        print(message)
+        return True
@@ -0,0 +1,99 @@
+import heapq
+import time
+
+
+class RecalculationScheduler:
+    """
+    Which users a monitor tick has to look at.
+
+    A min-heap of (due time, user id) replaces scanning every user every second: a tick
+    pops the users whose deadline has passed and adds the users at locations whose UV
+    reading changed since the last tick (changed_locations). Everyone else is left alone
+    until their deadline, which the monitor sets after each visit to the earliest time the
+    user could need a recalculation with an unchanged reading.
+
+    Rescheduling a user does not search the heap; the old entry is left behind and skipped
+    when it surfaces (the heap is rebuilt once stale entries outnumber live ones).
+    """
+
+    def __init__(self, clock=None):
+        """
+        Args:
+            clock: Function returning the current time in seconds (defaults to time.time;
+                   injectable for testing)
+        """
+        self.clock = clock or time.time
+        self._heap = []        # [due, sequence, user_id] entries, including stale ones
+        self._entries = {}     # user_id -> its current heap entry
+        self._sequence = 0     # tie-breaker so equal due times never compare user ids
+        self._last_uv = {}     # location -> reading seen by the previous tick
+
+    def schedule(self, user_id, due):
+        """Set (or move) the user's deadline."""
+        current = self._entries.get(user_id)
+        if current is not None and current[0] == due:
+            return
+        self._sequence += 1
+        entry = self._entries[user_id] = [due, self._sequence, user_id]
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+
+    def schedule_all(self, user_ids, due):
+        for user_id in user_ids:
+            self.schedule(user_id, due)
+
+    def discard(self, user_id):
+        """Forget a user (their heap entry is skipped when it surfaces)."""
+        self._entries.pop(user_id, None)
+
+    def _compact(self):
+        self._heap = list(self._entries.values())
+        heapq.heapify(self._heap)
+
+    def pop_due(self, now=None):
+        """
+        Remove and return every user whose deadline is at or before now (defaults to clock()).
+
+        Popped users are no longer scheduled; the caller reschedules them after the visit.
+        """
+        now = self.clock() if now is None else now
+        heap = self._heap
+        due_users = []
+        entries = self._entries
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            user_id = entry[2]
+            if entries.get(user_id) is entry:
+                del entries[user_id]
+                due_users.append(user_id)
+        return due_users
+
+    def next_due(self):
+        """Earliest deadline, or None if nobody is scheduled."""
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def changed_locations(self, readings):
+        """
+        Locations whose reading differs from the one passed on the previous call.
+
+        Args:
+            readings: dict of location -> current UV reading
+
+        Returns:
+            list: Locations that are new or changed
+        """
+        last_uv = self._last_uv
+        changed = [location for location, value in readings.items() if last_uv.get(location) != value]
+        for location in changed:
+            last_uv[location] = readings[location]
+        return changed
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
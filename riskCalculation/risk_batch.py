@@ -0,0 +1,109 @@
+import numpy as np
+
+# Lookup tables mirroring User.get_ref / User.get_condition_modifier.
+# Index 0 is unused for phototype so the array can be indexed by phototype directly.
+REF_TABLE = np.array([np.nan, 1.0, 0.8, 0.6, 0.4, 0.2, 0.1])
+CONDITION_MODIFIER_TABLE = np.array([1.0, 1.1, 1.2, 1.4, 1.6, 1.8])
+
+# Category codes returned by the batch functions. -1 means the score fell into one of
+# the gaps between bands, where User.classify_ers_* returns None.
+CATEGORY_LABELS = ("Very Low", "Low", "Medium", "High", "Very High")
+NO_CATEGORY = -1
+
+
+def _as_array(values, dtype):
+    return np.asarray(values, dtype=dtype)
+
+
+def get_ref_batch(phototype):
+    phototype = _as_array(phototype, np.int64)
+    if phototype.size and (phototype.min() < 1 or phototype.max() > 6):
+        raise ValueError("phototype must be between 1 and 6")
+    return REF_TABLE[phototype]
+
+
+def get_age_modifier_batch(age):
+    age = _as_array(age, np.float64)
+    # Same branch order as User.get_age_modifier, so non-integer ages fall through identically
+    conditions = [
+        age < 20,
+        (20 <= age) & (age <= 39),
+        (40 <= age) & (age <= 59),
+        (60 <= age) & (age <= 69),
+    ]
+    return np.select(conditions, [0.8, 1.0, 1.2, 1.4], default=1.6)
+
+
+def get_condition_modifier_batch(severity):
+    severity = _as_array(severity, np.int64)
+    if severity.size and (severity.min() < 0 or severity.max() > 5):
+        raise ValueError("severity must be between 0 and 5")
+    return CONDITION_MODIFIER_TABLE[severity]
+
+
+def get_uv_modifier_batch(uv_intensity):
+    uv = _as_array(uv_intensity, np.float64)
+    return np.where(uv == 0, -2.88, uv / 165 * 2.88)
+
+
+def classify_ers_baseline_batch(ers):
+    ers = _as_array(ers, np.float64)
+    conditions = [
+        (0 <= ers) & (ers <= 0.58),
+        (.59 <= ers) & (ers <= 1.16),
+        (1.17 <= ers) & (ers <= 1.75),
+        (1.76 <= ers) & (ers <= 2.34),
+        ers > 2.35,
+    ]
+    return np.select(conditions, [0, 1, 2, 3, 4], default=NO_CATEGORY).astype(np.int8)
+
+
+def classify_ers_final_batch(ers):
+    ers = _as_array(ers, np.float64)
+    conditions = [
+        ers <= 1.15,
+        (1.16 <= ers) & (ers <= 2.30),
+        (2.31 <= ers) & (ers <= 3.45),
+        (3.46 <= ers) & (ers <= 4.60),
+        ers > 4.61,
+    ]
+    return np.select(conditions, [0, 1, 2, 3, 4], default=NO_CATEGORY).astype(np.int8)
+
+
+def category_labels(codes):
+    """
+    Convert category codes back into the strings used by User.classify_ers_*.
+    Codes of NO_CATEGORY become None, matching the scalar functions.
+    """
+    return [CATEGORY_LABELS[code] if code != NO_CATEGORY else None for code in np.asarray(codes).tolist()]
+
+
+def calculate_risk_scores_batch(phototype, age, severity, uv_intensity):
+    """
+    Vectorized equivalent of User.calculate_final_erythemal_risk_score for many users at once.
+
+    Args:
+        phototype: Array-like of Fitzpatrick phototypes (1-6)
+        age: Array-like of ages in years
+        severity: Array-like of condition severity scores (0-5)
+        uv_intensity: Array-like of raw UV sensor readings (or a scalar shared by all users)
+
+    Returns:
+        dict: Arrays for every intermediate value plus baseline/final category codes
+    """
+    ref = get_ref_batch(phototype)
+    am = get_age_modifier_batch(age)
+    cm = get_condition_modifier_batch(severity)
+    baseline_ers = ref * am * cm
+    uv_modifier = get_uv_modifier_batch(uv_intensity)
+    final_ers = baseline_ers + uv_modifier
+    return {
+        "ref": ref,
+        "age_modifier": am,
+        "condition_modifier": cm,
+        "baseline_ers": baseline_ers,
+        "baseline_category": classify_ers_baseline_batch(baseline_ers),
+        "uv_modifier": uv_modifier,
+        "final_ers": final_ers,
+        "final_category": classify_ers_final_batch(final_ers),
+    }
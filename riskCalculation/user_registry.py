@@ -0,0 +1,76 @@
+from array import array
+import sys
+
+
+class UserRegistry:
+    """
+    Compact struct-of-arrays storage for the users a monitor is tracking.
+
+    Instead of one User object plus a wrapper dict per user, each field lives in its own typed
+    array and a user is just a row index. Only what the monitor needs between ticks is kept:
+
+        baseline_code:  index into calc.BASELINE_TABLE (phototype x age band x severity)
+        last_uv:        UV reading used for the last calculation (previous_uv_intensity)
+        last_calc_time: time of the last calculation (last_calculation_time)
+        location_id:    index into self.locations
+    """
+
+    def __init__(self):
+        self.user_ids = []       # row -> user id
+        self.rows = {}           # user id -> row
+        self.baseline_code = array('B')
+        self.last_uv = array('d')
+        self.last_calc_time = array('d')
+        self.location_id = array('I')
+        self.locations = []      # location id -> location name
+        self.location_ids = {}   # location name -> location id
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def intern_location(self, location):
+        """Return the id for a location name, assigning a new one the first time it is seen."""
+        location_id = self.location_ids.get(location)
+        if location_id is None:
+            location_id = len(self.locations)
+            self.locations.append(location)
+            self.location_ids[location] = location_id
+        return location_id
+
+    def add(self, user_id, baseline_code, location, uv_intensity=0, calc_time=0.0):
+        """
+        Add a user (or overwrite an existing one) and return its row.
+        """
+        location_id = self.intern_location(location)
+        row = self.rows.get(user_id)
+        if row is not None:
+            self.baseline_code[row] = baseline_code
+            self.last_uv[row] = uv_intensity
+            self.last_calc_time[row] = calc_time
+            self.location_id[row] = location_id
+            return row
+        row = len(self.user_ids)
+        self.user_ids.append(user_id)
+        self.rows[user_id] = row
+        self.baseline_code.append(baseline_code)
+        self.last_uv.append(uv_intensity)
+        self.last_calc_time.append(calc_time)
+        self.location_id.append(location_id)
+        return row
+
+    def location_of(self, row):
+        return self.locations[self.location_id[row]]
+
+    def nbytes(self):
+        """Bytes held by the typed arrays (excludes the user id strings and the id -> row dict)."""
+        return sum(column.itemsize * len(column) for column in
+                   (self.baseline_code, self.last_uv, self.last_calc_time, self.location_id))
+
+    def total_bytes(self):
+        """
+        nbytes() plus the user id strings, the row -> id list and the id -> row dict: what the
+        registry costs per user in practice (the few location names are left out).
+        """
+        return (self.nbytes() + sys.getsizeof(self.user_ids) + sys.getsizeof(self.rows)
+                + sum(sys.getsizeof(user_id) for user_id in self.user_ids)
+                + sum(sys.getsizeof(row) for row in self.rows.values() if row > 256))
@@ -0,0 +1,148 @@
+import queue
+import threading
+
+
+class LiveRoster:
+    """
+    The monitor's users, kept current from a snapshot listener on the users collection.
+
+    Register on_snapshot with collection('users').on_snapshot(), or with a query on it such
+    as the sharded monitor's. The first snapshot fills the roster, so no separate
+    collection scan is needed. After that only the documents that change are touched:
+
+        ADDED:    a User is built for the new document
+        MODIFIED: the User is rebuilt only if phototype, age, severity or location changed;
+                  the monitor's own writes (final_risk_category etc.) are ignored
+        REMOVED:  the user is dropped
+
+    Listener callbacks arrive on a background thread, so they are only queued there;
+    apply_pending() applies them on the monitor's thread between ticks. users has the same
+    shape as load_monitored_users() and by_location maps location -> set of user ids.
+    """
+
+    def __init__(self, extract_inputs, make_user):
+        """
+        Args:
+            extract_inputs: Function mapping a user document's dict to
+                            (phototype, age, severity_score, location); raises on bad data
+            make_user: Function building a User from (phototype, age, severity_score, location=...)
+        """
+        self.extract_inputs = extract_inputs
+        self.make_user = make_user
+        self.users = {}        # user_id -> {'user', 'doc_ref', 'location', 'inputs'}
+        self.by_location = {}  # location -> {user_id, ...}
+        self._changes = queue.Queue()
+        self._ready = threading.Event()
+        self._loaded = False   # set once the first snapshot has been applied
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback() (on the listener thread) whenever changes are queued, e.g. to wake a waiting loop."""
+        self._listeners.append(callback)
+
+    def on_snapshot(self, doc_snapshots, changes, read_time):
+        """Snapshot listener callback for the users collection."""
+        for change in changes:
+            document = change.document
+            data = None if change.type.name == 'REMOVED' else document.to_dict()
+            self._changes.put((document.id, document.reference, data))
+        self._changes.put(None)  # marks the end of a snapshot
+        self._ready.set()
+        for callback in self._listeners:
+            callback()
+
+    def wait_ready(self, timeout=None):
+        """Block until the first snapshot has arrived. Returns False on timeout."""
+        return self._ready.wait(timeout)
+
+    def _index(self, user_id, location):
+        self.by_location.setdefault(location, set()).add(user_id)
+
+    def _unindex(self, user_id, location):
+        users_here = self.by_location.get(location)
+        if users_here is not None:
+            users_here.discard(user_id)
+            if not users_here:
+                del self.by_location[location]
+
+    def remove(self, user_id):
+        entry = self.users.pop(user_id, None)
+        if entry is not None:
+            self._unindex(user_id, entry['location'])
+        return entry is not None
+
+    def upsert(self, user_id, doc_ref, user_info, recalculate=True):
+        """
+        Add a user or bring an existing one up to date with its document.
+
+        Args:
+            recalculate: Force a recalculation on the next reading (the User's timer is
+                         reset) when the user is new or their inputs changed
+
+        Returns:
+            str: 'added', 'updated' or 'unchanged'
+        """
+        inputs = tuple(self.extract_inputs(user_info))
+        phototype, age, severity_score, location = inputs
+        entry = self.users.get(user_id)
+        if entry is not None and entry['inputs'] == inputs:
+            return 'unchanged'
+
+        if entry is not None and entry['inputs'][:3] == inputs[:3]:
+            # Only the location moved; the score inputs and dose history carry over
+            user = entry['user']
+            status = 'updated'
+        else:
+            user = self.make_user(phototype, age, severity_score, location=location)
+            status = 'added'
+            if entry is not None:
+                user.uv_dose = entry['user'].uv_dose  # exposure so far still counts
+                status = 'updated'
+            if recalculate:
+                user.last_calculation_time = 0
+
+        if entry is not None:
+            self._unindex(user_id, entry['location'])
+        self.users[user_id] = {'user': user, 'doc_ref': doc_ref, 'location': location, 'inputs': inputs}
+        self._index(user_id, location)
+        return status
+
+    def apply_pending(self):
+        """
+        Apply every queued change. Call from the monitor's thread.
+
+        Returns:
+            dict: 'added', 'updated' and 'removed' lists of user ids, and 'failed'
+                  (user_id -> error) for documents whose inputs could not be read
+        """
+        summary = {'added': [], 'updated': [], 'removed': [], 'failed': {}}
+        while True:
+            try:
+                change = self._changes.get_nowait()
+            except queue.Empty:
+                break
+            if change is None:
+                self._loaded = True
+                continue
+            user_id, doc_ref, data = change
+            if data is None:
+                if self.remove(user_id):
+                    summary['removed'].append(user_id)
+                continue
+            try:
+                # Users from the first snapshot keep the old startup behaviour (no forced recalculation)
+                status = self.upsert(user_id, doc_ref, data, recalculate=self._loaded)
+            except Exception as e:
+                summary['failed'][user_id] = str(e)
+                if self.remove(user_id):
+                    summary['removed'].append(user_id)
+                continue
+            if status != 'unchanged':
+                summary[status].append(user_id)
+        return summary
+
+    def locations(self):
+        return set(self.by_location)
+
+    def __len__(self):
+        return len(self.users)
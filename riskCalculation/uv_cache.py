@@ -0,0 +1,132 @@
+import time
+
+try:
+    from .monitor_metrics import METRICS, RateLimitedLogger
+except ImportError:
+    from monitor_metrics import METRICS, RateLimitedLogger
+
+DEFAULT_UV_INTENSITY = 100
+
+# Read errors repeat every tick during an outage, so they go through this (calc.py logs
+# through the same instance)
+status_log = RateLimitedLogger(interval=10.0)
+
+
+class UVCache:
+    """
+    Short-lived cache of uv_intensity/<location> values, keyed by location.
+
+    The monitor calls prefetch() with every location it is about to read at the start of
+    a tick, which fetches all stale locations in a single multi-document get. Every
+    get() for the rest of the tick is then served from memory, so each distinct
+    location document is read at most once per tick no matter how many users share it.
+    That holds when a read fails too: the last known value (or DEFAULT_UV_INTENSITY) is
+    cached as the reading for the rest of the tick, so an outage costs one read attempt
+    per tick rather than one per lookup.
+    """
+
+    def __init__(self, client, ttl=0.5, clock=None):
+        """
+        Args:
+            client: Firestore client used for reads
+            ttl: Seconds a value stays fresh; keep it below the monitor's tick interval
+                 so every tick sees a new reading
+            clock: Function returning the current time in seconds (defaults to time.time;
+                   injectable for testing and simulated-time replays)
+        """
+        self.client = client
+        self.ttl = ttl
+        self.clock = clock or time.time
+        self._values = {}  # location -> (value, fetched_at)
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+
+    def _is_fresh(self, location, now):
+        entry = self._values.get(location)
+        return entry is not None and now - entry[1] < self.ttl
+
+    def prefetch(self, locations):
+        """
+        Fetch every stale location in one batched read.
+
+        Args:
+            locations: Iterable of location ids that will be read this tick
+        """
+        now = self.clock()
+        stale = [location for location in set(locations) if not self._is_fresh(location, now)]
+        if not stale:
+            return
+        refs = [self.client.collection('uv_intensity').document(location) for location in stale]
+        try:
+            with METRICS.timer('firestore_read_seconds', source='uv_cache'):
+                snapshots = list(self.client.get_all(refs))
+        except Exception as e:
+            METRICS.inc('firestore_errors_total', source='uv_cache')
+            status_log.log('uv_read_error', f"Error getting UV intensity: {e}")
+            for location in stale:
+                self._cache_fallback(location, now)
+            return
+        self.reads += len(refs)
+        METRICS.inc('firestore_reads_total', len(refs), source='uv_cache')
+        fetched = set()
+        for snapshot in snapshots:
+            value = DEFAULT_UV_INTENSITY
+            if snapshot.exists:
+                value = snapshot.to_dict().get('value', DEFAULT_UV_INTENSITY)
+            self._values[snapshot.id] = (value, now)
+            fetched.add(snapshot.id)
+        # get_all may leave out documents that do not exist, which read as the default
+        for location in stale:
+            if location not in fetched:
+                self._values[location] = (DEFAULT_UV_INTENSITY, now)
+
+    def _cache_fallback(self, location, now):
+        """After a failed read, keep serving the last known value (or the default) until the next tick."""
+        entry = self._values.get(location)
+        value = entry[0] if entry is not None else DEFAULT_UV_INTENSITY
+        self._values[location] = (value, now)
+        return value
+
+    def get(self, location='default_location'):
+        """
+        Return the UV intensity for a location, reading Firestore only if the cached value is stale.
+        """
+        now = self.clock()
+        if self._is_fresh(location, now):
+            self.hits += 1
+            METRICS.inc('uv_cache_lookups_total', result='hit')
+            return self._values[location][0]
+        self.misses += 1
+        METRICS.inc('uv_cache_lookups_total', result='miss')
+        try:
+            with METRICS.timer('firestore_read_seconds', source='uv_cache'):
+                snapshot = self.client.collection('uv_intensity').document(location).get()
+        except Exception as e:
+            METRICS.inc('firestore_errors_total', source='uv_cache')
+            status_log.log('uv_read_error', f"Error getting UV intensity: {e}")
+            return self._cache_fallback(location, now)
+        self.reads += 1
+        METRICS.inc('firestore_reads_total', source='uv_cache')
+        value = DEFAULT_UV_INTENSITY
+        if snapshot.exists:
+            value = snapshot.to_dict().get('value', DEFAULT_UV_INTENSITY)
+        self._values[location] = (value, now)
+        return value
+
+    def invalidate(self, location=None):
+        """Drop one location (or everything) so the next read goes to Firestore."""
+        if location is None:
+            self._values.clear()
+        else:
+            self._values.pop(location, None)
+
+    def stats(self):
+        """Return the hit/miss counters and the number of documents read so far."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reads': self.reads,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,146 @@
+from array import array
+import time
+
+
+def _midnight_at_or_before(timestamp):
+    t = time.localtime(timestamp)
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+def _next_midnight(timestamp):
+    t = time.localtime(timestamp)
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+
+
+class UVDoseAccumulator:
+    """
+    Streaming cumulative UV dose (raw sensor units x seconds) for one user or device.
+
+    Each reading is held until the next one arrives (sample-and-hold), which is right both
+    for 1 Hz sensor streams and for change-driven updates where a value stays valid until
+    it changes. Three totals are kept:
+
+        total_dose:  everything since the accumulator was created
+        today_dose:  since local midnight
+        window_dose: the last window_seconds (one hour by default), kept in a ring of
+                     fixed-size buckets so old exposure drops out without storing history
+
+    add_sample is O(1) and memory is fixed by the number of buckets, no matter how long
+    the stream runs.
+    """
+
+    __slots__ = ('window_seconds', 'bucket_seconds', 'max_gap', 'buckets', 'current_bucket',
+                 'window_dose', 'today_dose', 'total_dose', 'next_midnight', 'last_uv', 'last_time')
+
+    def __init__(self, window_seconds=3600, bucket_seconds=60, max_gap=None):
+        """
+        Args:
+            window_seconds: Length of the rolling window
+            bucket_seconds: Resolution of the rolling window; window_seconds / bucket_seconds
+                            buckets are kept
+            max_gap: If set, a reading is held for at most this many seconds (e.g. when a
+                     device goes quiet), so a dropout does not count as exposure
+        """
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.max_gap = max_gap
+        self.buckets = array('d', [0.0]) * max(1, int(window_seconds // bucket_seconds))
+        self.current_bucket = None
+        self.window_dose = 0.0
+        self.today_dose = 0.0
+        self.total_dose = 0.0
+        self.next_midnight = None
+        self.last_uv = None
+        self.last_time = None
+
+    def _advance_to(self, bucket_number):
+        """Move the ring forward, clearing buckets that fell out of the window."""
+        if self.current_bucket is None:
+            self.current_bucket = bucket_number
+            return
+        steps = bucket_number - self.current_bucket
+        if steps <= 0:
+            return
+        size = len(self.buckets)
+        if steps >= size:
+            for i in range(size):
+                self.buckets[i] = 0.0
+            self.window_dose = 0.0
+        else:
+            for step in range(1, steps + 1):
+                index = (self.current_bucket + step) % size
+                self.window_dose -= self.buckets[index]
+                self.buckets[index] = 0.0
+        self.current_bucket = bucket_number
+
+    def _integrate(self, uv, start, end):
+        dose = uv * (end - start)
+        self.total_dose += dose
+
+        if end >= self.next_midnight:
+            # Crossed midnight: today only gets the part after it
+            self.today_dose = uv * (end - max(start, _midnight_at_or_before(end)))
+            self.next_midnight = _next_midnight(end)
+        else:
+            self.today_dose += dose
+
+        # Spread the interval over the buckets it covers; anything older than the window is skipped
+        segment_start = max(start, end - self.window_seconds)
+        size = len(self.buckets)
+        while segment_start < end:
+            bucket_number = int(segment_start // self.bucket_seconds)
+            segment_end = min(end, (bucket_number + 1) * self.bucket_seconds)
+            self._advance_to(bucket_number)
+            segment_dose = uv * (segment_end - segment_start)
+            self.buckets[bucket_number % size] += segment_dose
+            self.window_dose += segment_dose
+            segment_start = segment_end
+
+    def add_sample(self, uv, timestamp=None):
+        """
+        Record a reading. The previous reading is integrated up to this timestamp.
+
+        Args:
+            uv: Raw UV sensor value
+            timestamp: Seconds since the epoch; defaults to now. Out-of-order samples are
+                       not integrated backwards, they only replace the held value.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if self.next_midnight is None:
+            self.next_midnight = _next_midnight(timestamp)
+        if self.last_time is not None and timestamp > self.last_time:
+            start = self.last_time
+            if self.max_gap is not None and timestamp - start > self.max_gap:
+                start = timestamp - self.max_gap
+            self._integrate(self.last_uv, start, timestamp)
+        self.last_uv = uv
+        if self.last_time is None or timestamp > self.last_time:
+            self.last_time = timestamp
+
+    def dose_last_window(self, now=None):
+        """Dose in the rolling window ending at now (defaults to the last sample time)."""
+        if now is not None and self.current_bucket is not None:
+            self._advance_to(int(now // self.bucket_seconds))
+        return max(0.0, self.window_dose)
+
+    def peak_rate(self):
+        """
+        Upper bound on how fast window_dose can move (units per second) while the held
+        reading stays the same: it grows at last_uv and drops as old buckets expire, a
+        whole bucket at a time.
+        """
+        return max(self.last_uv or 0, max(self.buckets) / self.bucket_seconds)
+
+    def dose_today(self, now=None):
+        """Dose since local midnight (as of now, defaulting to the last sample time)."""
+        if now is not None and self.next_midnight is not None and now >= self.next_midnight:
+            return 0.0
+        return self.today_dose
+
+    def to_dict(self):
+        return {
+            'uv_dose_last_hour': self.dose_last_window(),
+            'uv_dose_today': self.today_dose,
+            'uv_dose_total': self.total_dose
+        }
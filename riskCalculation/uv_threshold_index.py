@@ -0,0 +1,141 @@
+import bisect
+
+# Breakpoints are computed in floating point; queries are widened by this many UV units so
+# rounding can never hide a flip (each candidate group is then checked exactly)
+BREAKPOINT_TOLERANCE = 1e-6
+
+
+class UVThresholdIndex:
+    """
+    Which users at one location change category when its UV reading moves.
+
+    A user's score is baseline + a UV term that only depends on the reading, so users with
+    the same baseline always share a category and it can only flip at a few known
+    readings. Users are grouped by baseline key, and the flip readings of every group are
+    kept in one sorted list. changed(old_uv, new_uv) bisects to the breakpoints between
+    the two readings, checks the category of each group they belong to at both readings,
+    and returns the users of the groups that flipped: O(log n + k), without rescoring
+    anyone.
+    """
+
+    def __init__(self, breakpoints, category):
+        """
+        Args:
+            breakpoints: Function mapping a baseline key to the readings at which its
+                         category can change
+            category: Function mapping (baseline key, reading) to the category
+        """
+        self.breakpoints = breakpoints
+        self.category = category
+        self._groups = {}      # key -> set of user ids
+        self._key_of = {}      # user id -> key
+        self._thresholds = []  # sorted (reading, key) over every group seen so far
+
+    def add(self, user_id, key):
+        """Add a user (or move them to another baseline key)."""
+        old_key = self._key_of.get(user_id)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._groups[old_key].discard(user_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = set()
+            for reading in self.breakpoints(key):
+                bisect.insort(self._thresholds, (reading, key))
+        group.add(user_id)
+        self._key_of[user_id] = key
+
+    def remove(self, user_id):
+        key = self._key_of.pop(user_id, None)
+        if key is not None:
+            self._groups[key].discard(user_id)
+
+    def changed(self, old_uv, new_uv):
+        """
+        Users whose category at new_uv differs from their category at old_uv.
+
+        Returns:
+            list: User ids, in no particular order
+        """
+        low, high = min(old_uv, new_uv) - BREAKPOINT_TOLERANCE, max(old_uv, new_uv) + BREAKPOINT_TOLERANCE
+        thresholds = self._thresholds
+        candidates = set()
+        for i in range(bisect.bisect_left(thresholds, (low,)), len(thresholds)):
+            reading, key = thresholds[i]
+            if reading > high:
+                break
+            candidates.add(key)
+        changed = []
+        for key in candidates:
+            group = self._groups[key]
+            if group and self.category(key, old_uv) != self.category(key, new_uv):
+                changed.extend(group)
+        return changed
+
+    def __len__(self):
+        return len(self._key_of)
+
+
+class UVDeltaIndex:
+    """
+    Which users at one location are due a recalculation under the monitors' 100-unit rule:
+    users whose last-calculation reading is at least `delta` away from the current one.
+
+    Users recalculated on the same tick share their last reading, so users are grouped by
+    it and the distinct readings are kept sorted. due(reading) bisects to the groups at
+    least delta below or above the reading: O(log g + k) for g distinct readings, however
+    many users the location has.
+    """
+
+    def __init__(self, delta):
+        self.delta = delta
+        self._groups = {}      # reading -> set of user ids
+        self._reading_of = {}  # user id -> reading
+        self._readings = []    # sorted keys of _groups
+
+    def set(self, user_id, reading):
+        """Record the reading a user was last calculated at (adding the user if new)."""
+        old_reading = self._reading_of.get(user_id)
+        if old_reading == reading:
+            return
+        if old_reading is not None:
+            self._discard(user_id, old_reading)
+        group = self._groups.get(reading)
+        if group is None:
+            group = self._groups[reading] = set()
+            bisect.insort(self._readings, reading)
+        group.add(user_id)
+        self._reading_of[user_id] = reading
+
+    def remove(self, user_id):
+        reading = self._reading_of.pop(user_id, None)
+        if reading is not None:
+            self._discard(user_id, reading)
+
+    def _discard(self, user_id, reading):
+        group = self._groups[reading]
+        group.discard(user_id)
+        if not group:
+            del self._groups[reading]
+            del self._readings[bisect.bisect_left(self._readings, reading)]
+
+    def due(self, reading):
+        """
+        Users with abs(reading - last reading) >= delta.
+
+        Returns:
+            list: User ids, in no particular order
+        """
+        readings = self._readings
+        # Widen the bisect by the float tolerance, then apply the exact test per group
+        below = bisect.bisect_right(readings, reading - self.delta + BREAKPOINT_TOLERANCE)
+        above = bisect.bisect_left(readings, reading + self.delta - BREAKPOINT_TOLERANCE)
+        due = []
+        for last_reading in readings[:below] + readings[above:]:
+            if abs(reading - last_reading) >= self.delta:
+                due.extend(self._groups[last_reading])
+        return due
+
+    def __len__(self):
+        return len(self._reading_of)
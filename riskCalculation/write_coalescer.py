@@ -0,0 +1,212 @@
+import time
+
+try:
+    from .monitor_metrics import METRICS
+except ImportError:
+    from monitor_metrics import METRICS
+
+# Final categories from lowest to highest risk, as returned by calc.classify_final_ers
+FINAL_CATEGORIES = ("Very Low", "Low", "Medium", "High", "Very High")
+
+
+class WriteCoalescer:
+    """
+    Sits between the monitor and Firestore so only real changes are written.
+
+    The monitor submit()s every recalculation. The coalescer remembers the state it last
+    wrote for each user and queues a write only when the final category changes, or when
+    the stored UV/dose fields are older than refresh_interval. Two things keep users
+    near a band edge from flapping:
+
+        hysteresis: a user keeps their current category until the ERS is more than
+                    `hysteresis` past the edge of that category's band
+        min_dwell:  a move to a lower category is held until the current one has been
+                    shown for min_dwell seconds (moves up are written straight away, so a
+                    warning is never delayed). The held score is offered again by the
+                    first flush() once it is eligible (held_until() tells a scheduler when
+                    that is), so it does not wait for the user's next recalculation
+
+    Queued writes are coalesced per user (the newest fields win) and committed by flush()
+    in write batches. Writes that fail stay queued and are retried on the next flush.
+    With a write_queue, flush() hands them to that DurableWriteQueue instead, which logs
+    them to disk and commits (and retries) them in the background.
+    """
+
+    def __init__(self, client, classify, hysteresis=0.1, min_dwell=60, refresh_interval=900,
+                 batch_size=500, max_attempts=3, clock=None, write_queue=None):
+        """
+        Args:
+            client: Firestore client used for batch commits
+            classify: Function mapping an ERS to a final category (calc.classify_final_ers)
+            hysteresis: ERS margin past a band edge needed to leave the current category
+            min_dwell: Seconds a category is kept before a move down is written
+            refresh_interval: Seconds after which an unchanged user is written anyway so
+                              current_uv_intensity and the dose fields do not go stale
+            batch_size: Updates per write batch (Firestore allows at most 500)
+            max_attempts: Flushes a failing document is retried for before it is dropped
+            clock: Function returning the current time in seconds (defaults to time.time;
+                   injectable for testing and simulated-time replays)
+            write_queue: Optional DurableWriteQueue that flush() hands the writes to
+        """
+        self.client = client
+        self.classify = classify
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.clock = clock or time.time
+        self.write_queue = write_queue
+        self._written = {}   # user_id -> [category, written_at, category_since]
+        self._pending = {}   # user_id -> (doc_ref, fields)
+        self._attempts = {}  # user_id -> failed flushes of its pending write
+        self._held = {}      # user_id -> (doc_ref, ers, fields, eligible_at) of a move held by min_dwell
+        self.submitted = 0
+        self.skipped = 0
+
+    def _stable_category(self, ers, previous):
+        """Category for ers, sticking with previous while ers is within the hysteresis margin of its band."""
+        if previous is not None and previous in (self.classify(ers - self.hysteresis),
+                                                 self.classify(ers + self.hysteresis)):
+            return previous
+        category = self.classify(ers)
+        # Scores in the gaps between bands classify as None; keep what the user already sees
+        return category if category is not None else previous
+
+    def submit(self, user_id, doc_ref, ers, fields, now=None):
+        """
+        Offer a recalculated score for writing.
+
+        Args:
+            user_id: Document id of the user
+            doc_ref: Reference of the user's document
+            ers: Final erythemal risk score
+            fields: Other fields to store with the category (UV intensity, dose, timestamps)
+            now: Current time in seconds (defaults to clock())
+
+        Returns:
+            bool: True if a write was queued, False if the user's stored state is still current
+        """
+        now = self.clock() if now is None else now
+        self.submitted += 1
+        return self._offer(user_id, doc_ref, ers, fields, now)
+
+    def _offer(self, user_id, doc_ref, ers, fields, now):
+        self._held.pop(user_id, None)  # a newer score replaces a held one
+        state = self._written.get(user_id)
+        if state is None:
+            category = self.classify(ers)
+            self._written[user_id] = [category, now, now]
+        else:
+            previous, written_at, category_since = state
+            category = self._stable_category(ers, previous)
+            if (category != previous and previous is not None and category is not None
+                    and FINAL_CATEGORIES.index(category) < FINAL_CATEGORIES.index(previous)
+                    and now - category_since < self.min_dwell):
+                METRICS.inc('coalescer_held_total', reason='dwell')
+                self._held[user_id] = (doc_ref, ers, fields, category_since + self.min_dwell)
+                category = previous
+            if category == previous and now - written_at < self.refresh_interval:
+                self.skipped += 1
+                METRICS.inc('coalescer_skipped_total')
+                return False
+            state[0] = category
+            state[1] = now
+            if category != previous:
+                state[2] = now
+        self._pending[user_id] = (doc_ref, dict(fields, final_risk_category=category))
+        METRICS.set_gauge('coalescer_pending', len(self._pending))
+        return True
+
+    def discard(self, user_id):
+        """Forget a user (e.g. one whose document was deleted), dropping any queued write."""
+        self._written.pop(user_id, None)
+        self._pending.pop(user_id, None)
+        self._attempts.pop(user_id, None)
+        self._held.pop(user_id, None)
+
+    def held_until(self, user_id):
+        """Time a move down held by min_dwell becomes eligible for writing (None if nothing is held)."""
+        held = self._held.get(user_id)
+        return held[3] if held is not None else None
+
+    def _release_held(self, now):
+        """Offer again every held score whose dwell time has passed."""
+        for user_id, (doc_ref, ers, fields, eligible_at) in list(self._held.items()):
+            if eligible_at <= now:
+                self._offer(user_id, doc_ref, ers, fields, now)
+
+    def category_of(self, user_id):
+        """The category last queued or written for a user (None if it has not been submitted)."""
+        state = self._written.get(user_id)
+        return state[0] if state is not None else None
+
+    def _commit(self, chunk):
+        """Commit (user_id, doc_ref, fields) updates in one batch, falling back to single writes on failure."""
+        batch = self.client.batch()
+        for _, doc_ref, fields in chunk:
+            batch.update(doc_ref, fields)
+        try:
+            with METRICS.timer('firestore_write_seconds', source='coalescer'):
+                batch.commit()
+            return {}
+        except Exception:
+            failures = {}
+            for user_id, doc_ref, fields in chunk:
+                try:
+                    doc_ref.update(fields)
+                except Exception as e:
+                    failures[user_id] = str(e)
+            return failures
+
+    def flush(self):
+        """
+        Write every queued update in batches of batch_size, including held moves down whose
+        dwell time has passed.
+
+        Returns:
+            dict: user_id -> error message for writes that failed (they stay queued until
+                  they have failed max_attempts times); always empty with a write_queue
+        """
+        if self._held:
+            self._release_held(self.clock())
+        if not self._pending:
+            return {}
+        pending = [(user_id, doc_ref, fields) for user_id, (doc_ref, fields) in self._pending.items()]
+        self._pending = {}
+        if self.write_queue is not None:
+            for _, doc_ref, fields in pending:
+                self.write_queue.update(doc_ref, fields)
+            METRICS.set_gauge('coalescer_pending', 0)
+            return {}
+        failures = {}
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            chunk_failures = self._commit(chunk)
+            failures.update(chunk_failures)
+            METRICS.inc('firestore_writes_total', len(chunk) - len(chunk_failures), source='coalescer')
+
+        for user_id, doc_ref, fields in pending:
+            if user_id not in failures:
+                self._attempts.pop(user_id, None)
+                continue
+            METRICS.inc('firestore_errors_total', source='coalescer')
+            attempts = self._attempts.get(user_id, 0) + 1
+            if attempts >= self.max_attempts:
+                # Forget the user's written state too, so their next recalculation is written in full
+                self._attempts.pop(user_id, None)
+                self._written.pop(user_id, None)
+            else:
+                self._attempts[user_id] = attempts
+                self._pending[user_id] = (doc_ref, fields)
+        METRICS.set_gauge('coalescer_pending', len(self._pending))
+        return failures
+
+    def stats(self):
+        """Return how many recalculations were submitted and how many of them needed no write."""
+        return {
+            'submitted': self.submitted,
+            'skipped': self.skipped,
+            'pending': len(self._pending),
+            'skip_rate': self.skipped / self.submitted if self.submitted else 0.0
+        }
@@ -0,0 +1,391 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+try:
+    from .monitor_metrics import METRICS, RateLimitedLogger
+except ImportError:
+    from monitor_metrics import METRICS, RateLimitedLogger
+
+SEGMENT_SUFFIX = '.wal'
+# Firestore errors that retrying cannot fix (google.api_core.exceptions names; matched by
+# name so the queue does not import the Google client and test fakes can raise them)
+PERMANENT_ERRORS = frozenset({'NotFound', 'InvalidArgument', 'PermissionDenied', 'FailedPrecondition'})
+
+
+def is_permanent_error(error):
+    """True if error (or one of its base classes) is a Firestore error that retrying cannot fix."""
+    return any(cls.__name__ in PERMANENT_ERRORS for cls in type(error).__mro__)
+
+
+class DurableWriteQueue:
+    """
+    Firestore writes that survive errors, slow requests and crashes.
+
+    set()/update() append the write to an on-disk write-ahead log and hand it to a
+    background worker, so the calling loop never waits on the network. The worker commits
+    writes in order, in batches of up to batch_size. A failed batch is retried with
+    exponential backoff and full jitter until it goes through:
+
+        - a permanent error (NotFound, InvalidArgument, PermissionDenied,
+          FailedPrecondition, e.g. an update to a user deleted after it was queued) makes
+          the batch go one write at a time straight away, and the writes that fail
+          permanently are moved to the dead-letter file (dead_letters.jsonl)
+        - every max_attempts failures the batch is also tried one write at a time; if some
+          writes succeed, the ones that still fail are bad documents rather than an outage
+          and are dead-lettered too
+        - if they all fail the backend is down, and the writes keep being retried; a
+          single write that has failed max_single_failures times is dead-lettered so it
+          cannot hold up the queue forever
+
+    At most max_pending writes are held in memory; set()/update() block when the worker
+    is that far behind (backpressure). The log is kept in segment files next to an ack
+    file holding the last committed sequence number; fully committed segments are deleted.
+    Writes the log holds past the ack (left over from a crash or an unfinished close) are
+    replayed when the queue is opened again.
+
+    The log is flushed to the OS on every write, which survives a crash of the process;
+    pass fsync=True to also survive power loss (slower). One process per directory.
+    """
+
+    def __init__(self, client, directory, name='writes', batch_size=500, max_pending=10000, max_attempts=5,
+                 base_delay=0.5, max_delay=60.0, segment_bytes=4 * 1024 * 1024, fsync=False, sentinels=None,
+                 max_single_failures=50):
+        """
+        Args:
+            client: Firestore client; documents are addressed as client.document(path)
+            directory: Where the log, ack and dead-letter files live (created if missing)
+            name: Label for metrics and console messages
+            batch_size: Writes per batch commit (Firestore allows at most 500)
+            max_pending: Writes held in memory before set()/update() block
+            max_attempts: Failed commits of a batch before its writes are tried one by one
+            base_delay: Backoff after the first failure, doubled per failure up to max_delay
+            segment_bytes: Size at which the log moves on to a new segment file
+            fsync: fsync the log on every write
+            sentinels: dict of name -> special field value (e.g. firestore.SERVER_TIMESTAMP)
+                       that cannot be stored as JSON; they are logged by name
+            max_single_failures: Failures after which a batch of one write is dead-lettered
+                                 even if the error looks transient
+        """
+        self.client = client
+        self.directory = directory
+        self.name = name
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.max_single_failures = max_single_failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.sentinels = dict(sentinels or {})
+        self._sentinel_names = {id(value): key for key, value in self.sentinels.items()}
+        self.dead_letter_path = os.path.join(directory, 'dead_letters.jsonl')
+        self._ack_path = os.path.join(directory, 'ack')
+        self._log = RateLimitedLogger(interval=10.0)
+
+        self._append_lock = threading.Lock()
+        self._segments_lock = threading.Lock()
+        self._acked_changed = threading.Condition()
+        self._capacity = threading.Semaphore(max_pending)
+        self._items = queue.Queue()  # (seq, op), in log order
+        self._closing = threading.Event()
+        self._abort = threading.Event()
+        self.dead_letters = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._acked = self._read_ack()
+        self._segments = []  # [first_seq, path], oldest first
+        recovered = self._recover()
+        self._seq = max([self._acked] + [seq for seq, _ in recovered] + [first - 1 for first, _ in self._segments])
+        self._file = None
+        self._open_segment(self._seq + 1)
+
+        self._worker = threading.Thread(target=self._run, name=f'{name}-write-queue', daemon=True)
+        self._worker.start()
+        if recovered:
+            print(f"[{name}] Replaying {len(recovered)} writes left in the write-ahead log")
+            for item in recovered:
+                self._capacity.acquire()
+                self._items.put(item)
+        self._update_gauge()
+
+    # --- log files ---
+
+    def _read_ack(self):
+        try:
+            with open(self._ack_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_ack(self, seq):
+        tmp_path = self._ack_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(seq))
+        os.replace(tmp_path, self._ack_path)
+
+    def _recover(self):
+        """Load the segments on disk; return the (seq, op) entries that were never acked."""
+        recovered = []
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            self._segments.append([int(name[:-len(SEGMENT_SUFFIX)]), path])
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn last line from a crash mid-write
+                    if entry['seq'] > self._acked:
+                        recovered.append((entry['seq'], entry))
+        return recovered
+
+    def _open_segment(self, first_seq):
+        path = os.path.join(self.directory, f'{first_seq:020d}{SEGMENT_SUFFIX}')
+        if self._file is not None:
+            self._file.close()
+        self._file = open(path, 'a', encoding='utf-8')
+        with self._segments_lock:
+            if not self._segments or self._segments[-1][1] != path:
+                self._segments.append([first_seq, path])
+
+    def _drop_committed_segments(self):
+        """Delete segments whose every entry is at or below the ack (never the one being written)."""
+        with self._segments_lock:
+            while len(self._segments) > 1 and self._segments[1][0] - 1 <= self._acked:
+                _, path = self._segments.pop(0)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _encode_value(self, value):
+        name = self._sentinel_names.get(id(value))
+        return {'$sentinel': name} if name is not None else value
+
+    def _decode_fields(self, fields):
+        return {key: self.sentinels[value['$sentinel']] if isinstance(value, dict) and '$sentinel' in value else value
+                for key, value in fields.items()}
+
+    # --- producer side ---
+
+    def _submit(self, op, doc_ref, fields, merge=False, timeout=None):
+        if self._closing.is_set():
+            raise RuntimeError(f"write queue {self.name} is closed")
+        if not self._capacity.acquire(blocking=False):
+            start = time.perf_counter()
+            if not self._capacity.acquire(timeout=timeout):
+                raise queue.Full(f"write queue {self.name} is full")
+            METRICS.observe('write_queue_backpressure_seconds', time.perf_counter() - start, queue=self.name)
+        entry = {'op': op, 'path': doc_ref.path, 'merge': merge,
+                 'fields': {key: self._encode_value(value) for key, value in fields.items()}}
+        with self._append_lock:
+            entry['seq'] = self._seq + 1
+            try:
+                line = json.dumps(entry) + '\n'
+            except TypeError:
+                self._capacity.release()
+                raise
+            self._seq += 1
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._items.put((self._seq, entry))
+            if self._file.tell() >= self.segment_bytes:
+                self._open_segment(self._seq + 1)
+        self._update_gauge()
+        return entry['seq']
+
+    def set(self, doc_ref, fields, merge=False, timeout=None):
+        """
+        Queue doc_ref.set(fields, merge=merge).
+
+        Args:
+            timeout: Seconds to wait for room when max_pending writes are queued (None:
+                     wait as long as it takes); raises queue.Full when it runs out
+
+        Returns:
+            int: Sequence number of the write (see flush)
+        """
+        return self._submit('set', doc_ref, fields, merge, timeout)
+
+    def update(self, doc_ref, fields, timeout=None):
+        """Queue doc_ref.update(fields). See set()."""
+        return self._submit('update', doc_ref, fields, timeout=timeout)
+
+    def pending(self):
+        """Writes logged but not yet committed (or dead-lettered)."""
+        return self._seq - self._acked
+
+    def is_done(self, seq):
+        """True once the write with this sequence number has been committed or dead-lettered."""
+        return seq <= self._acked
+
+    def read_dead_letters(self, after_seq=0):
+        """
+        Dead-lettered writes with a sequence number above after_seq, oldest first.
+
+        Returns:
+            list: Logged write entries (seq, op, path, fields, ...) with the 'error' they failed with
+        """
+        try:
+            with open(self.dead_letter_path, encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return [entry for entry in entries if entry['seq'] > after_seq]
+
+    def _update_gauge(self):
+        METRICS.set_gauge('write_queue_pending', self.pending(), queue=self.name)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every write queued so far has been committed (or dead-lettered).
+
+        Returns:
+            bool: False if the timeout ran out first
+        """
+        target = self._seq
+        with self._acked_changed:
+            return self._acked_changed.wait_for(lambda: self._acked >= target, timeout)
+
+    def close(self, timeout=30.0):
+        """
+        Stop accepting writes, give the worker up to timeout seconds to drain the queue and stop it.
+
+        Whatever is still uncommitted stays in the log and is replayed next time.
+
+        Returns:
+            int: Number of writes left in the log
+        """
+        self._closing.set()
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            self._abort.set()
+            self._worker.join(5.0)
+        with self._append_lock:
+            self._file.close()
+        left = self.pending()
+        if left:
+            print(f"[{self.name}] {left} writes left in {self.directory}; they will be replayed on the next start")
+        return left
+
+    # --- worker side ---
+
+    def _next_batch(self):
+        try:
+            batch = [self._items.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._items.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _document(self, entry):
+        return self.client.document(entry['path'])
+
+    def _apply(self, target, entry):
+        fields = self._decode_fields(entry['fields'])
+        if entry['op'] == 'set':
+            target.set(self._document(entry), fields, merge=entry['merge'])
+        else:
+            target.update(self._document(entry), fields)
+
+    def _commit(self, batch):
+        write_batch = self.client.batch()
+        for _, entry in batch:
+            self._apply(write_batch, entry)
+        with METRICS.timer('firestore_write_seconds', source=self.name):
+            write_batch.commit()
+
+    def _commit_singly(self, batch):
+        """Commit each write on its own; return the (seq, entry, error) that failed."""
+        failed = []
+        for seq, entry in batch:
+            doc_ref = self._document(entry)
+            fields = self._decode_fields(entry['fields'])
+            try:
+                if entry['op'] == 'set':
+                    doc_ref.set(fields, merge=entry['merge'])
+                else:
+                    doc_ref.update(fields)
+            except Exception as e:
+                failed.append((seq, entry, e))
+        return failed
+
+    def _dead_letter(self, failed):
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            for _, entry, error in failed:
+                f.write(json.dumps(dict(entry, error=f"{type(error).__name__}: {error}")) + '\n')
+        self.dead_letters += len(failed)
+        METRICS.inc('write_queue_dead_letters_total', len(failed), queue=self.name)
+        self._log.log('dead_letter', f"[{self.name}] {len(failed)} writes failed on their own and were moved to "
+                                     f"{self.dead_letter_path} (first: {failed[0][1]['path']}: {failed[0][2]})")
+
+    def _commit_with_retry(self, batch):
+        """
+        Commit a batch, retrying with backoff, until every write is committed or dead-lettered.
+
+        Returns False if close() gave up on it.
+        """
+        failures = 0
+        while True:
+            try:
+                self._commit(batch)
+                METRICS.inc('firestore_writes_total', len(batch), source=self.name)
+                return True
+            except Exception as e:
+                failures += 1
+                METRICS.inc('firestore_errors_total', source=self.name)
+                error = e
+            if is_permanent_error(error) or failures % self.max_attempts == 0:
+                failed = self._commit_singly(batch)
+                if len(failed) < len(batch):
+                    METRICS.inc('firestore_writes_total', len(batch) - len(failed), source=self.name)
+                    if failed:
+                        # Others went through, so these are bad writes rather than an outage
+                        self._dead_letter(failed)
+                    return True
+                transient = [item for item in failed if not is_permanent_error(item[2])]
+                if len(transient) < len(failed):
+                    self._dead_letter([item for item in failed if is_permanent_error(item[2])])
+                    if not transient:
+                        return True
+                    batch = [(seq, entry) for seq, entry, _ in transient]
+                    error = transient[-1][2]
+            if len(batch) == 1 and failures >= self.max_single_failures:
+                self._dead_letter([(batch[0][0], batch[0][1], error)])
+                return True
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** min(failures - 1, 30)))
+            METRICS.inc('write_queue_retries_total', queue=self.name)
+            self._log.log('retry', f"[{self.name}] Batch of {len(batch)} writes failed ({failures}x): {error}; "
+                                   f"retrying in {delay:.1f}s ({self.pending()} writes pending)")
+            if self._abort.wait(delay):
+                return False
+
+    def _run(self):
+        while not self._abort.is_set():
+            batch = self._next_batch()
+            if not batch:
+                if self._closing.is_set():
+                    return
+                continue
+            if not self._commit_with_retry(batch):
+                return
+            with self._acked_changed:
+                self._acked = batch[-1][0]
+                self._write_ack(self._acked)
+                self._acked_changed.notify_all()
+            for _ in batch:
+                self._capacity.release()
+            self._drop_committed_segments()
+            self._update_gauge()
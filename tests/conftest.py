@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The in-memory Firestore fake lives with the benchmarks
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
@@ -0,0 +1,56 @@
+import time
+
+from fake_firestore import FakeFirestore
+from riskCalculation import calc
+from riskCalculation.write_queue import DurableWriteQueue
+
+
+def _client(user_ids):
+    return FakeFirestore(data={
+        'uv_intensity': {'default_location': {'value': 50}},
+        'users': {user_id: {'skinToneIndex': 3, 'age': '30', 'conditionSeverity': 1,
+                            'location': 'default_location'} for user_id in user_ids},
+    })
+
+
+def _queue(client, directory):
+    return DurableWriteQueue(client, str(directory), name='backfill', base_delay=0.01, max_delay=0.05,
+                             max_attempts=2)
+
+
+def test_bulk_reports_failed_writes_and_honors_batch_size():
+    client = _client([f"user-{i}" for i in range(10)])
+    client.fail_ids = {'user-3'}
+    summary = calc.add_risk_categories_to_users(bulk=True, batch_size=4, commit_concurrency=2, client=client)
+    assert set(summary['failed']) == {'user-3'}
+    assert summary['updated'] == 9
+    assert 'final_risk_category' in client.data['users']['user-0']
+
+
+def test_queued_backfill_reports_dead_lettered_users(tmp_path):
+    client = _client(['a', 'b', 'c'])
+    client.fail_ids = {'b'}
+    write_queue = _queue(client, tmp_path)
+    try:
+        summary = calc.add_risk_categories_to_users(client=client, write_queue=write_queue, flush_timeout=10)
+    finally:
+        write_queue.close()
+    assert set(summary['failed']) == {'b'}
+    assert 'injected write failure' in summary['failed']['b']
+    assert summary['updated'] == 2
+
+
+def test_queued_backfill_gives_up_waiting_during_an_outage(tmp_path):
+    client = _client(['a', 'b'])
+    client.fail_ids = {'a', 'b'}
+    write_queue = _queue(client, tmp_path)
+    start = time.perf_counter()
+    try:
+        summary = calc.add_risk_categories_to_users(bulk=True, client=client, write_queue=write_queue,
+                                                    flush_timeout=0.3)
+    finally:
+        left = write_queue.close(timeout=0.1)
+    assert time.perf_counter() - start < 10
+    assert set(summary['failed']) == {'a', 'b'}
+    assert all('not committed' in error for error in summary['failed'].values())
+    assert left == 2  # kept in the log for the next run
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Seconds importing riskCalculation.calc may take in a fresh interpreter (about 0.06s today)
+IMPORT_BUDGET_SECONDS = 0.5
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import riskCalculation.calc
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'modules': sorted(sys.modules)}))
+"""
+
+
+def _import_in_subprocess():
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], cwd=REPO_ROOT)
+    return json.loads(output)
+
+
+def test_import_loads_no_firebase_or_numpy():
+    modules = _import_in_subprocess()['modules']
+    heavy = [name for name in modules if name.split('.')[0] in ('firebase_admin', 'google', 'numpy')]
+    assert heavy == []
+
+
+def test_import_does_not_initialize_firestore():
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import riskCalculation.calc as calc; print(calc._db is None)'], cwd=REPO_ROOT)
+    assert output.strip() == b'True'
+
+
+def test_import_time_within_budget():
+    # Best of three so one slow start on a busy machine does not fail the test
+    seconds = min(_import_in_subprocess()['seconds'] for _ in range(3))
+    assert seconds < IMPORT_BUDGET_SECONDS, f"importing riskCalculation.calc took {seconds:.3f}s"
@@ -0,0 +1,85 @@
+import collections
+import random
+from array import array
+
+from riskCalculation import calc
+from riskCalculation.user_registry import UserRegistry
+
+LOCATIONS = ['a', 'b', 'c']
+
+
+def _registry(users, start):
+    registry = UserRegistry()
+    for user_id, (phototype, age, severity, location) in users.items():
+        registry.add(user_id, calc.get_baseline_code(phototype, age, severity), location, 0, start)
+    return registry
+
+
+def _run(users, ticks, start=0.0):
+    """
+    Recalculate the same users by scanning every row and through compact_monitor_visits.
+
+    Args:
+        ticks: list of (seconds since start, {location: reading})
+
+    Yields:
+        (full scan results, compact results) per tick, each row -> recalculation result
+    """
+    full, compact = _registry(users, start), _registry(users, start)
+    indexes = calc.build_uv_delta_indexes(compact)
+    previous_readings = [0] * len(compact.locations)
+    timers = collections.deque([(start, array('I', range(len(compact))))])
+    for tick, (offset, by_location) in enumerate(ticks):
+        now = start + offset
+        readings = [by_location[location] for location in compact.locations]
+        full_results = {}
+        for row in range(len(full)):
+            result = calc.recalculate_registry_user(full, row, readings[full.location_id[row]], now)
+            if result:
+                full_results[row] = result
+        if tick == 0:
+            visits = range(len(compact))
+        else:
+            visits = calc.compact_monitor_visits(compact, indexes, previous_readings, readings, timers, now)
+        previous_readings = readings
+        compact_results = {}
+        recalculated = array('I')
+        for row in visits:
+            current_uv = readings[compact.location_id[row]]
+            result = calc.recalculate_registry_user(compact, row, current_uv, now)
+            if result:
+                indexes[compact.location_id[row]].set(row, current_uv)
+                recalculated.append(row)
+                compact_results[row] = result
+        if recalculated:
+            timers.append((now, recalculated))
+        yield full_results, compact_results
+
+
+def test_move_that_keeps_the_category_still_resets_the_reference():
+    users = {'u': (1, 80, 5, 'a')}
+    ticks = [(second, {'a': uv}) for second, uv in enumerate([100, 210, 120, 80])]
+    categories = []
+    for full_results, compact_results in _run(users, ticks):
+        assert compact_results == full_results
+        categories.extend(result['Risk Category'] for result in full_results.values())
+    assert categories[-1] == 'High'
+
+
+def test_compact_visits_recalculate_what_a_full_scan_does():
+    rng = random.Random(20)
+    users = {f"user-{i}": (rng.randint(1, 6), rng.choice([15, 25, 40, 60, 80]), rng.randint(0, 5),
+                           rng.choice(LOCATIONS))
+             for i in range(300)}
+    readings = {location: 0 for location in LOCATIONS}
+    ticks = []
+    for tick in range(400):
+        for location in LOCATIONS:
+            if rng.random() < 0.5:
+                readings[location] = min(165, max(0, readings[location] + rng.randint(-80, 80)))
+        ticks.append((tick * 30.0, dict(readings)))  # 400 ticks 30 s apart: timers fire too
+    recalculated = 0
+    for full_results, compact_results in _run(users, ticks):
+        assert compact_results == full_results
+        recalculated += len(full_results)
+    assert recalculated > len(users)
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+
+from fake_firestore import FakeFirestore
+from riskCalculation import calc
+from riskCalculation.backfill_state import RUN_START_MARGIN, BackfillCheckpoint
+
+
+def _user(age, updated_at):
+    return {'skinToneIndex': 3, 'age': str(age), 'conditionSeverity': 1, 'location': 'default_location',
+            'updatedAt': updated_at}
+
+
+def test_full_scan_watermark_is_run_start(tmp_path, monkeypatch):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    start = datetime.now(timezone.utc)
+    client = FakeFirestore(data={
+        'uv_intensity': {'default_location': {'value': 50}},
+        'users': {
+            'a': _user(30, start - timedelta(days=2)),
+            # Written by a client whose clock is ahead, and read on a later page than a
+            'b': _user(40, start + timedelta(hours=1)),
+        }
+    })
+    backfill_page = calc._backfill_changed_users
+    pages = []
+
+    def edit_a_after_its_page(client_, users_docs, uv_by_location, stamp_time=None):
+        result = backfill_page(client_, users_docs, uv_by_location, stamp_time)
+        pages.append([user_doc.id for user_doc in users_docs])
+        if len(pages) == 1:
+            client.data['users']['a'].update(age='50', updatedAt=datetime.now(timezone.utc))
+        return result
+
+    monkeypatch.setattr(calc, '_backfill_changed_users', edit_a_after_its_page)
+    calc.add_risk_categories_incremental(page_size=1, checkpoint_path=checkpoint_path, client=client)
+    assert pages[:2] == [['a'], ['b']]
+
+    checkpoint = BackfillCheckpoint(checkpoint_path)
+    assert checkpoint.watermark <= start - RUN_START_MARGIN + timedelta(seconds=5)
+    assert checkpoint.run_started_at is None
+
+    # The next run picks up a's edit even though b's updatedAt is later
+    pages.clear()
+    summary = calc.add_risk_categories_incremental(page_size=10, checkpoint_path=checkpoint_path, client=client)
+    assert 'a' in pages[0]
+    assert summary['updated'] >= 1
+    assert client.data['users']['a']['risk_inputs_hash'] == calc.hash_risk_inputs(3, 50, 1, 'default_location', 50)
+
+
+def test_resumed_run_keeps_its_start_time(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    checkpoint = BackfillCheckpoint(path)
+    checkpoint.start_run(started)
+    checkpoint.advance(started + timedelta(days=3), 'a')
+    checkpoint.save()
+
+    resumed = BackfillCheckpoint(path)
+    resumed.start_run(started + timedelta(hours=5))
+    assert resumed.run_started_at == started
+    resumed.finish()
+    assert resumed.watermark == started - RUN_START_MARGIN
+
+
+def test_uv_change_rescores_the_locations_users(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    old = datetime.now(timezone.utc) - timedelta(days=2)
+    client = FakeFirestore(data={
+        'uv_intensity': {'default_location': {'value': 0}, 'beach': {'value': 0}},
+        'users': {'a': _user(30, old), 'b': dict(_user(30, old), location='beach')},
+    })
+    calc.add_risk_categories_incremental(checkpoint_path=checkpoint_path, client=client)
+    assert client.data['users']['a']['final_risk_category'] == 'Very Low'
+
+    # Nobody edited their profile, but the reading at the default location went up
+    client.data['uv_intensity']['default_location']['value'] = 165
+    summary = calc.add_risk_categories_incremental(checkpoint_path=checkpoint_path, client=client)
+    assert summary['updated'] == 1
+    assert client.data['users']['a']['final_risk_category'] != 'Very Low'
+    assert client.data['users']['b']['final_risk_category'] == 'Very Low'
+    assert BackfillCheckpoint(checkpoint_path).location_uv == {'default_location': 165, 'beach': 0}
+
+
+def test_users_without_updated_at_are_stamped_by_the_full_scan(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    legacy = _user(30, None)
+    del legacy['updatedAt']
+    client = FakeFirestore(data={
+        'uv_intensity': {'default_location': {'value': 50}},
+        'users': {'legacy': legacy},
+    })
+    calc.add_risk_categories_incremental(checkpoint_path=checkpoint_path, client=client)
+    stamped = client.data['users']['legacy']['updatedAt']
+    assert stamped <= BackfillCheckpoint(checkpoint_path).watermark
+
+    # Now that it has an updatedAt, a later edit is picked up
+    client.data['users']['legacy'].update(age='60', updatedAt=datetime.now(timezone.utc))
+    summary = calc.add_risk_categories_incremental(checkpoint_path=checkpoint_path, client=client)
+    assert summary['updated'] == 1
+    assert client.data['users']['legacy']['risk_inputs_hash'] == calc.hash_risk_inputs(3, 60, 1, 'default_location', 50)
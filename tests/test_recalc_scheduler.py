@@ -0,0 +1,60 @@
+from riskCalculation.recalc_scheduler import RecalculationScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_due_users_pop_in_deadline_order():
+    clock = Clock()
+    scheduler = RecalculationScheduler(clock=clock)
+    for user_id, due in [('c', 30), ('a', 10), ('b', 20), ('d', 40)]:
+        scheduler.schedule(user_id, due)
+    assert scheduler.next_due() == 10
+    clock.now = 25
+    assert scheduler.pop_due() == ['a', 'b']
+    assert 'a' not in scheduler and len(scheduler) == 2
+    assert scheduler.pop_due() == []  # popped users stay gone until rescheduled
+    assert scheduler.pop_due(now=100) == ['c', 'd']
+    assert scheduler.next_due() is None
+
+
+def test_rescheduling_moves_the_deadline():
+    clock = Clock()
+    scheduler = RecalculationScheduler(clock=clock)
+    scheduler.schedule('a', 10)
+    scheduler.schedule('b', 20)
+    scheduler.schedule('a', 50)  # later: the stale entry at 10 must be skipped
+    scheduler.schedule('b', 5)   # earlier
+    clock.now = 15
+    assert scheduler.pop_due() == ['b']
+    assert scheduler.next_due() == 50
+    clock.now = 50
+    assert scheduler.pop_due() == ['a']
+
+
+def test_discarded_users_never_come_due():
+    scheduler = RecalculationScheduler(clock=Clock())
+    scheduler.schedule_all(['a', 'b'], 10)
+    scheduler.discard('a')
+    assert scheduler.pop_due(now=10) == ['b']
+
+
+def test_stale_entries_are_compacted():
+    scheduler = RecalculationScheduler(clock=Clock())
+    for step in range(1000):
+        scheduler.schedule('a', step)
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 64
+    assert scheduler.pop_due(now=998) == []
+    assert scheduler.pop_due(now=999) == ['a']
+
+
+def test_changed_locations_reports_each_change_once():
+    scheduler = RecalculationScheduler(clock=Clock())
+    assert sorted(scheduler.changed_locations({'x': 50, 'y': 80})) == ['x', 'y']
+    assert scheduler.changed_locations({'x': 50, 'y': 80}) == []
+    assert scheduler.changed_locations({'x': 51, 'y': 80}) == ['x']
@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+import pytest
+
+from riskCalculation.calc import User, classify_final_ers
+from riskCalculation.risk_batch import (calculate_risk_scores_batch, category_labels, classify_ers_baseline_batch,
+                                        classify_ers_final_batch)
+
+# Scores inside the gaps between bands, where the scalar classifiers return None
+BASELINE_GAP_SCORES = [-0.1, 0.585, 1.165, 1.755, 2.345, 2.35]
+FINAL_GAP_SCORES = [1.155, 2.305, 3.455, 4.605, 4.61]
+
+
+def _scalar_row(phototype, age, severity, uv):
+    user = User(phototype, age, severity, uv_intensity=uv)
+    baseline = user.calculate_baseline_erythemal_risk_score()
+    final = user.calculate_final_erythemal_risk_score()
+    return baseline, final
+
+
+def _random_rows(count, seed):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        age = rng.choice([rng.randint(0, 100), rng.choice([19.5, 39.5, 59.5, 69.5])])
+        uv = rng.choice([0, 0, rng.randint(1, 1023), rng.uniform(0, 300)])
+        rows.append((rng.randint(1, 6), age, rng.randint(0, 5), uv))
+    return rows
+
+
+def _uv_for_final_score(phototype, age, severity, target):
+    """Reading that puts the user's final ERS at target (or as close as float rounding allows)."""
+    baseline = User(phototype, age, severity, uv_intensity=0).calculate_baseline_erythemal_risk_score()
+    return (target - baseline["Basline Risk Score"]) / 2.88 * 165
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_batch_matches_user_on_random_rows(seed):
+    rows = _random_rows(2000, seed)
+    # Readings that land the final score in every gap between final bands
+    for target in FINAL_GAP_SCORES:
+        rows.append((3, 30, 2, _uv_for_final_score(3, 30, 2, target)))
+    phototypes, ages, severities, uvs = (list(column) for column in zip(*rows))
+
+    batch = calculate_risk_scores_batch(phototypes, ages, severities, uvs)
+    baseline_labels = category_labels(batch["baseline_category"])
+    final_labels = category_labels(batch["final_category"])
+
+    for i, row in enumerate(rows):
+        baseline, final = _scalar_row(*row)
+        assert batch["ref"][i] == baseline["REF"]
+        assert batch["age_modifier"][i] == baseline["Age Modifier"]
+        assert batch["condition_modifier"][i] == baseline["Condition Modifier"]
+        assert batch["baseline_ers"][i] == pytest.approx(baseline["Basline Risk Score"], abs=1e-12)
+        assert baseline_labels[i] == baseline["Baseline Risk Category"], row
+        assert batch["uv_modifier"][i] == pytest.approx(final["UV Modifier"], abs=1e-12)
+        assert batch["final_ers"][i] == pytest.approx(final["ERS"], abs=1e-12)
+        assert final_labels[i] == final["Risk Category"], row
+
+
+def test_zero_uv_uses_fixed_modifier():
+    batch = calculate_risk_scores_batch([1, 6], [30, 80], [0, 5], [0, 0])
+    assert batch["uv_modifier"].tolist() == [-2.88, -2.88]
+    for i, row in enumerate([(1, 30, 0, 0), (6, 80, 5, 0)]):
+        _, final = _scalar_row(*row)
+        assert category_labels(batch["final_category"])[i] == final["Risk Category"]
+
+
+def test_gap_scores_have_no_category():
+    user = User(1, 30, 0, uv_intensity=0)
+    assert category_labels(classify_ers_baseline_batch(BASELINE_GAP_SCORES)) == \
+        [user.classify_ers_baseline(ers) for ers in BASELINE_GAP_SCORES]
+    assert category_labels(classify_ers_final_batch(FINAL_GAP_SCORES)) == \
+        [classify_final_ers(ers) for ers in FINAL_GAP_SCORES]
+    assert all(label is None for label in category_labels(classify_ers_final_batch(FINAL_GAP_SCORES)))
+
+
+def test_scalar_uv_is_broadcast():
+    batch = calculate_risk_scores_batch([1, 2, 3], [20, 40, 60], [0, 1, 2], 120)
+    assert np.allclose(batch["uv_modifier"], 120 / 165 * 2.88)
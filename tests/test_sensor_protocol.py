@@ -0,0 +1,51 @@
+from penapps_optSun.sensor_protocol import FrameDecoder, encode_frame
+
+
+def _frames(sequences):
+    return [encode_frame(sequence, 100 + sequence % 50, 2.5, sequence % 2) for sequence in sequences]
+
+
+def test_frames_split_at_every_byte_boundary():
+    stream = b''.join(_frames(range(5)))
+    for split in range(len(stream) + 1):
+        decoder = FrameDecoder()
+        samples = decoder.feed(stream[:split]) + decoder.feed(stream[split:])
+        assert [sample[0] for sample in samples] == [0, 1, 2, 3, 4]
+        assert samples[1] == (1, 101, 2.5, 1)
+        assert decoder.stats() == {'frames': 5, 'crc_errors': 0, 'resync_bytes': 0, 'dropped': 0}
+
+
+def test_resyncs_after_noise_and_a_corrupted_frame():
+    good, bad, after = _frames([1, 2, 3])
+    bad = bytearray(bad)
+    bad[7] ^= 0xFF  # flip payload bits so the CRC no longer matches
+    noise = b'\x00\xa5\x13\x37'
+    decoder = FrameDecoder()
+    samples = decoder.feed(noise + good + bytes(bad) + after)
+    assert [sample[0] for sample in samples] == [1, 3]
+    assert decoder.crc_errors == 1
+    # The noise plus every byte of the corrupted frame was skipped while resyncing
+    assert decoder.resync_bytes == len(noise) + len(bad)
+    assert decoder.dropped == 1  # frame 2 is counted as lost
+
+
+def test_trailing_half_magic_is_kept_for_the_next_read():
+    frame = _frames([7])[0]
+    decoder = FrameDecoder()
+    assert decoder.feed(b'\x01\x02' + frame[:1]) == []
+    assert decoder.feed(frame[1:]) == [(7, 107, 2.5, 1)]
+    assert decoder.resync_bytes == 2
+
+
+def test_sequence_gaps_count_lost_frames_across_wraparound():
+    decoder = FrameDecoder()
+    decoder.feed(b''.join(_frames([65533, 65534, 1, 2, 5])))
+    # 65535 and 0 are missing across the wrap, then 3 and 4
+    assert decoder.dropped == 4
+
+
+def test_counter_restart_is_not_counted_as_lost_frames():
+    decoder = FrameDecoder()
+    decoder.feed(b''.join(_frames([500, 501, 0, 1])))
+    assert decoder.dropped == 0
+    assert decoder.frames == 4
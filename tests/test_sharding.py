@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta, timezone
+
+from fake_firestore import FakeFirestore
+from riskCalculation import calc
+
+SHARDS = 4
+
+
+def _user(created_at):
+    return {'skinToneIndex': 3, 'age': '30', 'conditionSeverity': 1, 'location': 'default_location',
+            'createdAt': created_at}
+
+
+def _shard_rosters(client):
+    return [calc.start_live_roster(client, query=calc.shard_users_query(client, shard, SHARDS), timeout=1)
+            for shard in range(SHARDS)]
+
+
+def test_bucket_ranges_partition_the_buckets():
+    for shard_count in range(1, 10):
+        ranges = [calc.shard_bucket_range(shard, shard_count) for shard in range(shard_count)]
+        assert ranges[0][0] == 0 and ranges[-1][1] == calc.SHARD_BUCKETS
+        assert all(ranges[shard][1] == ranges[shard + 1][0] for shard in range(shard_count - 1))
+        for bucket in range(calc.SHARD_BUCKETS):
+            lo, hi = ranges[bucket * shard_count // calc.SHARD_BUCKETS]
+            assert lo <= bucket < hi
+
+
+def test_each_change_is_delivered_to_one_shard():
+    created = datetime.now(timezone.utc) - timedelta(days=1)
+    user_ids = [f"user-{i}" for i in range(200)]
+    client = FakeFirestore(data={'users': {user_id: _user(created) for user_id in user_ids}})
+    summary = calc.stamp_shard_buckets(client, client.collection('users').stream())
+    assert summary == {'stamped': 200, 'failed': {}}
+
+    # A restart of the supervisor reads every user again but rewrites none of them
+    client.reset_counters()
+    assert calc.stamp_shard_buckets(client, client.collection('users').stream()) == {'stamped': 0, 'failed': {}}
+    assert client.writes == 0
+
+    rosters = _shard_rosters(client)
+    for shard, (roster, _) in enumerate(rosters):
+        assert set(roster.users) == {user_id for user_id in user_ids if calc.shard_for(user_id, SHARDS) == shard}
+    assert sum(len(roster) for roster, _ in rosters) == 200
+    assert client.listen_reads == 200  # the initial snapshots: one read per user, not per user per shard
+
+    # The echo of a monitor write reaches only the shard that owns the user
+    client.reset_counters()
+    for user_id in user_ids[:50]:
+        client.document(f"users/{user_id}").update({'final_risk_category': 'Low'})
+    assert client.listen_reads == 50
+
+    # Listening to the whole collection from every shard is billed once per shard
+    for _, watch in rosters:
+        watch.unsubscribe()
+    watches = [client.collection('users').on_snapshot(lambda *args: None) for _ in range(SHARDS)]
+    client.reset_counters()
+    for user_id in user_ids[:50]:
+        client.document(f"users/{user_id}").update({'final_risk_category': 'Moderate'})
+    assert client.listen_reads == 50 * SHARDS
+    for watch in watches:
+        watch.unsubscribe()
+
+
+def test_new_users_are_stamped_into_their_shard():
+    start = datetime.now(timezone.utc)
+    client = FakeFirestore(data={'users': {'old': _user(start - timedelta(days=1))}})
+    calc.stamp_shard_buckets(client, client.collection('users').stream())
+    rosters = _shard_rosters(client)
+
+    stamped = []
+    watch = calc.watch_new_users(client, start - calc.NEW_USERS_MARGIN,
+                                 lambda docs: stamped.append(calc.stamp_shard_buckets(client, docs)['stamped']))
+    assert stamped == []  # the existing user is older than the window
+    client.put('users', 'new', _user(datetime.now(timezone.utc)))
+    assert sum(stamped) == 1
+
+    roster, _ = rosters[calc.shard_for('new', SHARDS)]
+    roster.apply_pending()
+    assert 'new' in roster.users
+
+    # The app's setData on sign-up replaces the whole document, dropping the bucket; it is stamped again
+    client.put('users', 'new', _user(datetime.now(timezone.utc)))
+    assert sum(stamped) == 2
+    assert client.data['users']['new'][calc.SHARD_FIELD] == calc.shard_bucket('new')
+    watch.unsubscribe()
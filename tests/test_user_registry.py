@@ -0,0 +1,15 @@
+import tracemalloc
+
+from riskCalculation.user_registry import UserRegistry
+
+
+def test_total_bytes_matches_what_the_registry_allocates():
+    tracemalloc.start()
+    registry = UserRegistry()
+    for i in range(20000):
+        # Firebase auth uids are 28 characters long
+        registry.add(f"uid{i:025d}", i % 180, f"location_{i % 10}", 0, 0.0)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert abs(registry.total_bytes() - allocated) < 0.1 * allocated
+    assert registry.nbytes() < 0.2 * registry.total_bytes()  # the columns are the small part
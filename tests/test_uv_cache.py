@@ -0,0 +1,82 @@
+from fake_firestore import FakeFirestore
+from riskCalculation.uv_cache import DEFAULT_UV_INTENSITY, UVCache
+
+
+class OutageFirestore(FakeFirestore):
+    """FakeFirestore whose round trips fail while down is set (every attempt is still counted)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.down = False
+        self.attempts = 0
+
+    def _round_trip(self, reads=0, writes=0):
+        self.attempts += 1
+        if self.down:
+            raise RuntimeError("Firestore unavailable")
+        super()._round_trip(reads, writes)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _locations(count):
+    return {f'location_{i}': {'value': 50 + i} for i in range(count)}
+
+
+def test_each_location_read_once_per_tick():
+    client = OutageFirestore(data={'uv_intensity': _locations(10)})
+    clock = Clock()
+    cache = UVCache(client, ttl=0.5, clock=clock)
+    for _ in range(3):
+        cache.prefetch(_locations(10))
+        for _ in range(100):
+            for location in _locations(10):
+                cache.get(location)
+        clock.now += 1.0
+    assert client.attempts == 3
+    assert cache.get('location_3') == 53
+
+
+def test_failed_prefetch_is_not_retried_per_lookup():
+    client = OutageFirestore(data={'uv_intensity': _locations(1000)})
+    clock = Clock()
+    cache = UVCache(client, ttl=0.5, clock=clock)
+    cache.prefetch(_locations(1000))
+    clock.now += 1.0
+    client.down = True
+    cache.prefetch(_locations(1000))
+    values = [cache.get(location) for location in _locations(1000)]
+    assert client.attempts == 2
+    assert values == [50 + i for i in range(1000)]  # last known readings
+    # The next tick tries Firestore again
+    clock.now += 1.0
+    client.down = False
+    cache.prefetch(_locations(1000))
+    assert client.attempts == 3
+
+
+def test_failed_get_falls_back_once_per_tick():
+    client = OutageFirestore(data={'uv_intensity': _locations(1)})
+    client.down = True
+    cache = UVCache(client, ttl=0.5, clock=Clock())
+    assert [cache.get('location_0') for _ in range(50)] == [DEFAULT_UV_INTENSITY] * 50
+    assert client.attempts == 1
+
+
+def test_read_errors_share_one_rate_limit_with_calc(capsys, monkeypatch):
+    from riskCalculation import calc, uv_cache
+
+    monkeypatch.setattr(uv_cache.status_log, '_last', {})
+    monkeypatch.setattr(uv_cache.status_log, '_suppressed', {})
+    client = OutageFirestore(data={'uv_intensity': _locations(1)})
+    client.down = True
+    UVCache(client, ttl=0.5, clock=Clock()).get('location_0')
+    calc.get_uv_intensity_from_firebase('location_0', client=client)
+    assert calc.status_log is uv_cache.status_log
+    assert capsys.readouterr().out.count("Error") == 1
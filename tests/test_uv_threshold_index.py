@@ -0,0 +1,59 @@
+import random
+
+from riskCalculation import calc
+from riskCalculation.uv_threshold_index import UVDeltaIndex, UVThresholdIndex
+
+
+def _index(users):
+    index = UVThresholdIndex(calc.final_category_breakpoints, calc.registry_final_category)
+    for user_id, code in users.items():
+        index.add(user_id, code)
+    return index
+
+
+def _reclassify(users, old_uv, new_uv):
+    return {user_id for user_id, code in users.items()
+            if calc.registry_final_category(code, old_uv) != calc.registry_final_category(code, new_uv)}
+
+
+def test_changed_matches_a_full_reclassification_across_breakpoints():
+    codes = range(len(calc.BASELINE_TABLE))
+    users = {f"user-{code}-{copy}": code for code in codes for copy in range(2)}
+    index = _index(users)
+    # Readings on and just either side of every breakpoint, plus the whole sensor range
+    readings = set(range(0, 166))
+    for code in codes:
+        for breakpoint in calc.final_category_breakpoints(code):
+            readings.update((breakpoint, breakpoint - 1e-9, breakpoint + 1e-9))
+    readings = sorted(reading for reading in readings if 0 <= reading <= 165)
+    rng = random.Random(0)
+    pairs = [(readings[i], readings[i + 1]) for i in range(len(readings) - 1)]
+    pairs += [(rng.choice(readings), rng.choice(readings)) for _ in range(2000)]
+    for old_uv, new_uv in pairs:
+        assert set(index.changed(old_uv, new_uv)) == _reclassify(users, old_uv, new_uv), (old_uv, new_uv)
+        assert set(index.changed(new_uv, old_uv)) == _reclassify(users, new_uv, old_uv)
+
+
+def test_moving_and_removing_users():
+    users = {'a': 0, 'b': len(calc.BASELINE_TABLE) - 1}
+    index = _index(users)
+    index.add('a', users['b'])  # same baseline as b now
+    index.remove('b')
+    users = {'a': len(calc.BASELINE_TABLE) - 1}
+    for old_uv, new_uv in [(0, 165), (40, 120), (165, 0)]:
+        assert set(index.changed(old_uv, new_uv)) == _reclassify(users, old_uv, new_uv)
+    assert len(index) == 1
+
+
+def test_delta_index_finds_readings_at_least_delta_away():
+    rng = random.Random(1)
+    last = {f"user-{i}": rng.choice([0, 50, 99.5, 100, 150, 165]) for i in range(200)}
+    index = UVDeltaIndex(100)
+    for user_id, reading in last.items():
+        index.set(user_id, reading)
+    for reading in [0, 0.5, 50, 99.5, 100, 150, 165, 199.5, 200]:
+        assert set(index.due(reading)) == {user_id for user_id, value in last.items()
+                                           if abs(reading - value) >= 100}
+    index.set('user-0', 165)
+    index.remove('user-1')
+    assert 'user-1' not in index.due(0) and len(index) == 199
@@ -0,0 +1,71 @@
+from fake_firestore import FakeFirestore
+from riskCalculation import calc
+from riskCalculation.recalc_scheduler import RecalculationScheduler
+from riskCalculation.write_coalescer import WriteCoalescer
+
+HIGH_ERS, LOW_ERS = 4.0, 1.5
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _coalescer(client, clock):
+    return WriteCoalescer(client, calc.classify_final_ers, hysteresis=0.1, min_dwell=60, refresh_interval=900,
+                          clock=clock)
+
+
+def test_held_move_down_is_written_once_the_dwell_time_passes():
+    client = FakeFirestore(data={'users': {'u': {}}})
+    clock = Clock()
+    coalescer = _coalescer(client, clock)
+    doc_ref = client.document('users/u')
+    assert coalescer.submit('u', doc_ref, HIGH_ERS, {})
+    coalescer.flush()
+    assert client.data['users']['u']['final_risk_category'] == 'High'
+
+    clock.now += 10
+    assert not coalescer.submit('u', doc_ref, LOW_ERS, {'current_uv_intensity': 20})
+    assert coalescer.held_until('u') == 1060.0
+
+    # No further recalculation of the user: the flushes alone release the held move
+    clock.now += 20
+    coalescer.flush()
+    assert client.data['users']['u']['final_risk_category'] == 'High'
+    clock.now = 1060.0
+    coalescer.flush()
+    assert client.data['users']['u'] == {'final_risk_category': 'Low', 'current_uv_intensity': 20}
+    assert coalescer.held_until('u') is None
+
+
+def test_newer_score_replaces_a_held_one():
+    client = FakeFirestore(data={'users': {'u': {}}})
+    clock = Clock()
+    coalescer = _coalescer(client, clock)
+    doc_ref = client.document('users/u')
+    coalescer.submit('u', doc_ref, HIGH_ERS, {})
+    coalescer.submit('u', doc_ref, LOW_ERS, {})
+    assert coalescer.submit('u', doc_ref, 4.2, {}) is False  # back up within the band
+    assert coalescer.held_until('u') is None
+    clock.now += 120
+    coalescer.flush()
+    assert client.data['users']['u']['final_risk_category'] == 'High'
+
+
+def test_scheduler_visits_a_user_when_their_held_move_becomes_eligible():
+    client = FakeFirestore(data={'users': {'u': {}}})
+    clock = Clock()
+    coalescer = _coalescer(client, clock)
+    scheduler = RecalculationScheduler(clock=clock)
+    user = calc.User(3, 30, 1, uv_intensity=0)
+    user.last_calculation_time = clock.now
+    coalescer.submit('u', client.document('users/u'), HIGH_ERS, {})
+    coalescer.submit('u', client.document('users/u'), LOW_ERS, {})
+    calc.schedule_next_check(scheduler, 'u', user, clock.now, coalescer)
+    assert scheduler.next_due() == 1060.0
+    calc.schedule_next_check(scheduler, 'u', user, clock.now)
+    assert scheduler.next_due() == 1000.0 + calc.RECALCULATION_INTERVAL
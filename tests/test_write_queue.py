@@ -0,0 +1,93 @@
+import json
+import os
+
+from fake_firestore import FakeFirestore
+from riskCalculation.write_queue import DurableWriteQueue, is_permanent_error
+
+
+def _queue(client, directory, **kwargs):
+    kwargs.setdefault('base_delay', 0.01)
+    kwargs.setdefault('max_delay', 0.05)
+    return DurableWriteQueue(client, str(directory), name='test', **kwargs)
+
+
+def _dead_letters(queue):
+    if not os.path.exists(queue.dead_letter_path):
+        return []
+    with open(queue.dead_letter_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_writes_are_committed(tmp_path):
+    client = FakeFirestore(data={'users': {'a': {'x': 0}}})
+    queue = _queue(client, tmp_path)
+    queue.set(client.document('users/b'), {'x': 1})
+    queue.update(client.document('users/a'), {'x': 2})
+    assert queue.flush(timeout=5)
+    assert queue.close() == 0
+    assert client.data['users'] == {'a': {'x': 2}, 'b': {'x': 1}}
+
+
+def test_update_of_deleted_document_does_not_block_the_queue(tmp_path):
+    client = FakeFirestore(data={'users': {'a': {'x': 0}}})
+    queue = _queue(client, tmp_path)
+    queue.update(client.document('users/gone'), {'x': 1})  # user deleted after the write was queued
+    queue.flush(timeout=5)
+    queue.update(client.document('users/a'), {'x': 2})
+    assert queue.flush(timeout=5)
+    assert queue.pending() == 0
+    assert client.data['users']['a'] == {'x': 2}
+    letters = _dead_letters(queue)
+    assert [letter['path'] for letter in letters] == ['users/gone']
+    assert letters[0]['error'].startswith('NotFound')
+    assert queue.close() == 0
+
+
+def test_permanent_failures_in_a_batch_are_dead_lettered_alone(tmp_path):
+    client = FakeFirestore(data={'users': {'a': {'x': 0}}})
+    queue = _queue(client, tmp_path, max_attempts=1000)
+    client.fail_ids.add('a')  # hold the worker until every write is queued
+    queue.update(client.document('users/a'), {'x': 1})
+    queue.update(client.document('users/gone'), {'x': 1})
+    queue.set(client.document('users/b'), {'x': 1})
+    client.fail_ids.clear()
+    assert queue.flush(timeout=5)
+    assert [letter['path'] for letter in _dead_letters(queue)] == ['users/gone']
+    assert client.data['users'] == {'a': {'x': 1}, 'b': {'x': 1}}
+    queue.close()
+
+
+def test_single_write_that_keeps_failing_is_dead_lettered(tmp_path):
+    client = FakeFirestore(data={'users': {'a': {'x': 0}}})
+    client.fail_ids.add('a')  # transient-looking error on every attempt
+    queue = _queue(client, tmp_path, max_single_failures=3)
+    queue.update(client.document('users/a'), {'x': 1})
+    assert queue.flush(timeout=5)
+    assert [letter['path'] for letter in _dead_letters(queue)] == ['users/a']
+    queue.close()
+
+
+def test_stuck_write_is_not_replayed_after_restart(tmp_path):
+    client = FakeFirestore(data={'users': {'a': {'x': 0}}})
+    queue = _queue(client, tmp_path)
+    queue.update(client.document('users/gone'), {'x': 1})
+    assert queue.flush(timeout=5)
+    queue.close()
+    reopened = _queue(client, tmp_path)
+    assert reopened.pending() == 0
+    reopened.update(client.document('users/a'), {'x': 3})
+    assert reopened.flush(timeout=5)
+    assert client.data['users']['a'] == {'x': 3}
+    reopened.close()
+
+
+def test_error_classification():
+    class NotFound(Exception):
+        pass
+
+    class ServiceUnavailable(Exception):
+        pass
+
+    assert is_permanent_error(NotFound('missing'))
+    assert not is_permanent_error(ServiceUnavailable('down'))
+    assert not is_permanent_error(RuntimeError('injected'))
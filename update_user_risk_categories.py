@@ -4,6 +4,7 @@ Script to update all existing users in the database with correct risk categories
 This fixes the issue where users have "Unknown" risk categories.
 """
 
+import argparse
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'riskCalculation'))
@@ -11,11 +12,24 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'riskCalculation'))
 from riskCalculation.calc import add_risk_categories_to_users
 
 def main():
+    parser = argparse.ArgumentParser(description="Backfill risk categories for all users.")
+    parser.add_argument('--bulk', action='store_true',
+                        help="score users in one pass and write them with batched commits")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="updates per write batch in bulk mode (max 500)")
+    parser.add_argument('--commit-concurrency', type=int, default=4,
+                        help="batch commits in flight at once in bulk mode")
+    args = parser.parse_args()
+
     print("🔄 Updating risk categories for all users in the database...")
     print("=" * 60)
     
     try:
-        add_risk_categories_to_users()
+        summary = add_risk_categories_to_users(bulk=args.bulk, batch_size=args.batch_size,
+                                               commit_concurrency=args.commit_concurrency)
+        if summary and summary['failed']:
+            print(f"\n⚠️  Updated {summary['updated']} users, {len(summary['failed'])} failed.")
+            return 1
         print("\n✅ Successfully updated all users with correct risk categories!")
         print("🎉 All users should now have proper baseline_risk_category and final_risk_category values.")
         